@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+'''
+Benchmarks whole installs and uninstalls in a temporary root, without touching the system.
+
+The scripts are copied into the root with fake submodules, and every program they run is replaced
+by stub.py, so a run only depends on this repo. HOME points into the root and QUALIA_SYSTEM_PREFIX
+replaces /usr. The scenarios run one after another on the same root, like a user would, each in
+its own process, and the wall time, processes started and bytes written of each are compared with
+baseline.json.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import runpy
+import subprocess
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB = f'{BENCH_DIR}/stub.py'
+BASELINE = f'{BENCH_DIR}/baseline.json'
+
+STUBS = ('gnome-shell', 'gsettings', 'xfconf-query', 'git', 'meson', 'ninja', 'sassc', 'gtk-update-icon-cache')
+
+SUBMODULES = {
+    'dg-adw-gtk3': (),
+    'dg-yaru': (),
+    'dg-libadwaita': ('install.sh',),
+    'dg-firefox-theme': ('install.sh',),
+    'dg-vscode-adwaita': ('install.py',),
+}
+
+FIRST_INSTALL = {
+    'dir': 'default',
+    'color': 'orange',
+    'theme': 'light',
+    'window-controls': 'macos',
+    'enabled': ['gtk3', 'gtk4-libadwaita', 'gtk4', 'gnome-shell', 'icons', 'cursors', 'sounds', 'gtksourceview', 'firefox', 'vscode'],
+    'flatpak': False,
+    'firefox-settings': True,
+    'default-syntax': False,
+}
+
+# name: (script, spec), the spec is None for uninstall.py
+SCENARIOS = {
+    'first-install': ('install.py', FIRST_INSTALL),
+    'noop-update': ('install.py', FIRST_INSTALL),
+    'accent-change': ('install.py', dict(FIRST_INSTALL, color='blue')),
+    'theme-switch': ('install.py', dict(FIRST_INSTALL, color='blue', theme='dark')),
+    'full-uninstall': ('uninstall.py', None),
+}
+
+# Latency in seconds of each stub with --latency 1, roughly what the real programs take on a fast machine
+LATENCY = {
+    'gnome-shell': 0.15,
+    'gsettings': 0.01,
+    'xfconf-query': 0.01,
+    'git': 0.01,
+    'meson': 0.5,
+    'ninja': 1.0,
+    'install.sh': 0.3,
+    'install.py': 0.3,
+    'gtk-update-icon-cache': 0.05,
+}
+
+# A run regresses if it takes more than WALL_TOLERANCE times the baseline plus WALL_SLACK seconds,
+# starts more processes, or writes more than BYTES_TOLERANCE times the bytes
+WALL_TOLERANCE = 1.5
+WALL_SLACK = 0.25
+BYTES_TOLERANCE = 1.1
+
+def wrapper(path, name):
+    '''
+    Write an executable that runs stub.py as name.
+
+    Parameters:
+        path (str) : Where to write it.
+        name (str) : The program it replaces.
+    '''
+    with open(path, 'w', encoding='UTF-8') as f:
+        f.write(f'#!{sys.executable}\nimport sys, runpy\nsys.argv.insert(1, {name!r})\nrunpy.run_path({STUB!r}, run_name="__main__")\n')
+    os.chmod(path, 0o755)
+
+def build_root(root):
+    '''
+    Create the repo copy, home directory and stubs the scenarios run in.
+
+    Parameters:
+        root (str) : An empty directory.
+    '''
+    repo = f'{root}/repo'
+    os.makedirs(repo)
+    for name in os.listdir(REPO_DIR):
+        if name.endswith('.py'):
+            shutil.copy2(f'{REPO_DIR}/{name}', repo)
+    for component, scripts in SUBMODULES.items():
+        os.makedirs(f'{repo}/src/{component}')
+        for script in scripts:
+            wrapper(f'{repo}/src/{component}/{script}', script)
+
+    os.makedirs(f'{root}/home/.mozilla/firefox/bench.default-release')
+    os.makedirs(f'{root}/home/.vscode/extensions')
+    os.makedirs(f'{root}/usr/share')
+
+    for directory in ('bin', 'state', 'specs', 'traces'):
+        os.makedirs(f'{root}/bench/{directory}')
+    for name in STUBS:
+        wrapper(f'{root}/bench/bin/{name}', name)
+    # run_command runs ninja through env, and the stubs need python
+    for name in ('env', 'python3'):
+        os.symlink(shutil.which(name) if name == 'env' else sys.executable, f'{root}/bench/bin/{name}')
+
+def environment(root, latency):
+    '''
+    Parameters:
+        root (str) : The root from build_root.
+        latency (float) : Multiplier for LATENCY.
+
+    Returns:
+        env (dict) : The environment the scenarios run in.
+    '''
+    env = {key: value for key, value in os.environ.items() if key in ('LANG', 'LC_ALL', 'TERM', 'TMPDIR')}
+    env.update({
+        'PATH': f'{root}/bench/bin',
+        'HOME': f'{root}/home',
+        'USER': '',
+        'QUALIA_SYSTEM_PREFIX': f'{root}/usr',
+        'QUALIA_BENCH_LOG': f'{root}/bench/log',
+        'QUALIA_BENCH_STATE': f'{root}/bench/state',
+        'QUALIA_BENCH_LATENCY': json.dumps({name: seconds * latency for name, seconds in LATENCY.items()}),
+    })
+    return env
+
+def snapshot(root):
+    '''
+    Parameters:
+        root (str) : The root from build_root.
+
+    Returns:
+        files (dict) : {path: (size, mtime)} of every file, except the ones the harness writes.
+    '''
+    files = {}
+    for directory, dirs, names in os.walk(root):
+        if directory == root:
+            dirs.remove('bench')
+        for name in names:
+            path = os.path.join(directory, name)
+            stat = os.lstat(path)
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+def bytes_written(before, after):
+    '''
+    Returns:
+        bytes (int) : The size of the files that were created or changed between the snapshots.
+    '''
+    return sum(size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime))
+
+def stub_calls(root):
+    '''
+    Returns:
+        calls (int) : The number of stubs that ran since the log was last read, the log is emptied.
+    '''
+    path = f'{root}/bench/log'
+    if not os.path.isfile(path):
+        return 0
+    with open(path, encoding='UTF-8') as f:
+        calls = sum(1 for line in f if line.strip() != '')
+    os.remove(path)
+    return calls
+
+def worker(root, name):
+    '''
+    Run a scenario in this process, writing what it measured to bench/<name>.json.
+
+    Parameters:
+        root (str) : The root from build_root.
+        name (str) : The scenario.
+    '''
+    script, config = SCENARIOS[name]
+    repo = f'{root}/repo'
+    sys.path.insert(0, repo)
+    os.chdir(repo)
+
+    # Only the stubs are used, even if Gio or snapd are available
+    import gsettings
+    import xfconf
+    import snapd
+    import tracing
+    gsettings.Gio = None
+    xfconf.Gio = None
+    snapd.Snapd.available = lambda self: False
+    # The scripts refuse to run as root, everything is in the temporary root so that doesn't matter here
+    if os.getuid() == 0:
+        os.getuid = lambda: 1000
+
+    trace = f'{root}/bench/traces/{name}.json'
+    if config is not None:
+        spec = f'{root}/bench/specs/{name}.json'
+        with open(spec, 'w', encoding='UTF-8') as f:
+            json.dump(config, f)
+        sys.argv = [script, '--spec', spec, '--trace', trace]
+    else:
+        sys.argv = [script]
+        tracing.enabled = True
+
+    code = 0
+    start = time.perf_counter()
+    try:
+        runpy.run_path(f'{repo}/{script}', run_name='__main__')
+    except SystemExit as error:
+        code = error.code if isinstance(error.code, int) else 0 if error.code is None else 1
+    wall = time.perf_counter() - start
+
+    with open(f'{root}/bench/{name}.json', 'w', encoding='UTF-8') as f:
+        json.dump({'exit code': code, 'wall': wall, 'processes': sum(spawns for _, _, spawns in tracing.summary())}, f)
+
+def run(root, name, env, quiet):
+    '''
+    Run a scenario in its own process.
+
+    Parameters:
+        root (str) : The root from build_root.
+        name (str) : The scenario.
+        env (dict) : The environment from environment.
+        quiet (bool) : Hide the output of the scripts.
+
+    Returns:
+        result (dict) : {'wall', 'processes', 'stub calls', 'bytes'}, or None if the scenario failed.
+    '''
+    before = snapshot(root)
+    output = subprocess.run([sys.executable, os.path.realpath(__file__), '--worker', root, name], env=env,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE if quiet else None, stderr=subprocess.STDOUT, check=False)
+    after = snapshot(root)
+    calls = stub_calls(root)
+    try:
+        with open(f'{root}/bench/{name}.json', encoding='UTF-8') as f:
+            result = json.load(f)
+    except FileNotFoundError:
+        result = None
+    if output.returncode != 0 or result is None or result['exit code'] != 0:
+        if quiet and output.stdout is not None:
+            print(output.stdout.decode('utf-8', 'replace'))
+        return None
+    return {'wall': round(result['wall'], 3), 'processes': result['processes'], 'stub calls': calls, 'bytes': bytes_written(before, after)}
+
+def regressions(name, result, baseline):
+    '''
+    Parameters:
+        name (str) : The scenario.
+        result (dict) : What the scenario measured.
+        baseline (dict) : What it measured in the baseline.
+
+    Returns:
+        problems (list) : What got worse, as sentences.
+    '''
+    problems = []
+    if result['wall'] > baseline['wall'] * WALL_TOLERANCE + WALL_SLACK:
+        problems.append(f"{name} took {result['wall']:.2f}s, the baseline is {baseline['wall']:.2f}s")
+    if result['processes'] > baseline['processes']:
+        problems.append(f"{name} started {result['processes']} processes, the baseline is {baseline['processes']}")
+    if result['bytes'] > baseline['bytes'] * BYTES_TOLERANCE:
+        problems.append(f"{name} wrote {result['bytes']} bytes, the baseline is {baseline['bytes']}")
+    return problems
+
+def leftovers(root, name):
+    '''
+    Check that a scenario didn't leave behind what it should have removed.
+
+    After the uninstall nothing of the theme can be left, and after the accent change nothing can be
+    left of the themes for the first accent color, except for the cursors that don't depend on it.
+
+    Parameters:
+        root (str) : The root from build_root.
+        name (str) : The scenario that just ran.
+
+    Returns:
+        problems (list) : What was left behind, as sentences.
+    '''
+    left = []
+    if name == 'full-uninstall':
+        for directory in (f'{root}/home', f'{root}/usr'):
+            for parent, dirs, files in os.walk(directory):
+                left += [os.path.join(parent, i) for i in dirs + files if i.startswith('qualia')]
+                dirs[:] = [i for i in dirs if not i.startswith('qualia')]
+    elif name == 'accent-change':
+        color = FIRST_INSTALL['color']
+        prefix = 'qualia' if color == 'orange' else f'qualia-{color}'
+        themes = [f'{prefix}{suffix}{controls}' for suffix in ('', '-dark') for controls in ('', f"-{FIRST_INSTALL['window-controls']}")]
+        for share in (f'{root}/home/.local/share', f'{root}/usr/share'):
+            for theme in [f'{share}/themes/{i}' for i in themes] + [f'{share}/icons/{i}' for i in themes]:
+                for parent, dirs, files in os.walk(theme):
+                    for i in files:
+                        path = os.path.relpath(os.path.join(parent, i), theme)
+                        if path != 'cursor.theme' and not path.startswith('cursors/'):
+                            left.append(os.path.join(parent, i))
+    return [f'{name} left {os.path.relpath(path, root)} behind' for path in sorted(left)]
+
+def main():
+    '''The main function.'''
+    parser = argparse.ArgumentParser(description='Benchmark install.py and uninstall.py in a temporary root with stub programs')
+    parser.add_argument('scenarios', nargs='*', default=[],
+                        help='scenarios to measure, the ones before them are ran first without being measured, defaults to all of them: ' + ', '.join(SCENARIOS))
+    parser.add_argument('-l', '--latency', type=float, default=1.0, metavar='SCALE', help='multiply the latency of the stubs, 0 to only measure the scripts')
+    parser.add_argument('-b', '--baseline', default=BASELINE, metavar='FILE', help='the baseline to compare with')
+    parser.add_argument('-u', '--update-baseline', action='store_true', help='write the results to the baseline instead of comparing')
+    parser.add_argument('-k', '--keep', action='store_true', help="don't delete the temporary root")
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the scripts')
+    parser.add_argument('--worker', nargs=2, metavar=('ROOT', 'SCENARIO'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        worker(*args.worker)
+        return
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario '{name}'")
+
+    # Later scenarios depend on the ones before them, so everything up to the last one that is measured is ran in order
+    measured = [name for name in SCENARIOS if name in args.scenarios or len(args.scenarios) == 0]
+    names = list(SCENARIOS)[:list(SCENARIOS).index(measured[-1]) + 1]
+
+    root = tempfile.mkdtemp(prefix='qualia-bench-')
+    try:
+        build_root(root)
+        env = environment(root, args.latency)
+        results = {}
+        left = []
+        print(f"{'scenario':<16}{'wall':>9}{'processes':>11}{'stub calls':>12}{'bytes':>12}")
+        for name in names:
+            result = run(root, name, env, not args.verbose)
+            if result is None:
+                print(f"{name} failed, run with --verbose to see why{', the root is in ' + root if args.keep else ''}.")
+                sys.exit(1)
+            left += leftovers(root, name)
+            if name not in measured:
+                continue
+            results[name] = result
+            print(f"{name:<16}{result['wall']:>8.2f}s{result['processes']:>11}{result['stub calls']:>12}{result['bytes']:>12}")
+    finally:
+        if args.keep:
+            print(f'The root is in {root}')
+        else:
+            shutil.rmtree(root)
+
+    # A scenario that doesn't do its job can't be compared with the baseline
+    if len(left) > 0:
+        for problem in left:
+            print(problem)
+        sys.exit(1)
+
+    try:
+        with open(args.baseline, encoding='UTF-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = None
+
+    if args.update_baseline:
+        # Scenarios that weren't measured keep their baseline, unless it was measured with another latency
+        scenarios = baseline['scenarios'] if baseline is not None and baseline['latency'] == args.latency else {}
+        with open(args.baseline, 'w', encoding='UTF-8') as f:
+            json.dump({'latency': args.latency, 'scenarios': {**scenarios, **results}}, f, indent=2)
+            f.write('\n')
+        print(f'Wrote {args.baseline}')
+        return
+
+    if baseline is None:
+        print("There is no baseline, run with '--update-baseline' to create one.")
+        return
+    if baseline['latency'] != args.latency:
+        print(f"The baseline was measured with '--latency {baseline['latency']}', not comparing.")
+        return
+    problems = []
+    for name, result in results.items():
+        if name in baseline['scenarios']:
+            problems += regressions(name, result, baseline['scenarios'][name])
+    for problem in problems:
+        print(problem)
+    if len(problems) > 0:
+        sys.exit(1)
+    print('No regressions.')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''Benchmarks paths.installed against a synthetic tree with thousands of themes.'''
+import os
+import sys
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+
+def build_tree(home, themes):
+    '''
+    Creates a ~/.local/share with qualia themes and unrelated themes.
+
+    Parameters:
+        home (str) : The home directory to create the tree in.
+        themes (int) : The number of themes in each directory.
+    '''
+    share = f'{home}/.local/share'
+    for i in range(themes):
+        for name in (f'qualia-{i}', f'other-{i}'):
+            for subdir in ('gtk-2.0', 'gtk-3.0', 'gtk-4.0', 'gnome-shell', 'metacity', 'unity', 'xfwm4', 'cinnamon'):
+                os.makedirs(f'{share}/themes/{name}/{subdir}')
+            for subdir in ('16x16', '24x24', 'scalable', 'cursors'):
+                os.makedirs(f'{share}/icons/{name}/{subdir}')
+            open(f'{share}/icons/{name}/index.theme', 'w', encoding='UTF-8').close()
+            os.makedirs(f'{share}/sounds/{name}')
+            os.makedirs(f'{share}/gtksourceview-5/styles', exist_ok=True)
+            open(f'{share}/gtksourceview-5/styles/{name}.xml', 'w', encoding='UTF-8').close()
+
+def run(paths, repeat):
+    '''
+    Parameters:
+        paths (module) : The paths module.
+        repeat (int) : The number of calls to paths.installed in each run, like a single install does.
+
+    Returns:
+        seconds (float) : How long it took.
+    '''
+    paths.invalidate()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        paths.installed()
+    return time.perf_counter() - start
+
+def main():
+    '''The main function.'''
+    parser = argparse.ArgumentParser(description='Benchmark paths.installed with and without the directory index')
+    parser.add_argument('-t', '--themes', type=int, default=2000, help='number of themes in each theme directory')
+    parser.add_argument('-r', '--repeat', type=int, default=6, help='calls to paths.installed per run')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp()
+    try:
+        build_tree(home, args.themes)
+
+        # paths reads these when it is imported
+        os.environ['HOME'] = home
+        os.environ['USER'] = ''
+        os.environ.pop('SUDO_USER', None)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+        import paths
+        import manifest
+        manifest.load = lambda component: None # only benchmark the filesystem
+
+        indexed = run(paths, args.repeat)
+        index_glob = paths._index_glob
+        paths._index_glob = glob.glob
+        globbed = run(paths, args.repeat)
+        paths._index_glob = index_glob
+
+        print(f'{args.themes * 2} themes per directory, {args.repeat} calls')
+        print(f'glob:  {globbed:.3f}s')
+        print(f'index: {indexed:.3f}s ({globbed / indexed:.1f}x)')
+    finally:
+        shutil.rmtree(home)
+
+if __name__ == "__main__":
+    main()
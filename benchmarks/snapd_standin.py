@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+'''
+Checks snapd.Snapd against a stand-in snapd on a Unix socket in a temporary directory.
+
+The stand-in answers the parts of the REST API that Snapd uses, keeps the snaps and connections in
+memory and finishes each change after it has been polled once, so the real snapd is never touched.
+The sudo path is checked with a fake sudo that runs the command as the current user.
+'''
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import socketserver
+import http.server
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from snapd import Snapd, SnapdError
+
+SUDO = '''#!/bin/sh
+exec "$@"
+'''
+
+class Store:
+    '''
+    The state of the stand-in snapd.
+
+    Attributes:
+        snaps (set) : The names of the installed snaps.
+        connections (set) : {(plug snap, plug, slot snap, slot), ...} the established connections.
+        changes (dict) : {id: [polls left, error]} the changes that were submitted.
+        requests (list) : [(method, path), ...] every request that was made.
+        online (bool) : Whether or not the store can be reached.
+    '''
+    def __init__(self):
+        self.snaps = {'core22', 'firefox', 'gtk-common-themes'}
+        self.connections = {('firefox', 'gtk-3-themes', 'gtk-common-themes', 'gtk-3-themes')}
+        self.changes = {}
+        self.requests = []
+        self.online = True
+        self.lock = threading.Lock()
+
+    def change(self, error = None):
+        '''
+        Parameters:
+            error (str) : The error the change fails with, None if it succeeds.
+
+        Returns:
+            id (str) : The id of the new change.
+        '''
+        change = str(len(self.changes) + 1)
+        self.changes[change] = [1, error]
+        return change
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    '''Answers the requests to the stand-in snapd.'''
+    store = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, response, status = 200):
+        body = json.dumps(dict(response, **{'status-code': status})).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, message, status = 400):
+        self.reply({'type': 'error', 'result': {'message': message}}, status)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        store = self.store
+        with store.lock:
+            store.requests.append(('GET', url.path))
+            if url.path == '/v2/snaps':
+                self.reply({'type': 'sync', 'result': [{'name': name} for name in sorted(store.snaps)]})
+            elif url.path == '/v2/connections':
+                established = [{'plug': {'snap': i[0], 'plug': i[1]}, 'slot': {'snap': i[2], 'slot': i[3]}} for i in sorted(store.connections)]
+                self.reply({'type': 'sync', 'result': {'established': established}})
+            elif url.path == '/v2/debug' and parse_qs(url.query).get('aspect') == ['connectivity']:
+                self.reply({'type': 'sync', 'result': {'connectivity': store.online}})
+            elif url.path.startswith('/v2/changes/') and url.path[12:] in store.changes:
+                change = store.changes[url.path[12:]]
+                if change[0] > 0:
+                    change[0] -= 1
+                    self.reply({'type': 'sync', 'result': {'ready': False, 'status': 'Doing'}})
+                elif change[1] is None:
+                    self.reply({'type': 'sync', 'result': {'ready': True, 'status': 'Done'}})
+                else:
+                    self.reply({'type': 'sync', 'result': {'ready': True, 'status': 'Error', 'err': change[1]}})
+            else:
+                self.error('not found', 404)
+
+    def do_POST(self):
+        store = self.store
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with store.lock:
+            store.requests.append(('POST', self.path))
+            if self.path == '/v2/snaps' and body.get('action') in ('install', 'refresh', 'remove'):
+                if body['action'] == 'install':
+                    store.snaps.update(body['snaps'])
+                elif body['action'] == 'remove':
+                    store.snaps.difference_update(body['snaps'])
+                self.reply({'type': 'async', 'change': store.change()}, 202)
+            elif self.path == '/v2/interfaces' and body.get('action') in ('connect', 'disconnect'):
+                plug, slot = body['plugs'][0], body['slots'][0]
+                connection = (plug['snap'], plug['plug'], slot['snap'], slot['slot'])
+                if slot['snap'] not in store.snaps:
+                    self.reply({'type': 'async', 'change': store.change(f"snap \"{slot['snap']}\" is not installed")}, 202)
+                    return
+                if body['action'] == 'connect':
+                    store.connections.add(connection)
+                else:
+                    store.connections.discard(connection)
+                self.reply({'type': 'async', 'change': store.change()}, 202)
+            else:
+                self.error('bad request')
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''A threaded HTTP server on a Unix socket.'''
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address, a Unix socket has none
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+def check(problems, condition, message):
+    '''
+    Parameters:
+        problems (list) : The problems found so far, the message is added to it if the condition is False.
+        condition (bool) : Whether or not the check passed.
+        message (str) : What was checked.
+    '''
+    print(f"{'ok' if condition else 'FAILED'}: {message}")
+    if not condition:
+        problems.append(message)
+
+def run_checks(socket_path, bin_dir, store):
+    '''
+    Parameters:
+        socket_path (str) : Path to the socket of the stand-in.
+        bin_dir (str) : Directory with the fake sudo.
+        store (Store) : The state of the stand-in.
+
+    Returns:
+        problems (list) : The checks that failed.
+    '''
+    problems = []
+
+    missing = Snapd(f'{socket_path}.missing')
+    check(problems, not missing.available(), 'snapd is not available without a socket')
+    check(problems, not missing.connectivity(), 'there is no connectivity without a socket')
+
+    client = Snapd(socket_path, sudo = False)
+    check(problems, client.available(), 'snapd is available with the stand-in socket')
+    check(problems, client.connectivity(), 'connectivity is read from snapd')
+    store.online = False
+    check(problems, not client.connectivity(), 'no connectivity is read from snapd')
+    store.online = True
+
+    check(problems, client.snaps() == {'core22', 'firefox', 'gtk-common-themes'}, 'snaps lists the installed snaps')
+    check(problems, client.connections() == [('firefox', 'gtk-3-themes', 'gtk-common-themes', 'gtk-3-themes')], 'connections lists the established connections')
+    del store.requests[:]
+    client.snaps()
+    client.connections()
+    check(problems, store.requests == [], 'snaps and connections are cached')
+
+    check(problems, Snapd.snaps_request('install', ['qualia-gtk-theme']) == ('POST', '/v2/snaps', {'action': 'install', 'snaps': ['qualia-gtk-theme']}),
+          'snaps_request builds a snaps change')
+    check(problems, Snapd.interface_request('connect', 'firefox', 'icon-themes', 'qualia-gtk-theme', 'icon-themes')
+          == ('POST', '/v2/interfaces', {'action': 'connect', 'plugs': [{'snap': 'firefox', 'plug': 'icon-themes'}], 'slots': [{'snap': 'qualia-gtk-theme', 'slot': 'icon-themes'}]}),
+          'interface_request builds an interface change')
+
+    client.apply([])
+    check(problems, store.requests == [], 'apply does nothing without requests')
+
+    client.apply([Snapd.snaps_request('install', ['qualia-gtk-theme']),
+                  Snapd.interface_request('connect', 'firefox', 'icon-themes', 'qualia-gtk-theme', 'icon-themes'),
+                  Snapd.interface_request('disconnect', 'firefox', 'gtk-3-themes', 'gtk-common-themes', 'gtk-3-themes')])
+    posts = [i for i in store.requests if i[0] == 'POST']
+    polls = [i for i in store.requests if i[1].startswith('/v2/changes/')]
+    check(problems, len(posts) == 3, 'apply submits every request')
+    check(problems, len(polls) == 6, 'apply polls each change until it is ready')
+    check(problems, 'qualia-gtk-theme' in client.snaps(), 'apply invalidates the cached snaps')
+    check(problems, client.connections() == [('firefox', 'icon-themes', 'qualia-gtk-theme', 'icon-themes')], 'apply invalidates the cached connections')
+
+    try:
+        client.apply([Snapd.interface_request('connect', 'firefox', 'sound-themes', 'missing-snap', 'sound-themes')])
+        failed = None
+    except SnapdError as error:
+        failed = str(error)
+    check(problems, failed == 'snap "missing-snap" is not installed', 'apply raises the error of a failed change')
+
+    try:
+        client.apply([('POST', '/v2/snaps', {'action': 'hold', 'snaps': []})])
+        failed = None
+    except SnapdError as error:
+        failed = str(error)
+    check(problems, failed == 'bad request', 'apply raises the error of a rejected request')
+
+    # Not running as root, so apply hands the requests to snapd.py started through sudo
+    path = os.environ['PATH']
+    os.environ['PATH'] = bin_dir + os.pathsep + path
+    getuid = os.getuid
+    os.getuid = lambda: 1000
+    try:
+        del store.requests[:]
+        Snapd(socket_path).apply([Snapd.snaps_request('remove', ['qualia-gtk-theme'])])
+    finally:
+        os.getuid = getuid
+        os.environ['PATH'] = path
+    check(problems, ('POST', '/v2/snaps') in store.requests, 'apply submits the requests through sudo when not running as root')
+    check(problems, 'qualia-gtk-theme' not in client.snaps(), 'the change made through sudo is applied')
+    return problems
+
+def main():
+    '''The main function.'''
+    tmp = tempfile.mkdtemp(prefix='qualia-snapd-')
+    socket_path = f'{tmp}/snapd.socket'
+    with open(f'{tmp}/sudo', 'w', encoding='UTF-8') as f:
+        f.write(SUDO)
+    os.chmod(f'{tmp}/sudo', 0o755)
+
+    store = Store()
+    Handler.store = store
+    server = Server(socket_path, Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        problems = run_checks(socket_path, tmp, store)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp)
+    if len(problems) > 0:
+        sys.exit(1)
+    print('All checks passed.')
+
+if __name__ == "__main__":
+    main()
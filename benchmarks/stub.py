@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+'''
+Fake versions of the programs the install script runs, used by harness.py.
+
+The harness runs this file under the name of the program it replaces. Every call is appended to
+QUALIA_BENCH_LOG, then the stub sleeps for the latency in QUALIA_BENCH_LATENCY and does just
+enough for the install script to work: the build tools write a theme with a few hundred files,
+and gsettings and xfconf-query keep their settings in QUALIA_BENCH_STATE.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import fcntl
+import hashlib
+
+# Hex colors of the accents, so the builds can be recolored like the real ones
+ACCENTS = {
+    'orange': '#e95420', 'bark': '#787859', 'sage': '#657b69', 'olive': '#4b8501', 'viridian': '#03875b',
+    'prussiangreen': '#308280', 'lightblue': '#0073e5', 'blue': '#3584e4', 'purple': '#7764d8',
+    'magenta': '#b34cb3', 'pink': '#da3450', 'red': '#c7162b',
+}
+
+SCHEMAS = {
+    'org.gnome.desktop.interface': {'gtk-theme': 'Adwaita', 'icon-theme': 'Adwaita', 'cursor-theme': 'Adwaita', 'color-scheme': 'default'},
+    'org.gnome.desktop.sound': {'theme-name': 'freedesktop'},
+    'org.gnome.desktop.wm.preferences': {'theme': 'Adwaita'},
+    'org.gnome.shell.extensions.user-theme': {'name': ''},
+    'org.gnome.TextEditor': {'style-scheme': 'Adwaita'},
+}
+
+CHANNELS = {'xsettings': {'/Net/ThemeName': 'Adwaita', '/Net/IconThemeName': 'Adwaita', '/Gdk/WindowScalingFactor': '1'}}
+
+# Number of icons in each icon theme, and lines in each stylesheet
+ICONS = 150
+CSS_LINES = 1500
+
+def log(name):
+    with open(os.environ['QUALIA_BENCH_LOG'], 'a', encoding='UTF-8') as f:
+        f.write(json.dumps({'name': name, 'argv': sys.argv[1:], 'cwd': os.getcwd()}) + '\n')
+
+def state(name, default):
+    '''
+    Parameters:
+        name (str) : The file in QUALIA_BENCH_STATE.
+        default (dict) : The state if the file doesn't exist yet.
+
+    Returns:
+        f (file) : The locked file, close it to release the lock.
+        state (dict) : The state.
+    '''
+    f = open(os.path.join(os.environ['QUALIA_BENCH_STATE'], name), 'a+', encoding='UTF-8')
+    fcntl.flock(f, fcntl.LOCK_EX)
+    f.seek(0)
+    text = f.read()
+    return f, json.loads(text) if text != '' else default
+
+def save(f, data):
+    f.seek(0)
+    f.truncate()
+    json.dump(data, f)
+    f.close()
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='UTF-8') as f:
+        f.write(text)
+
+def css(accent, variant, lines = CSS_LINES):
+    background = '#242424' if variant == 'dark' else '#fafafa'
+    return ''.join(f'.widget-{i} {{ color: {ACCENTS[accent] if i % 7 == 0 else background}; border-color: #{i % 4096:03x}; }}\n' for i in range(lines))
+
+def svg(accent, i):
+    return f'<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16"><path d="M{i % 16} 0h16v16H0z" fill="{ACCENTS[accent]}"/><path d="M0 0h8v8H0z" fill="#3d3d3d"/></svg>\n'
+
+def parse_options(argv):
+    return {i[2:].split('=', 1)[0]: i.split('=', 1)[1] for i in argv if i.startswith('-D') and '=' in i}
+
+def meson_theme(component, options, destdir):
+    '''Write what meson would install for dg-adw-gtk3 or dg-yaru.'''
+    share = destdir + options['prefix'] + '/share'
+    accent = options.get('accent-colors') or 'orange'
+    controls = options.get('window-controls', 'macos')
+    name = 'qualia' if accent == 'orange' else f'qualia-{accent}'
+    for variant, suffix in (('light', ''), ('dark', '-dark')):
+        if component == 'dg-adw-gtk3':
+            theme = f'{share}/themes/{name}{suffix}-{controls}'
+            write(f'{theme}/index.theme', f'[Desktop Entry]\nName={name}{suffix}-{controls}\n')
+            if options.get('gtk3') == 'true':
+                write(f'{theme}/gtk-3.0/gtk.css', css(accent, variant))
+                write(f'{theme}/gtk-2.0/gtkrc', f'gtk-color-scheme = "selected_bg_color:{ACCENTS[accent]}"\n')
+            if options.get('gtk4') == 'true':
+                write(f'{theme}/gtk-4.0/gtk.css', css(accent, variant))
+            continue
+        if options.get('gnome-shell') == 'true':
+            write(f'{share}/themes/{name}{suffix}/gnome-shell/gnome-shell.css', css(accent, variant))
+            write(f'{share}/themes/{name}{suffix}/index.theme', f'[Desktop Entry]\nName={name}{suffix}\n')
+        if options.get('icons') == 'true':
+            icons = f'{share}/icons/{name}{suffix}'
+            write(f'{icons}/index.theme', f'[Icon Theme]\nName={name}{suffix}\nDirectories=scalable/apps\n')
+            for i in range(ICONS):
+                write(f'{icons}/scalable/apps/icon-{i}.svg', svg(accent, i))
+        if options.get('gtksourceview') == 'true':
+            write(f'{share}/gtksourceview-5/styles/qualia{suffix}.xml', f'<style-scheme id="qualia{suffix}"><color name="accent" value="{ACCENTS[accent]}"/></style-scheme>\n')
+    if component == 'dg-yaru' and options.get('cursors') == 'true':
+        write(f'{share}/icons/qualia/cursor.theme', '[Icon Theme]\nName=qualia\n')
+        for i in range(ICONS // 5):
+            write(f'{share}/icons/qualia/cursors/cursor-{i}', 'cursor\n' * 64)
+    if component == 'dg-yaru' and options.get('sounds') == 'true':
+        write(f'{share}/sounds/qualia/index.theme', '[Sound Theme]\nName=qualia\n')
+
+def install_script(component, argv):
+    '''Write what the install scripts of dg-libadwaita, dg-firefox-theme and dg-vscode-adwaita would install.'''
+    home = os.environ['HOME']
+    accent = argv[argv.index('-c') + 1] if '-c' in argv else 'orange'
+    variant = argv[argv.index('-t') + 1] if '-t' in argv else 'light'
+    if component == 'dg-libadwaita':
+        write(f'{home}/.config/gtk-4.0/gtk.css', css(accent, variant))
+        for i in range(ICONS // 10):
+            write(f'{home}/.config/gtk-4.0/mac-icons/button-{i}.svg', svg(accent, i))
+    elif component == 'dg-firefox-theme':
+        firefox = f'{home}/.mozilla/firefox'
+        for profile in os.listdir(firefox):
+            if os.path.isdir(f'{firefox}/{profile}'):
+                write(f'{firefox}/{profile}/chrome/qualia/theme.css', css(accent, variant, CSS_LINES // 3))
+                write(f'{firefox}/{profile}/chrome/userChrome.css', '@import "qualia/theme.css";\n')
+                write(f'{firefox}/{profile}/user.js', 'user_pref("toolkit.legacyUserProfileCustomizations.stylesheets", true);\n')
+    elif component == 'dg-vscode-adwaita':
+        # Like the real script, the extension is replaced, so only the variant it was given is installed
+        extension = f'{home}/.vscode/extensions/qualia'
+        shutil.rmtree(extension, ignore_errors=True)
+        write(f'{extension}/package.json', json.dumps({'name': 'qualia', 'accent': accent, 'default-syntax': '-d' in argv}))
+        write(f'{extension}/themes/qualia-{variant}.json', json.dumps({'colors': {f'color.{i}': ACCENTS[accent] for i in range(200)}}))
+
+def gsettings(argv):
+    f, schemas = state('gsettings.json', SCHEMAS)
+    if argv[0] == 'list-schemas':
+        print('\n'.join(schemas))
+    elif argv[0] == 'list-recursively':
+        for key, value in schemas.get(argv[1], {}).items():
+            print(f"{argv[1]} {key} '{value}'")
+    elif argv[0] == 'get':
+        print(f"'{schemas[argv[1]][argv[2]]}'")
+    elif argv[0] == 'set':
+        schemas.setdefault(argv[1], {})[argv[2]] = argv[3].strip("'")
+    save(f, schemas)
+
+def xfconf_query(argv):
+    f, channels = state('xfconf.json', CHANNELS)
+    channel = argv[argv.index('-c') + 1] if '-c' in argv else None
+    if channel is None:
+        print('Channels:\n' + ''.join(f'  {i}\n' for i in channels), end='')
+    elif '-s' in argv:
+        channels.setdefault(channel, {})[argv[argv.index('-p') + 1]] = argv[argv.index('-s') + 1]
+    else:
+        for prop, value in channels.get(channel, {}).items():
+            print(f'{prop:<40}{value}')
+    save(f, channels)
+
+def git(argv):
+    if argv[:2] == ['rev-parse', 'HEAD']:
+        print(hashlib.sha1(os.path.basename(os.getcwd()).encode('utf-8')).hexdigest())
+    elif argv[:2] == ['submodule', 'status']:
+        for path in argv[3:]:
+            print(f" {hashlib.sha1(os.path.basename(path).encode('utf-8')).hexdigest()} {path} (heads/main)")
+
+def main():
+    '''Runs the stub for the program in argv[1], with its arguments after it.'''
+    name = sys.argv.pop(1)
+    argv = sys.argv[1:]
+    log(name)
+    time.sleep(json.loads(os.environ.get('QUALIA_BENCH_LATENCY', '{}')).get(name, 0))
+    component = os.path.basename(os.getcwd())
+    if name == 'gnome-shell':
+        print('GNOME Shell 44.0')
+    elif name == 'gsettings':
+        gsettings(argv)
+    elif name == 'xfconf-query':
+        xfconf_query(argv)
+    elif name == 'git':
+        git(argv)
+    elif name == 'meson':
+        build = argv[1] if argv[0] == 'configure' else argv[0]
+        os.makedirs(build, exist_ok=True)
+        write(f'{build}/options.json', json.dumps(parse_options(argv)))
+    elif name == 'ninja' and 'install' in argv:
+        with open(f"{argv[argv.index('-C') + 1]}/options.json", encoding='UTF-8') as f:
+            meson_theme(component, json.load(f), os.environ.get('DESTDIR', ''))
+    elif name in ('install.sh', 'install.py'):
+        install_script(component, argv)
+    elif name == 'gtk-update-icon-cache':
+        write(f'{argv[-1]}/icon-theme.cache', 'cache\n')
+
+if __name__ == "__main__":
+    main()
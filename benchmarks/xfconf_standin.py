@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+'''
+Checks xfconf.Xfconf against a stand-in Xfconf service on a private D-Bus session bus.
+
+A dbus-daemon is started for the check, and this script is started again with --serve to own
+org.xfce.Xfconf on it, so the session bus and the real Xfce settings are never touched. Needs
+dbus-daemon and the Gio bindings (python3-gi).
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from xfconf import Xfconf, BUS_NAME, OBJECT_PATH, INTERFACE
+
+try:
+    from gi.repository import Gio, GLib
+except ImportError:
+    Gio = None
+
+INTROSPECTION = f'''
+<node>
+  <interface name="{INTERFACE}">
+    <method name="ListChannels">
+      <arg type="as" name="channels" direction="out"/>
+    </method>
+    <method name="GetAllProperties">
+      <arg type="s" name="channel" direction="in"/>
+      <arg type="s" name="property_base" direction="in"/>
+      <arg type="a{{sv}}" name="properties" direction="out"/>
+    </method>
+    <method name="SetProperty">
+      <arg type="s" name="channel" direction="in"/>
+      <arg type="s" name="property" direction="in"/>
+      <arg type="v" name="value" direction="in"/>
+    </method>
+  </interface>
+</node>
+'''
+
+# channel: {property: GVariant}, what the service starts with
+PROPERTIES = {
+    'xsettings': {
+        '/Net/ThemeName': ('s', 'Adwaita'),
+        '/Net/IconThemeName': ('s', 'Adwaita'),
+        '/Gdk/WindowScalingFactor': ('i', 1),
+    },
+    'xfwm4': {
+        '/general/theme': ('s', 'Default'),
+        '/general/use_compositing': ('b', True),
+    },
+}
+
+# A xfconf-query that only knows the channels, to check the fallback when the service isn't on the bus
+XFCONF_QUERY = '''#!/bin/sh
+printf 'Channels:\\n  xsettings\\n'
+'''
+
+def serve(address):
+    '''
+    Owns org.xfce.Xfconf on the bus and answers calls until the bus goes away.
+
+    Parameters:
+        address (str) : Address of the bus.
+    '''
+    properties = {channel: {prop: GLib.Variant(*value) for prop, value in values.items()} for channel, values in PROPERTIES.items()}
+
+    def on_call(connection, sender, path, interface, method, parameters, invocation):
+        if method == 'ListChannels':
+            invocation.return_value(GLib.Variant('(as)', (list(properties),)))
+        elif method == 'GetAllProperties':
+            channel, base = parameters.unpack()
+            if channel not in properties:
+                invocation.return_dbus_error('org.xfce.Xfconf.Error.ChannelNotFound', f'Channel "{channel}" does not exist')
+                return
+            values = {prop: value for prop, value in properties[channel].items() if prop.startswith(base)}
+            invocation.return_value(GLib.Variant('(a{sv})', (values,)))
+        elif method == 'SetProperty':
+            channel = parameters.get_child_value(0).get_string()
+            prop = parameters.get_child_value(1).get_string()
+            properties.setdefault(channel, {})[prop] = parameters.get_child_value(2).get_variant()
+            invocation.return_value(None)
+
+    flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+    connection = Gio.DBusConnection.new_for_address_sync(address, flags, None, None)
+    interface = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION).interfaces[0]
+    connection.register_object(OBJECT_PATH, interface, on_call, None, None)
+    loop = GLib.MainLoop()
+    connection.connect('closed', lambda *args: loop.quit())
+    Gio.bus_own_name_on_connection(connection, BUS_NAME, Gio.BusNameOwnerFlags.NONE, None, None)
+    loop.run()
+
+def check(problems, condition, message):
+    '''
+    Parameters:
+        problems (list) : The problems found so far, the message is added to it if the condition is False.
+        condition (bool) : Whether or not the check passed.
+        message (str) : What was checked.
+    '''
+    print(f"{'ok' if condition else 'FAILED'}: {message}")
+    if not condition:
+        problems.append(message)
+
+def run_checks(address, bin_dir):
+    '''
+    Parameters:
+        address (str) : Address of the private bus.
+        bin_dir (str) : Directory with the fake xfconf-query.
+
+    Returns:
+        problems (list) : The checks that failed.
+    '''
+    problems = []
+
+    # Before the service is started, Xfconf isn't on the bus and channels has to use xfconf-query
+    path = os.environ['PATH']
+    os.environ['PATH'] = bin_dir + os.pathsep + path
+    try:
+        missing = Xfconf(address = address)
+        check(problems, not missing.available(), 'Xfconf is not available without the service')
+        missing.bus = None # pretend available said it could be started
+        check(problems, missing.channels() == ['xsettings'], 'channels falls back to xfconf-query when the service is missing')
+    finally:
+        os.environ['PATH'] = path
+
+    service = subprocess.Popen([sys.executable, os.path.realpath(__file__), '--serve', address])
+    try:
+        deadline = time.monotonic() + 10
+        while not Xfconf(address = address).available():
+            if time.monotonic() > deadline or service.poll() is not None:
+                check(problems, False, 'the stand-in service owns org.xfce.Xfconf')
+                return problems
+            time.sleep(0.05)
+
+        client = Xfconf(address = address)
+        check(problems, sorted(client.channels()) == ['xfwm4', 'xsettings'], 'channels lists the channels of the service')
+        client.read('xsettings', 'xfwm4')
+        check(problems, client.get('xsettings', '/Net/ThemeName') == 'Adwaita', 'get returns a string property')
+        check(problems, client.get('xfwm4', '/general/use_compositing') == 'true', 'get returns a boolean property like xfconf-query')
+        check(problems, client.get('xsettings', '/Net/Missing') == '', 'get returns an empty string for a missing property')
+
+        client.set('xsettings', '/Net/IconThemeName', 'Adwaita')
+        check(problems, client.plan() == [], 'setting a property to its value plans nothing')
+        client.set('xsettings', '/Net/ThemeName', 'qualia')
+        client.set('xfwm4', '/general/use_compositing', 'false')
+        check(problems, sorted(client.plan()) == [('xfwm4', '/general/use_compositing', 'true', 'false'), ('xsettings', '/Net/ThemeName', 'Adwaita', 'qualia')],
+              'plan lists only the properties that differ')
+
+        dry_run = Xfconf(dry_run = True, address = address)
+        dry_run.set('xsettings', '/Net/ThemeName', 'qualia')
+        dry_run.apply()
+        check(problems, Xfconf(address = address).get('xsettings', '/Net/ThemeName') == 'Adwaita', "apply doesn't write in dry run mode")
+
+        client.apply()
+        check(problems, client.plan() == [], 'apply clears the planned changes')
+        after = Xfconf(address = address)
+        after.read('xsettings', 'xfwm4')
+        check(problems, after.get('xsettings', '/Net/ThemeName') == 'qualia', 'apply writes a string property')
+        check(problems, after.get('xfwm4', '/general/use_compositing') == 'false', 'apply writes a boolean property')
+        check(problems, after._types['xfwm4'].get('/general/use_compositing') == 'b', 'apply keeps the type of the property')
+    finally:
+        service.terminate()
+        service.wait()
+    return problems
+
+def main():
+    '''The main function.'''
+    parser = argparse.ArgumentParser(description='Check xfconf.Xfconf against a stand-in Xfconf service')
+    parser.add_argument('--serve', metavar='ADDRESS', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if Gio is None:
+        print('The Gio bindings are needed, install python3-gi.')
+        sys.exit(1)
+    if args.serve is not None:
+        serve(args.serve)
+        return
+    if shutil.which('dbus-daemon') is None:
+        print('dbus-daemon is needed to start a private bus.')
+        sys.exit(1)
+
+    tmp = tempfile.mkdtemp(prefix='qualia-xfconf-')
+    bus = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--nopidfile', '--print-address=1', f'--address=unix:dir={tmp}'],
+                           stdout=subprocess.PIPE, text=True)
+    try:
+        address = bus.stdout.readline().strip()
+        with open(f'{tmp}/xfconf-query', 'w', encoding='UTF-8') as f:
+            f.write(XFCONF_QUERY)
+        os.chmod(f'{tmp}/xfconf-query', 0o755)
+        problems = run_checks(address, tmp)
+    finally:
+        bus.terminate()
+        bus.wait()
+        shutil.rmtree(tmp)
+    if len(problems) > 0:
+        sys.exit(1)
+    print('All checks passed.')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+'''This module is for caching built themes, so a build that was done before can be installed without rebuilding it.'''
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+from paths import BUILD_CACHE
+from privileged import allowed
+
+# Maximum size of the cache in bytes, the least recently used builds are deleted when it is bigger
+LIMIT = 1 << 30
+
+_lock = threading.Lock()
+_used = set() # keys used by this process, they aren't evicted since they might still be installed from
+
+def key(component, version, options):
+    '''
+    Parameters:
+        component (str) : The part of the theme.
+        version (str) : The commit of the submodule.
+        options (list) : Every option the build is configured with.
+
+    Returns:
+        key (str) : The key of the build.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for i in [component, version] + sorted(options):
+        digest.update(i.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+def lookup(key):
+    '''
+    Parameters:
+        key (str) : The key of the build.
+
+    Returns:
+        stage (str) : The directory the build was installed to, or None if it isn't cached.
+    '''
+    with _lock:
+        _used.add(key)
+        if not os.path.isfile(f'{BUILD_CACHE}/{key}/size'):
+            return None
+        os.utime(f'{BUILD_CACHE}/{key}') # mark it as recently used
+        return f'{BUILD_CACHE}/{key}/root'
+
+def reserve(key):
+    '''
+    Parameters:
+        key (str) : The key of the build.
+
+    Returns:
+        destdir (str) : An empty directory to install the build to, pass it to commit once it is installed.
+    '''
+    with _lock:
+        _used.add(key)
+    if os.path.exists(f'{BUILD_CACHE}/{key}.tmp'):
+        shutil.rmtree(f'{BUILD_CACHE}/{key}.tmp')
+    os.makedirs(f'{BUILD_CACHE}/{key}.tmp/root')
+    return f'{BUILD_CACHE}/{key}.tmp/root'
+
+def _size(directory):
+    size = 0
+    for parent, _, files in os.walk(directory):
+        for i in files:
+            size += os.lstat(os.path.join(parent, i)).st_size
+    return size
+
+def commit(key, meta = None, limit = LIMIT):
+    '''
+    Add a build that was installed to the directory from reserve to the cache.
+
+    Parameters:
+        key (str) : The key of the build.
+        meta (dict) : {'component': str, 'version': str, 'options': list} what the build is, so other builds can be compared to it.
+        limit (int) : Size of the cache in bytes to evict down to.
+
+    Returns:
+        stage (str) : The directory the build is cached in.
+    '''
+    if meta is not None:
+        with open(f'{BUILD_CACHE}/{key}.tmp/meta.json', 'w', encoding='UTF-8') as f:
+            json.dump(meta, f)
+    with open(f'{BUILD_CACHE}/{key}.tmp/size', 'w', encoding='UTF-8') as f:
+        f.write(str(_size(f'{BUILD_CACHE}/{key}.tmp/root')))
+    with _lock:
+        if os.path.exists(f'{BUILD_CACHE}/{key}'):
+            shutil.rmtree(f'{BUILD_CACHE}/{key}')
+        os.replace(f'{BUILD_CACHE}/{key}.tmp', f'{BUILD_CACHE}/{key}')
+    evict(limit)
+    return f'{BUILD_CACHE}/{key}/root'
+
+def builds():
+    '''
+    Returns:
+        builds (dict) : {key: meta} the cached builds that have meta, see commit.
+    '''
+    ret = {}
+    try:
+        with os.scandir(BUILD_CACHE) as it:
+            for entry in it:
+                if not os.path.isfile(f'{entry.path}/size'):
+                    continue # unfinished builds
+                try:
+                    with open(f'{entry.path}/meta.json', encoding='UTF-8') as f:
+                        ret[entry.name] = json.load(f)
+                except (OSError, ValueError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return ret
+
+def evict(limit = LIMIT):
+    '''
+    Delete the least recently used builds until the cache fits in the limit.
+
+    Parameters:
+        limit (int) : Size of the cache in bytes.
+    '''
+    with _lock:
+        builds = []
+        try:
+            with os.scandir(BUILD_CACHE) as it:
+                for entry in it:
+                    try:
+                        with open(f'{entry.path}/size', encoding='UTF-8') as f:
+                            builds.append((entry.stat().st_mtime, int(f.read()), entry.name))
+                    except (OSError, ValueError):
+                        continue # unfinished builds
+        except FileNotFoundError:
+            return
+        size = sum(i[1] for i in builds)
+        for _, build_size, name in sorted(builds):
+            if size <= limit:
+                break
+            if name in _used:
+                continue
+            shutil.rmtree(f'{BUILD_CACHE}/{name}', ignore_errors=True)
+            size -= build_size
+
+def installed(stage):
+    '''
+    Parameters:
+        stage (str) : The directory a build is cached in.
+
+    Returns:
+        paths (list) : Every file and directory the build installs, not including the directories the theme dirs are in.
+    '''
+    paths = []
+    for parent, dirs, files in os.walk(stage):
+        paths += ['/' + os.path.relpath(os.path.join(parent, i), stage) for i in dirs + files]
+    return [path for path in paths if allowed(path)]
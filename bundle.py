@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+'''This module is for installing the themes from a bundle written by prebuild.py, without any build tools.'''
+import os
+import sys
+import json
+import tarfile
+import subprocess
+
+from privileged import allowed
+
+class BundleError(Exception):
+    '''Raised when a bundle can't be read or doesn't have what is needed.'''
+
+def read_index(path):
+    '''
+    Parameters:
+        path (str) : The bundle.
+
+    Returns:
+        index (dict) : The index of the bundle, see prebuild.py.
+    '''
+    try:
+        with tarfile.open(path, 'r|*') as tar:
+            member = tar.next()
+            if member is None or member.name != 'index.json':
+                raise BundleError(f"'{path}' doesn't start with index.json")
+            return json.load(tar.extractfile(member))
+    except (OSError, tarfile.TarError, ValueError) as error:
+        raise BundleError(f"Can't read '{path}': {error}") from error
+
+def select(index, color, theme, window_controls, panel_icons):
+    '''
+    Parameters:
+        index (dict) : The index of the bundle.
+        color (str) : The accent color.
+        theme (str) : 'light' or 'dark'.
+        window_controls (str) : The window controls variant.
+        panel_icons (bool) : Whether or not the icons have the panel icons, bundles from before they were a variant don't.
+
+    Returns:
+        artifacts (list) : The artifacts of the variant.
+    '''
+    for cell in index['cells']:
+        if cell['color'] == color and cell['theme'] == theme and cell['window-controls'] == window_controls and cell.get('panel-icons', False) == panel_icons:
+            return cell['artifacts']
+    raise BundleError(f"The bundle has no {color} {theme} {window_controls} variant{' with panel icons' if panel_icons else ''}")
+
+def part(path):
+    '''
+    Parameters:
+        path (str) : Path of a file in a share directory, like 'themes/qualia-dark/gtk-3.0/gtk.css'.
+
+    Returns:
+        part (str) : The part of the theme it belongs to, or None if it belongs to all of them.
+    '''
+    split = path.split('/')
+    if split[0] == 'themes' and len(split) > 2:
+        for subdir, name in (('gtk-2.0', 'gtk3'), ('gtk-3.0', 'gtk3'), ('gtk-4.0', 'gtk4-libadwaita'), ('gnome-shell', 'gnome-shell'),
+                             ('cinnamon', 'cinnamon-shell'), ('metacity', 'metacity'), ('unity', 'ubuntu-unity'), ('xfwm4', 'xfwm4')):
+            if split[2].startswith(subdir):
+                return name
+        return None
+    if split[0] == 'gnome-shell':
+        return 'gnome-shell'
+    if split[0] == 'icons':
+        if len(split) > 2 and (split[2] == 'cursors' or split[2] == 'cursor.theme'):
+            return 'cursors'
+        return 'icons'
+    if split[0] == 'sounds':
+        return 'sounds'
+    if split[0].startswith('gtksourceview'):
+        return 'gtksourceview'
+    return None
+
+def destination(name, strip, dest, enabled):
+    '''
+    Parameters:
+        name (str) : Name of a member of an artifact.
+        strip (str) : Directory in the artifact to extract, without the leading '/', like the prefix it was built for. Empty to extract everything.
+        dest (str) : Directory to install the artifact in.
+        enabled (list) : Parts of the theme that are enabled.
+
+    Returns:
+        path (str) : Where to extract the member, or None if it shouldn't be extracted.
+    '''
+    name = os.path.normpath(name)
+    if strip != '':
+        if not name.startswith(strip + '/'):
+            return None
+        name = name[len(strip) + 1:]
+        if name.startswith('share/'):
+            owner = part(name[len('share/'):])
+            if owner is not None and owner not in enabled:
+                return None
+    path = os.path.normpath(f'{dest}/{name}')
+    # allowed resolves the symlinks in the parent, so a link extracted earlier can't lead out of the theme
+    return path if allowed(path) else None
+
+def _extract_member(tar, member, path):
+    if member.isdir():
+        if os.path.islink(path) or (os.path.lexists(path) and not os.path.isdir(path)):
+            os.unlink(path)
+        os.makedirs(path, exist_ok=True)
+        return path
+    if not member.isfile() and not member.issym():
+        return None
+    if member.issym() and not allowed(os.path.join(os.path.dirname(path), member.linkname)):
+        return None # links can only point to other parts of the theme
+    if os.path.isdir(path) and not os.path.islink(path):
+        return None # a file can't replace a directory
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path):
+        os.unlink(path)
+    if member.issym():
+        os.symlink(member.linkname, path)
+    else:
+        with open(path, 'wb') as f:
+            source = tar.extractfile(member)
+            for chunk in iter(lambda: source.read(1 << 16), b''):
+                f.write(chunk)
+        os.chmod(path, member.mode & 0o777)
+    return path
+
+def extract(path, plan):
+    '''
+    Extract artifacts from a bundle as a stream, straight into the directories they are installed in.
+
+    Parameters:
+        path (str) : The bundle.
+        plan (dict) : {artifact: {'strip': str, 'dest': str, 'enabled': list}}, see destination.
+
+    Returns:
+        extracted (dict) : {artifact: [path, ...]} the paths that were extracted.
+    '''
+    extracted = {artifact: [] for artifact in plan}
+    if len(plan) == 0:
+        return extracted
+    try:
+        with tarfile.open(path, 'r|*') as bundle:
+            for artifact in bundle:
+                if artifact.name not in plan:
+                    continue
+                options = plan[artifact.name]
+                with tarfile.open(fileobj=bundle.extractfile(artifact), mode='r|*') as tar:
+                    for member in tar:
+                        dest = destination(member.name, options['strip'], options['dest'], options['enabled'])
+                        if dest is not None and _extract_member(tar, member, dest) is not None:
+                            extracted[artifact.name].append(dest)
+    except (tarfile.TarError, ValueError) as error:
+        raise BundleError(f"Can't read '{path}': {error}") from error
+    missing = [artifact for artifact in plan if len(extracted[artifact]) == 0]
+    if len(missing) > 0:
+        raise BundleError(f"'{path}' is missing {', '.join(missing)}")
+    return extracted
+
+def writable(directory):
+    '''
+    Parameters:
+        directory (str) : A directory that might not exist yet.
+
+    Returns:
+        writable (bool) : Whether or not this process can create files in it.
+    '''
+    while not os.path.exists(directory):
+        directory = os.path.dirname(directory)
+    return os.access(directory, os.W_OK)
+
+def install(path, plan, verbose = False):
+    '''
+    Extract artifacts from a bundle, the ones this process can't write are extracted by a process started with sudo.
+
+    Parameters:
+        path (str) : The bundle.
+        plan (dict) : See extract.
+        verbose (bool) : Print the artifacts that are extracted.
+
+    Returns:
+        extracted (dict) : See extract.
+    '''
+    privileged = {artifact: options for artifact, options in plan.items() if not writable(options['dest'])}
+    if verbose:
+        for artifact, options in plan.items():
+            print(f"Extracting {artifact} to {options['dest']}" + (' with sudo' if artifact in privileged else ''))
+    extracted = extract(path, {artifact: options for artifact, options in plan.items() if artifact not in privileged})
+    if len(privileged) > 0:
+        output = subprocess.run(['sudo', sys.executable, os.path.realpath(__file__), os.path.abspath(path)], input=json.dumps(privileged).encode('utf-8'), stdout=subprocess.PIPE, check=False)
+        if output.returncode != 0:
+            raise BundleError(f'Extracting {", ".join(privileged)} with sudo failed')
+        extracted.update(json.loads(output.stdout))
+    return extracted
+
+def artifact_plan(index, artifacts, dirs, enabled):
+    '''
+    Parameters:
+        index (dict) : The index of the bundle.
+        artifacts (list) : The artifacts from select.
+        dirs (dict) : {component: directory} where to install each part, the prefix for meson themes and the home directory for the others.
+        enabled (list) : Parts of the theme that are enabled.
+
+    Returns:
+        plan (dict) : The plan for extract, only including the parts in dirs.
+    '''
+    plan = {}
+    for artifact in artifacts:
+        info = index['artifacts'][artifact]
+        if info['component'] not in dirs:
+            continue
+        strip = index['prefix'].strip('/') if info['root'] == '/' else ''
+        plan[artifact] = {'strip': strip, 'dest': dirs[info['component']], 'enabled': list(enabled)}
+    return plan
+
+def main():
+    '''Extracts the artifacts in the plan read from stdin, used by install when it isn't running as root.'''
+    try:
+        print(json.dumps(extract(sys.argv[1], json.load(sys.stdin))))
+    except (OSError, BundleError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+'''
+This module is for storing the configuration, it is only written when it changed.
+
+The config is JSON with a schema version, config.txt and src/installed-versions.txt in the old
+'key: value' format are still read if there is no JSON config, and deleted once it is written.
+'''
+import os
+import json
+import shutil
+from contextlib import contextmanager
+
+from paths import REPO_DIR, STATE_DIR, CONFIG, LEGACY_CONFIG, OLD_CONFIG
+
+SCHEMA_VERSION = 1
+
+# Old configs are only in the repo, so they aren't migrated to the state of every user
+LEGACY_CONFIGS = (LEGACY_CONFIG, OLD_CONFIG) if STATE_DIR == REPO_DIR else ()
+
+# Keys in the old format that are lists separated by spaces
+LIST_KEYS = ('enabled', 'firefox', 'vscode')
+
+def parse_legacy(text):
+    '''
+    Parameters:
+        text (str) : A config in the old 'key: value' format.
+
+    Returns:
+        data (dict) : The config in the current schema, see ConfigStore.
+    '''
+    data = {'schema': SCHEMA_VERSION}
+    for line in text.splitlines():
+        key, sep, value = line.strip().partition(': ')
+        if sep == '' or value == '':
+            continue
+        if key in LIST_KEYS:
+            data[key] = value.split(' ')
+        elif key == 'gnome':
+            data['gnome'] = int(value) if value.isdigit() else None
+        elif key == 'flatpak':
+            data['flatpak'] = value == 'True'
+        elif key.endswith('_version'):
+            data.setdefault('versions', {})[key[:-len('_version')]] = value
+        elif key.startswith('old_'):
+            split = key.split('_')
+            if len(split) == 3:
+                data.setdefault('old', {}).setdefault(split[1], {})[split[2]] = value
+        elif ' ' not in value:
+            data[key] = value
+    return data
+
+def _migrate(data):
+    '''Upgrade a config written with an older schema, there is only one so far.'''
+    data['schema'] = SCHEMA_VERSION
+    return data
+
+class ConfigStore:
+    '''
+    Keeps the config in memory, and writes it to a temporary file that is renamed over the config so it is never half written.
+
+    Attributes:
+        path (str) : The config file.
+        legacy (tuple) : Config files in the old format, read if path doesn't exist.
+        data (dict) : {'schema': int, 'color': str, 'theme': str, 'window-controls': str, 'dir': str, 'enabled': list, 'gnome': int,
+                       'firefox': list, 'vscode': list, 'flatpak': bool, 'versions': {theme: commit}, 'old': {part: {desktop: name}}}
+                      The fingerprints are kept in their own store, {'schema': int, theme: {'fingerprint': str, 'inputs': dict}}, see fingerprint.py
+    '''
+    def __init__(self, path = CONFIG, legacy = LEGACY_CONFIGS):
+        self.path = path
+        self.legacy = legacy
+        self.data = {}
+        self._written = None # what is in the file, so unchanged configs aren't written
+        self._batches = 0
+        self.load()
+
+    def load(self):
+        '''Read the config file, or the old config file if there isn't one.'''
+        self.data = {}
+        self._written = self._serialize() # nothing is written until something is set
+        try:
+            with open(self.path, encoding='UTF-8') as f:
+                text = f.read()
+            data = json.loads(text)
+            if isinstance(data, dict):
+                self.data = data if data.get('schema') == SCHEMA_VERSION else _migrate(data)
+                self._written = text
+            return
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            return # a broken config is replaced the next time something is set
+        for path in self.legacy:
+            try:
+                with open(path, encoding='UTF-8') as f:
+                    self.data = parse_legacy(f.read())
+                self._written = None # written in the current format the next time it is saved
+                return
+            except (OSError, UnicodeDecodeError):
+                continue
+
+    def exists(self):
+        '''
+        Returns:
+            exists (bool) : Whether or not there is a config file, in either format.
+        '''
+        return any(os.path.isfile(path) for path in (self.path,) + self.legacy)
+
+    def get(self, key, default = None):
+        '''
+        Parameters:
+            key (str) : The key in data.
+            default : Returned if the key isn't set.
+        '''
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        '''
+        Parameters:
+            key (str) : The key in data.
+            value : A value that can be written as JSON.
+        '''
+        self.data[key] = value
+
+    def _serialize(self):
+        return json.dumps({'schema': SCHEMA_VERSION, **self.data}, indent=2, sort_keys=True) + '\n'
+
+    def dirty(self):
+        '''
+        Returns:
+            dirty (bool) : Whether or not data is different from what is in the file.
+        '''
+        return self._serialize() != self._written
+
+    def save(self):
+        '''
+        Write the config if it changed and no batch is open, the old config files are deleted once it is written.
+
+        Returns:
+            written (bool) : Whether or not it was written.
+        '''
+        if self._batches > 0:
+            return False
+        text = self._serialize()
+        if text == self._written:
+            return False
+        if os.path.isdir(self.path) and not os.path.islink(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f'{self.path}.tmp', 'w', encoding='UTF-8') as f:
+            f.write(text)
+        os.replace(f'{self.path}.tmp', self.path)
+        self._written = text
+        for path in self.legacy:
+            if os.path.isfile(path):
+                os.remove(path)
+        return True
+
+    @contextmanager
+    def batch(self):
+        '''Changes made in the with block are written once at the end of it, instead of every time save is called.'''
+        self._batches += 1
+        try:
+            yield self
+        finally:
+            self._batches -= 1
+            self.save()
+
+    def delete(self):
+        '''Delete the config file and the old config files.'''
+        for path in (self.path,) + self.legacy:
+            if os.path.isfile(path):
+                os.remove(path)
+        self.data = {}
+        self._written = self._serialize()
@@ -0,0 +1,75 @@
+'''
+This module is for deciding which parts of the theme have to be installed again.
+
+Every part declares its inputs, everything its installed files depend on: the commit of its
+submodule, the options or arguments it is built with, and through them the desktop versions it is
+built for. When a part is installed, a fingerprint of its inputs is kept in fingerprints.json next
+to the config along with the inputs themselves, and the part is only installed again if the
+fingerprint changes. The kept inputs are only used to explain what changed.
+'''
+import json
+import hashlib
+
+def digest(inputs):
+    '''
+    Parameters:
+        inputs (dict) : The inputs of a part, anything that can be written as JSON.
+
+    Returns:
+        fingerprint (str) : The SHA-256 of the inputs, which doesn't depend on the order of their keys.
+    '''
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+def record(inputs):
+    '''
+    Parameters:
+        inputs (dict) : The inputs a part was installed with.
+
+    Returns:
+        entry (dict) : {'fingerprint': str, 'inputs': dict} to keep in fingerprints.json.
+    '''
+    return {'fingerprint': digest(inputs), 'inputs': inputs}
+
+def meson_options(options):
+    '''
+    Parameters:
+        options (list) : Meson options like '-Dprefix=/usr'.
+
+    Returns:
+        options (dict) : {option: value}
+    '''
+    return dict(option[2:].split('=', 1) for option in options if option.startswith('-D') and '=' in option)
+
+def _show(value):
+    if isinstance(value, str) and len(value) == 40 and all(i in '0123456789abcdef' for i in value):
+        return value[:7] # commits
+    return 'nothing' if value is None else repr(value)
+
+def changes(entry, inputs):
+    '''
+    Parameters:
+        entry (dict) : What record returned when the part was last installed, or None if it wasn't.
+        inputs (dict) : The inputs of the part now.
+
+    Returns:
+        reasons (list) : What changed, empty if the part doesn't have to be installed again.
+    '''
+    if not isinstance(entry, dict) or not isinstance(entry.get('fingerprint'), str):
+        return ['there is no fingerprint of the last install']
+    if entry['fingerprint'] == digest(inputs):
+        return []
+    old = entry.get('inputs') if isinstance(entry.get('inputs'), dict) else {}
+    reasons = []
+    for key in sorted(set(old) | set(inputs)):
+        before = old.get(key)
+        after = inputs.get(key)
+        if before == after:
+            continue
+        if isinstance(before, dict) and isinstance(after, dict):
+            for i in sorted(set(before) | set(after)):
+                if before.get(i) != after.get(i):
+                    reasons.append(f'{key} {i}: {_show(before.get(i))} -> {_show(after.get(i))}')
+        else:
+            reasons.append(f'{key}: {_show(before)} -> {_show(after)}')
+    # Only the fingerprint differs if fingerprints.json was edited by hand
+    return reasons if len(reasons) > 0 else ['the fingerprint changed']
@@ -0,0 +1,151 @@
+'''This module is for reading and changing GSettings keys.'''
+import shutil
+import subprocess
+
+import tracing
+
+try:
+    from gi.repository import Gio, GLib
+except ImportError:
+    Gio = None
+
+class GSettings:
+    '''
+    Reads and changes GSettings keys through one session connection.
+
+    Gio is used when it is available, otherwise the gsettings command is used. Either way the
+    schema list and the values of each schema are only read once, and changes are queued by set
+    and written all at once by apply.
+
+    Attributes:
+        verbose (bool) : Print the commands that are ran.
+        dry_run (bool) : Print the changes that would be made, without making them.
+    '''
+    _schemas = None # {schema, ...}, shared by all instances since it doesn't change while we run
+    _values = {} # {schema: {key: value}}, values that were read or applied
+
+    def __init__(self, verbose = False, dry_run = False):
+        self.verbose = verbose
+        self.dry_run = dry_run
+        self.pending = {} # {schema: {key: value}}, changes that haven't been applied yet
+        self.settings = {} # {schema: Gio.Settings}
+
+    @staticmethod
+    def available():
+        '''
+        Returns:
+            available (bool) : Whether or not GSettings can be used.
+        '''
+        return Gio is not None or shutil.which('gsettings') is not None
+
+    def _run(self, command):
+        if self.verbose:
+            print("Running command '" + ' '.join(command) + "'")
+        with tracing.command(command) as info:
+            output = subprocess.run(command, stdout=subprocess.PIPE, check=False)
+            info['exit code'] = output.returncode
+        output.check_returncode()
+        return output.stdout.decode('utf-8')
+
+    def _settings(self, schema):
+        if schema not in self.settings:
+            self.settings[schema] = Gio.Settings.new(schema)
+        return self.settings[schema]
+
+    def schemas(self):
+        '''
+        Returns:
+            schemas (set) : The installed schemas.
+        '''
+        if GSettings._schemas is None:
+            if Gio is not None:
+                source = Gio.SettingsSchemaSource.get_default()
+                GSettings._schemas = set(source.list_schemas(True)[0]) if source is not None else set()
+            else:
+                GSettings._schemas = set(self._run(['gsettings', 'list-schemas']).split())
+        return GSettings._schemas
+
+    def has_schema(self, schema):
+        '''
+        Parameters:
+            schema (str) : The schema to check for.
+
+        Returns:
+            installed (bool) : Whether or not the schema is installed.
+        '''
+        return schema in self.schemas()
+
+    def _read(self, schema):
+        values = {}
+        if Gio is not None:
+            settings = self._settings(schema)
+            for key in settings.props.settings_schema.list_keys():
+                value = settings.get_value(key)
+                values[key] = value.get_string() if value.get_type_string() == 's' else value.print_(False)
+        else:
+            for line in self._run(['gsettings', 'list-recursively', schema]).split('\n'):
+                line = line.split(' ', 2)
+                if len(line) == 3 and line[0] == schema:
+                    values[line[1]] = line[2].strip('\'')
+        GSettings._values[schema] = values
+
+    def get(self, schema, key):
+        '''
+        Get the value of a key, including changes that haven't been applied yet.
+
+        Parameters:
+            schema (str) : The schema of the key.
+            key (str) : The key to get.
+
+        Returns:
+            value (str) : The value, strings don't include the quotes. Empty if the key doesn't exist.
+        '''
+        if key in self.pending.get(schema, {}):
+            return self.pending[schema][key]
+        if schema not in GSettings._values:
+            self._read(schema)
+        return GSettings._values[schema].get(key, '')
+
+    def set(self, schema, key, value):
+        '''
+        Queue a change to a key, it is written by apply.
+
+        Parameters:
+            schema (str) : The schema of the key.
+            key (str) : The key to change.
+            value (str) : The new value, strings shouldn't include quotes.
+        '''
+        self.pending.setdefault(schema, {})[key] = value
+
+    def apply(self):
+        '''Writes all of the queued changes, or prints them in dry run mode.'''
+        pending = self.pending
+        self.pending = {}
+        if len(pending) == 0:
+            return
+        if self.dry_run:
+            for schema, changes in pending.items():
+                for key, value in changes.items():
+                    print(f"Would change '{schema} {key}' from '{self.get(schema, key)}' to '{value}'")
+            return
+        if Gio is not None:
+            for schema, changes in pending.items():
+                settings = self._settings(schema)
+                settings.delay()
+                for key, value in changes.items():
+                    if not settings.props.settings_schema.has_key(key):
+                        continue
+                    value_type = settings.get_value(key).get_type_string()
+                    variant = GLib.Variant('s', value) if value_type == 's' else GLib.Variant.parse(GLib.VariantType(value_type), value, None, None)
+                    if self.verbose:
+                        print(f"Setting '{schema} {key}' to '{value}'")
+                    settings.set_value(key, variant)
+                settings.apply()
+            Gio.Settings.sync()
+        else:
+            for schema, changes in pending.items():
+                for key, value in changes.items():
+                    self._run(['gsettings', 'set', schema, key, value])
+        for schema, changes in pending.items():
+            if schema in GSettings._values:
+                GSettings._values[schema].update(changes)
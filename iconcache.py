@@ -0,0 +1,59 @@
+'''This module is for regenerating icon-theme.cache only for the icon themes that changed.'''
+import os
+import time
+import shutil
+
+import privileged
+
+ICON_ROOTS = tuple(root for root in privileged.THEME_ROOTS if root.endswith('/icons'))
+
+_changed = set() # icon theme dirs that had files installed or deleted since the last update
+
+def touch(paths):
+    '''
+    Remember the icon themes that paths are in, so their caches are regenerated by update.
+
+    Parameters:
+        paths (list) : Paths that were installed or deleted.
+    '''
+    for path in paths:
+        for root in ICON_ROOTS:
+            if path.startswith(root + '/'):
+                split = path[len(root) + 1:].split('/')
+                if split[0].startswith('qualia') and split[-1] != 'icon-theme.cache':
+                    _changed.add(f'{root}/{split[0]}')
+                break
+
+def tool():
+    '''
+    Returns:
+        command (str) : The command that regenerates icon caches, or None if it isn't installed.
+    '''
+    for command in ('gtk-update-icon-cache', 'gtk4-update-icon-cache'):
+        if shutil.which(command) is not None:
+            return command
+    return None
+
+def update(verbose = False, dry_run = False):
+    '''
+    Regenerate the caches of the icon themes that changed, themes that were deleted or don't have an index are skipped.
+
+    Parameters:
+        verbose (bool) : Print the operations.
+        dry_run (bool) : Don't actually regenerate anything.
+
+    Returns:
+        regenerated (list) : [(theme dir, seconds), ...] the caches that were regenerated.
+    '''
+    themes = sorted(_changed)
+    _changed.clear()
+    if tool() is None:
+        return []
+    regenerated = []
+    for theme in themes:
+        if os.path.islink(theme) or not os.path.isfile(f'{theme}/index.theme'):
+            continue
+        start = time.perf_counter()
+        privileged.batch([{'op': 'icon-cache', 'path': theme}], verbose, dry_run)
+        regenerated.append((theme, time.perf_counter() - start))
+    return regenerated
@@ -8,11 +8,30 @@ import subprocess
 import shutil
 import time
 import threading
+import queue
+import json
+import signal
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from re import sub
-from urllib.request import urlopen
 from glob import glob
 
-from paths import HOME, REPO_DIR, CONFIG, OLD_CONFIG, SRC, FIREFOX_DIR, VSCODE_DIR, installed
+from gsettings import GSettings
+from xfconf import Xfconf
+from snapd import Snapd, SnapdError
+import privileged
+import manifest
+import buildcache
+import bundle
+import sync
+import iconcache
+import recolor
+from configstore import ConfigStore
+import spec
+import multiuser
+import tracing
+import fingerprint
+from paths import HOME, SYSTEM_PREFIX, REPO_DIR, SRC, GTK4_DIR, FIREFOX_DIR, VSCODE_DIR, CACHE_DIR, DE_CACHE, BUILD_CACHE, STAGE_DIR, FINGERPRINTS, installed, invalidate
 
 NC = '\033[0m'
 BOLD = '\033[1m'
@@ -28,7 +47,7 @@ VARIANTS = { # all of the possible configurations, name: pretty-name
     'dir': {
         'default': f'Default  {BGREEN}(Recommended for most distros){NC}',
         'home': f'{HOME}/.local/share  {BYELLOW}(Only recommended for immutable distros){NC}',
-        'root': f'/usr/share  {BYELLOW}(Do not choose if you use Flatpaks){NC}'
+        'root': f'{SYSTEM_PREFIX}/share  {BYELLOW}(Do not choose if you use Flatpaks){NC}'
     },
     'color': {
         'orange': 'Orange',
@@ -96,6 +115,18 @@ VERSIONS = {
     'budgie': (10.6,)
 }
 
+# Commands used to get the versions of the installed desktops, name: (command, regex of what to ignore in output)
+DE_PROBES = {
+    'gnome': (['gnome-shell', '--version'], r'\.[0-9]?\n?$|\D'),
+    'cinnamon': (['cinnamon', '--version'], r'\.[0-9]\.?[0-9]?[0-9]?\n?$|^Cinnamon '),
+    'unity': (['unity', '--version'], r'\.[0-9]\.[0-9]?\n?$|\D'),
+    'mate': (['mate-session', '--version'], r'\.[0-9][0-9]?\.[0-9][0-9]?\n?$|^mate-session '),
+    'budgie': (['budgie-desktop', '--version'], r'Copyright.*\n|\.[0-9]\n|^budgie-desktop')
+}
+
+# Seconds to wait for a desktop to print its version before assuming it isn't usable
+DE_PROBE_TIMEOUT = 5
+
 DIR_MSG = f'{BLBLUE}Where do you want to {NC}{BLCYAN}install the theme{NC}{BLBLUE}?{NC}'
 SETTINGS_MSG = f'{BLBLUE}Do you want to theme the {NC}{BLCYAN}settings pages{NC}{BLBLUE} in {BLCYAN}Firefox{BLBLUE}?{NC}{BOLD}'
 SYNTAX_MSG = f'{BLBLUE}Do you want to keep the {NC}{BLCYAN}default syntax highlighting{NC}{BLBLUE} in {BLCYAN}VS Code{BLBLUE}?{NC}{BOLD}'
@@ -118,8 +149,44 @@ OLD_THEMES = [
 # anything in dg-yaru or dg-adw-gtk3
 MESON_THEMES = list(VARIANTS['enableable']['dg-yaru'].keys()) + list(VARIANTS['enableable']['dg-adw-gtk3'].keys())
 
+# dg-yaru options that only some of its parts use, option: parts
+# Changing them doesn't reinstall dg-yaru unless one of the parts is installed, the cursors and sounds don't have an accent color
+YARU_OPTION_PARTS = {
+    'accent-colors': ('gnome-shell', 'cinnamon-shell', 'metacity', 'ubuntu-unity', 'xfwm4', 'icons', 'gtksourceview'),
+    'window-controls': ('metacity', 'ubuntu-unity', 'xfwm4'),
+    'panel-icons': ('icons',),
+    'gnome-shell-version': ('gnome-shell',),
+}
+
+# Installed once for every user when installing for several users, the other parts are in the home directory of each user
+SHARED_COMPONENTS = ('dg-adw-gtk3', 'dg-yaru', 'qualia-gtk-theme-snap')
+
+# The configuration the shared themes are built with, so it is the same for every user
+SHARED_KEYS = ('dir', 'color', 'window-controls')
+
 # Set some things to false
-reinstall = no_update = update_color = update_theme = update_settings = update_syntax = reconfigure = verbose = force = configured = updated = False
+no_update = update_color = update_theme = update_settings = update_syntax = reconfigure = verbose = force = explain = configured = updated = False
+
+# Maximum number of themes to install at once, None means one per CPU
+jobs = None
+
+# Bundle of prebuilt themes to install from instead of building them, None means build them
+bundle_file = None
+
+# Configuration read from a spec instead of prompting, see spec.py, None means prompt
+config_spec = None
+
+# What this run installs, 'all', 'shared' for the themes in /usr when installing for several users, or 'user' for the parts in the home directory
+scope = 'all'
+
+# Users to install for after the shared themes are installed, see multiuser.py
+users = []
+
+# File to write a Chrome trace of the run to, None means don't trace it
+trace_file = None
+
+# Held while installing into a shared prefix, so dg-adw-gtk3 and dg-yaru don't write to the same theme dirs at once
+prefix_lock = threading.Lock()
 
 #################
 ##  Functions  ##
@@ -136,7 +203,7 @@ def cd(directory):
         print(f"Changing directory to '{directory}'")
     os.chdir(directory)
 
-def run_command(command, meson = False, override_verbose = None, show_ouput = False):
+def run_command(command, meson = False, override_verbose = None, show_ouput = False, cwd = None):
     '''
     Run an external command and handle errors.
 
@@ -145,69 +212,282 @@ def run_command(command, meson = False, override_verbose = None, show_ouput = Fa
         meson (bool) : If the option to clean build dir should be printed.
         override_verbose (bool) : Override the global verbose value.
         show_ouput (bool) : Show output of command.
+        cwd (str) : Directory to run the command in. Defaults to the current directory.
     '''
     if override_verbose is None:
         global verbose
     else:
         verbose = override_verbose
     if verbose:
-        print("Running command '" + ' '.join(command) + "'")
+        progress.print("Running command '" + ' '.join(command) + "'")
     try:
-        subprocess.run(command, stdout=None if verbose or show_ouput else subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+        # When not verbose, output is printed through progress so it doesn't end up in the middle of the spinners
+        with tracing.command(command, cwd) as info:
+            process = subprocess.Popen(command, stdout=None if verbose else subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
+            output = []
+            if process.stdout is not None:
+                with process.stdout:
+                    for line in process.stdout:
+                        output.append(line)
+                        if show_ouput:
+                            progress.print(line.decode('utf-8', 'replace').rstrip('\n'))
+            info['exit code'] = process.wait()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, b''.join(output))
     except subprocess.CalledProcessError as error:
-        if not (verbose or show_ouput):
-            print('\n' + error.output.decode("utf-8"))
+        if not verbose:
+            if not show_ouput:
+                print('\n' + error.output.decode("utf-8"))
             print(f"{BRED}Something went wrong, run {BLRED}'{sys.argv[0]} --verbose'{BRED} for more info.{NC}")
         else:
             print(f'{BRED}Something went wrong. Check the log above.{NC}')
         if meson:
             print(f"{BRED}Also, running {BLRED}'{sys.argv[0]} --clean'{BRED} might fix the issue.{NC}")
-        print('\033[?25h') # bring back cursor
+        progress.show_cursor()
+        write_trace()
+        os._exit(1)
+
+def file_operations(operations):
+    '''
+    Run file operations in the theme directories and handle errors, see privileged.batch.
+
+    Parameters:
+        operations (list) : The operations to run.
+    '''
+    iconcache.touch([operation['path'] for operation in operations])
+    try:
+        privileged.batch(operations, verbose)
+    except privileged.PrivilegedError as error:
+        print(f'{BRED}Something went wrong:{NC}\n{error}')
+        progress.show_cursor()
+        write_trace()
         os._exit(1)
 
-def check_output(command):
+def switch_gtk4_variant(variant):
+    '''
+    Point the GTK4 configuration at the light or dark variant, by replacing the 'current' link in one rename.
+
+    Parameters:
+        variant (str) : Either 'light' or 'dark'.
+    '''
+    current = f'{GTK4_DIR}/qualia/current'
+    operations = []
+    if not os.path.islink(current) or os.readlink(current) != variant:
+        operations.append({'op': 'symlink', 'path': current, 'target': f'{GTK4_DIR}/qualia/{variant}'})
+    for name in ('gtk.css', 'mac-icons'):
+        link = f'{GTK4_DIR}/{name}'
+        if os.path.lexists(f'{GTK4_DIR}/qualia/{variant}/{name}'):
+            if not os.path.islink(link) or os.readlink(link) != f'qualia/current/{name}':
+                operations.append({'op': 'symlink', 'path': link, 'target': f'{current}/{name}'})
+        elif os.path.islink(link) and os.readlink(link) == f'qualia/current/{name}':
+            operations.append({'op': 'unlink', 'path': link})
+    file_operations(operations)
+
+def panel_icons(desktop_versions):
+    '''
+    Parameters:
+        desktop_versions (dict) : The versions of the installed desktops, None if a desktop isn't installed.
+
+    Returns:
+        panel_icons (bool) : Whether or not the icons are built with the panel icons, which Unity and MATE use.
+    '''
+    return desktop_versions.get('unity') is not None or desktop_versions.get('mate') is not None
+
+def disabled_paths(config, component):
+    '''
+    Parameters:
+        config (dict) : Dictionary that contains the configuration.
+        component (str) : The part of the theme.
+
+    Returns:
+        paths (tuple) : The installed paths of its parts that are turned off, ending in '/' so a path is in them if it starts with one after adding '/'.
+            They are removed by the cleanup instead of when it is installed, so the desktops go back to the themes they used before.
+    '''
+    parts = [part for part in VARIANTS['enableable'].get(component, {}) if part not in config['enabled']]
+    if len(parts) == 0:
+        return ()
+    current = installed(new_only = True)
+    return tuple(path + '/' for part in parts if part in current for path in current[part])
+
+def theme_color(theme_dir):
+    '''
+    Parameters:
+        theme_dir (str) : A theme dir, like '~/.local/share/themes/qualia-blue-dark'.
+
+    Returns:
+        color (str) : The accent color it is for.
+    '''
+    name = os.path.basename(theme_dir)
+    for color in VARIANTS['color']:
+        if name == f'qualia-{color}' or name.startswith((f'qualia-{color}-', f'qualia-{color}.')):
+            return color
+    return 'orange'
+
+def write_trace():
+    '''Write the trace and print the summary of where the time went, if --trace was used.'''
+    if trace_file is None:
+        return
+    tracing.phase(None)
+    try:
+        tracing.write(trace_file)
+    except OSError as error:
+        print(f"{BRED}Can't write the trace to '{trace_file}': {error}{NC}")
+    print(tracing.table())
+
+def in_scope(component):
+    '''
+    Parameters:
+        component (str) : The part of the theme.
+
+    Returns:
+        in_scope (bool) : Whether or not this run installs it, see scope.
+    '''
+    if scope == 'all' or component == 'bundle':
+        return True
+    return (component in SHARED_COMPONENTS) == (scope == 'shared')
+
+def check_output(command, cwd = None):
     '''
     Check output of command.
 
     Parameters:
         command (list) : A list of the command and arguments to run.
+        cwd (str) : Directory to run the command in. Defaults to the current directory.
 
     Returns:
         output (str) : The ouput of the command.
     '''
-    output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').strip('\'\n')
+    with tracing.command(command, cwd) as info:
+        result = subprocess.run(command, stdout=subprocess.PIPE, check=False, cwd=cwd)
+        info['exit code'] = result.returncode
+    result.check_returncode()
+    output = result.stdout.decode('utf-8').strip('\'\n')
     return output
 
+def update_submodules(submodules, max_jobs = None):
+    '''
+    Check out the commits of the submodules that the superproject points to, updating them at the same time.
+
+    Parameters:
+        submodules (list) : Paths to the submodules to update.
+        max_jobs (int) : The maximum number of submodules to update at once. Defaults to one per CPU.
+    '''
+    submodules = [os.path.relpath(i, REPO_DIR) for i in submodules]
+    if len(submodules) == 0:
+        return
+
+    # Lines start with ' ' if the checked out commit matches the superproject, '-' if not initialized, and '+' if it doesn't match
+    status = check_output(['git', 'submodule', 'status', '--'] + submodules, cwd=REPO_DIR).split('\n')
+    stale = []
+    uninitialized = []
+    for line in status:
+        if len(line.strip()) == 0:
+            continue
+        path = line[1:].split()[1]
+        if line[0] != ' ':
+            stale.append(path)
+        if line[0] == '-':
+            uninitialized.append(path)
+
+    if len(stale) == 0:
+        return
+
+    # Only init writes to .git/config, so do it once for all of them before updating in parallel
+    if len(uninitialized) > 0:
+        run_command(['git', 'submodule', 'init', '--'] + uninitialized, cwd=REPO_DIR)
+
+    def update(path):
+        start = time.monotonic()
+        with tracing.span(path, 'submodules'):
+            run_command(['git', 'submodule', 'update', '--', path], cwd=REPO_DIR)
+        return path, time.monotonic() - start
+
+    print(f'{BGREEN}Updating{NC} the submodules.')
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        for path, seconds in executor.map(update, stale):
+            print(f'Updated {BOLD}{os.path.basename(path)}{NC} in {seconds:.1f}s.')
+
+def schedule(threads, max_jobs = None, on_done = None):
+    '''
+    Run install threads on a bounded number of workers, starting the next one whenever one finishes.
+
+    The themes don't use each other's files, and dg-adw-gtk3 and dg-yaru only write to a shared prefix
+    while holding prefix_lock, so they can be installed in any order.
+
+    Parameters:
+        threads (list) : The InstallThread objects to run.
+        max_jobs (int) : The maximum number of threads running at once. Defaults to one per CPU.
+        on_done (callable) : Called from the main thread with each thread after it finishes.
+    '''
+    if max_jobs is None:
+        max_jobs = os.cpu_count() or 1
+    max_jobs = max(1, max_jobs)
+
+    pending = list(threads)
+    done = queue.Queue()
+    running = 0
+
+    while pending or running > 0:
+        while pending and running < max_jobs:
+            thread = pending.pop(0)
+            thread.done = done
+            thread.start()
+            running += 1
+
+        thread = done.get()
+        running -= 1
+        if on_done is not None:
+            on_done(thread)
+
 def main():
     '''The main function.'''
     #####################
     ##  Configuration  ##
     #####################
 
-    if shutil.which('sassc') is None:
+    tracing.phase('configuration')
+
+    # Nothing has to be built when installing from a bundle
+    if shutil.which('sassc') is None and bundle_file is None:
         print(f"{BLRED}'sassc'{BRED} not found, exiting.{NC}")
         sys.exit()
 
-    if shutil.which('git') is None:
+    if shutil.which('git') is None and bundle_file is None:
         print(f"{BLRED}'git'{BRED} not found, exiting.{NC}")
         sys.exit()
 
+    index = None
+    if bundle_file is not None:
+        try:
+            index = bundle.read_index(bundle_file)
+        except bundle.BundleError as error:
+            print(f'{BRED}{error}{NC}')
+            sys.exit(1)
+
     conf = Config()
     conf.read()
 
     global configure_all
-    global reinstall
+    global update_dir, update_color, update_theme, update_window_controls, update_settings, update_syntax
+    global config_spec
 
-    # Move old config file
-    if os.path.isfile(OLD_CONFIG) and not os.path.isfile(CONFIG):
-        shutil.move(OLD_CONFIG, CONFIG)
+    # Users that installed the theme before keep their own choices, except for what the themes in /usr were built with
+    if scope == 'user' and config_spec is not None and 'enabled' in conf.ret_config():
+        config_spec = {**Config.to_spec(conf.ret_config()), **{key: config_spec[key] for key in SHARED_KEYS if key in config_spec}}
 
     # Whether or not to configure
-    if not os.path.isfile(CONFIG) or reconfigure:
+    if config_spec is not None:
+        changed = conf.apply_spec(config_spec)
+        # Like the options that change one part of the configuration, only what the spec changed is reinstalled
+        configure_all = not conf.store.exists() or 'enabled' in changed or 'flatpak' in changed
+        update_dir = 'dir' in changed
+        update_color = 'color' in changed
+        update_theme = 'theme' in changed
+        update_window_controls = 'window-controls' in changed
+        update_settings = update_syntax = False
+    elif not conf.store.exists() or reconfigure:
         configure_all = True
         conf.configure()
-        if os.path.isfile(CONFIG):
-            os.remove(CONFIG)
 
     config = conf.ret_config()
 
@@ -222,16 +502,19 @@ def main():
         conf.configure()
 
     # Reconfigure color, theme variant, or syntax highlighting if user wants to
-    if ( update_color or update_theme or update_syntax or update_settings or update_dir or update_window_controls ) and not configure_all:
+    if ( update_color or update_theme or update_syntax or update_settings or update_dir or update_window_controls ) and not configure_all and config_spec is None:
         conf.configure()
 
     if configured:
         config = conf.ret_config()
 
-    conf.write(config)
+    # The shared themes are built once, so they have to be somewhere every user can read them
+    if scope == 'shared' and config['dir'] != 'root':
+        print(f'{BYELLOW}Installing for several users, so the themes are installed in {BOLD}{SYSTEM_PREFIX}/share{NC}{BYELLOW}.{NC}')
+        config['dir'] = 'root'
+        update_dir = True
 
-    if configure_all or force or update_color:
-        reinstall = True
+    conf.write(config)
 
     ######################
     ##  Install Themes  ##
@@ -265,13 +548,13 @@ def main():
                 for path in i:
                     if name == 'icons' and path in paths['cursors']:
                         pass
-                    else:
-                        exists = os.path.exists(path)
+                    elif os.path.lexists(path):
+                        exists = True
             else:
                 if name == 'icons' and i in paths['cursors']:
                     pass
-                else:
-                    exists = os.path.exists(i)
+                elif os.path.lexists(i):
+                    exists = True
         if should_print and exists:
             message = ''
             for theme in VARIANTS['enableable']:
@@ -287,19 +570,24 @@ def main():
 
         return exists
 
+    threads = []
+    bundle_dirs = {} # {component: directory}, the parts to install from the bundle
+    disabled = [] # parts that are turned off in a theme that is still installed, they are removed by the cleanup
+
     # Install dg-adw-gtk3
     if 'gtk3' in config['enabled'] or 'gtk4-libadwaita' in config['enabled']:
         # If user is installing in root dir, remove old symlinks if they exist
-        if config['dir'] == 'root':
+        if config['dir'] == 'root' and in_scope('dg-adw-gtk3'):
             dirs = paths['gtk3'] + paths['gtk4-libadwaita']
             if isinstance(dirs, list):
-                for directory in dirs:
-                    if os.path.islink(directory):
-                        run_command(['sudo', 'rm', '-rf', directory])
+                file_operations([{'op': 'unlink', 'path': directory} for directory in dirs if os.path.islink(directory)])
 
-        gtk3 = InstallDgAdwGtk3(config)
-        config['dg-adw-gtk3_version'] = gtk3.get_version()
-        conf.write(config)
+        if index is not None:
+            bundle_dirs['dg-adw-gtk3'] = f'{HOME}/.local' if config['dir'] in ('default', 'home') else SYSTEM_PREFIX
+        else:
+            threads.append(InstallDgAdwGtk3(config))
+        if in_scope('dg-adw-gtk3'):
+            disabled += [i for i in ('gtk3', 'gtk4-libadwaita') if i not in config['enabled']]
     else:
         check_path('gtk3', paths)
         check_path('gtk4', paths)
@@ -318,164 +606,304 @@ def main():
             yaru_disabled.append(i)
 
     if len(yaru_parts) > 0:
-        yaru = InstallDgYaru(config, yaru_parts, yaru_parts_pretty)
-        config['dg-yaru_version'] = yaru.get_version()
-        conf.write(config)
-    for i in yaru_disabled:
-        check_path(i, paths)
+        if index is not None:
+            bundle_dirs['dg-yaru'] = f'{HOME}/.local' if config['dir'] == 'home' else SYSTEM_PREFIX
+        else:
+            threads.append(InstallDgYaru(config, yaru_parts, yaru_parts_pretty))
+    if len(yaru_parts) > 0 and in_scope('dg-yaru'):
+        disabled += yaru_disabled
+    else:
+        for i in yaru_disabled:
+            check_path(i, paths)
 
     # Install dg-libadwaita
     if 'gtk4' in config['enabled']:
-        gtk4 = InstallDgLibadwaita(config)
-        config['dg-libadwaita_version'] = gtk4.get_version()
-        conf.write(config)
+        if index is not None:
+            bundle_dirs['dg-libadwaita'] = HOME
+        else:
+            threads.append(InstallDgLibadwaita(config))
     else:
         check_path('gtk4', paths)
 
+    bundle_dirs = {component: directory for component, directory in bundle_dirs.items() if in_scope(component)}
+    if len(bundle_dirs) > 0:
+        threads.append(InstallBundle(config, index, bundle_dirs))
+
+    # The Firefox and VS Code themes aren't prebuilt, so they are still installed from the submodules
+    def from_submodule(name, src):
+        if index is None or (shutil.which('git') is not None and os.path.isdir(f'{src}/.git')):
+            return True
+        print(f"{BYELLOW}The {name} theme isn't in the bundle and its submodule isn't available, skipping it.{NC}")
+        return False
+
     # Install dg-firefox-theme
     if 'firefox' in config['enabled']:
-        firefox = InstallDgFirefoxTheme(config)
-        config['dg-firefox-theme_version'] = firefox.get_version()
-        conf.write(config)
+        if from_submodule('Firefox', SRC['firefox']):
+            threads.append(InstallDgFirefoxTheme(config))
     else:
         check_path('firefox', paths)
 
     # Install dg-vscode-adwiata
     if 'vscode' in config['enabled']:
-        vscode = InstallDgVscodeAdwaita(config)
-        config['dg-vscode-adwaita_version'] = vscode.get_version()
-        conf.write(config)
+        if from_submodule('VS Code', SRC['vscode']):
+            threads.append(InstallDgVscodeAdwaita(config))
     else:
         check_path('vscode', paths)
 
     # Install snap theme
-    if 'snap' in config['enabled']:
+    snapd = Snapd(verbose=verbose)
+    if 'snap' in config['enabled'] and in_scope('qualia-gtk-theme-snap'):
+        # Check that snapd can reach the store
+        if snapd.available() and snapd.connectivity():
+            threads.append(InstallQualiaGtkThemeSnap(config, snapd))
+    elif snapd.available() and in_scope('qualia-gtk-theme-snap'):
         try:
-            # Check that there is an internet connection
-            urlopen('https://www.google.com/', timeout=3)
-            InstallQualiaGtkThemeSnap(config)
-        except OSError:
-            pass
-    elif shutil.which('snap'):
-        snap_list = check_output(['snap', 'list'])
-        for line in snap_list:
-            line = line.split()
-            if 'qualia-gtk-theme' in line:
+            if 'qualia-gtk-theme' in snapd.snaps():
                 print("Snap theme was installed previously, use './uninstall.py snap' to remove it.")
+        except (OSError, SnapdError):
+            pass
+
+    def record(component, paths):
+        '''
+        Delete the files a theme installed before for another accent color, window controls variant or directory, and add what it installed to its manifest.
+
+        Parameters:
+            component (str) : The part of the theme.
+            paths (list) : Every file and directory it installed.
+        '''
+        # Like the themes for the previous accent color, the empty theme dirs are removed by the cleanup
+        stale = manifest.stale(component, paths)
+        if len(stale) > 0:
+            kept = disabled_paths(config, component)
+            theme_dirs = {manifest.theme_dir(path) for path in paths}
+            # A theme dir that is still installed can have files from another accent color, since the orange
+            # theme dirs have no accent color in their name and the cursors are installed in them for every accent color
+            stale = [path for path in stale if not (path + '/').startswith(kept)
+                     and (manifest.theme_dir(path) not in theme_dirs or theme_color(manifest.theme_dir(path)) != config['color'])]
+        if len(stale) > 0:
+            file_operations([{'op': 'unlink', 'path': path} for path in stale])
+        manifest.record(component, paths)
+
+    def finished(thread):
+        '''
+        Save the version of a theme to the config file once it is installed.
+
+        Parameters:
+            thread (InstallThread) : The thread that finished.
+        '''
+        if thread.failed:
+            return # it is installed again next time, since nothing about this install is recorded
+        if thread.src is not None:
+            config[f'{thread.component}_version'] = thread.get_version()
+            if thread.inputs is not None:
+                config['fingerprints'][thread.component] = fingerprint.record(thread.inputs)
+            conf.write(config)
+            if thread.changed or manifest.load(thread.component) is None:
+                record(thread.component, thread.installed_paths())
+        elif isinstance(thread, InstallBundle):
+            for component, paths in thread.extracted.items():
+                config[f'{component}_version'] = thread.versions[component]
+                # What the bundle installed wasn't built here, so the next build from the submodule can't be skipped
+                config['fingerprints'].pop(component, None)
+                record(component, paths)
+            conf.write(config)
+
+    threads = [thread for thread in threads if in_scope(thread.component)]
+
+    tracing.phase('submodules')
+    if not no_update and shutil.which('git') is not None:
+        update_submodules([thread.src for thread in threads if thread.src is not None], jobs)
+
+    tracing.phase('install')
+    signal.signal(signal.SIGWINCH, progress.resize)
+    schedule(threads, jobs, finished)
+    invalidate() # the themes changed what is installed
 
     #####################
     ##  Enable Themes  ##
     #####################
 
-    gtk3_name = f"qualia{config['suffix']}-{config['window-controls']}" if config['color'] == 'orange' else f"qualia-{config['color']}{config['suffix']}-{config['window-controls']}"
-    theme_name = f"qualia{config['suffix']}" if config['color'] == 'orange' else f"qualia-{config['color']}{config['suffix']}"
-    icon_name = 'qualia-dark' if config['color'] == 'orange' else f"qualia-{config['color']}-dark"
-    cursor_name = 'qualia'
-    sourceview_name = f"qualia{config['suffix']}"
-    xfwm4_name = f"qualia{config['suffix']}-{config['window-controls']}"
-    if shutil.which('xfconf-query') is not None:
-        if 'xsettings' in check_output(['xfconf-query', '-l']) and check_output(['xfconf-query', '-c', 'xsettings', '-p', '/Gdk/WindowScalingFactor']) == '2':
-            xfwm4_name += '-xhdpi'
-
-    cd(REPO_DIR)
-
-    kwargs = {
-        'gtk3': gtk3_name,
-        'icons': icon_name,
-        'cursors': cursor_name,
-        'sounds': cursor_name,
-        'gnome-shell': theme_name,
-        'cinnamon-shell': theme_name,
-        'metacity': xfwm4_name,
-        'xfwm4': xfwm4_name,
-        'gtksourceview': sourceview_name
-    }
+    # When installing for several users, the themes are enabled by the run for each user
+    if scope != 'shared':
+        tracing.phase('enable')
+        gtk3_name = f"qualia{config['suffix']}-{config['window-controls']}" if config['color'] == 'orange' else f"qualia-{config['color']}{config['suffix']}-{config['window-controls']}"
+        theme_name = f"qualia{config['suffix']}" if config['color'] == 'orange' else f"qualia-{config['color']}{config['suffix']}"
+        icon_name = 'qualia-dark' if config['color'] == 'orange' else f"qualia-{config['color']}-dark"
+        cursor_name = 'qualia'
+        sourceview_name = f"qualia{config['suffix']}"
+        xfwm4_name = f"qualia{config['suffix']}-{config['window-controls']}"
+        xfconf = Xfconf(verbose)
+        if xfconf.available():
+            if 'xsettings' in xfconf.channels() and xfconf.get('xsettings', '/Gdk/WindowScalingFactor') == '2':
+                xfwm4_name += '-xhdpi'
 
-    enable = Enable(config, verbose, **kwargs)
+        cd(REPO_DIR)
 
-    config = enable.enable_theme()
+        kwargs = {
+            'gtk3': gtk3_name,
+            'icons': icon_name,
+            'cursors': cursor_name,
+            'sounds': cursor_name,
+            'gnome-shell': theme_name,
+            'cinnamon-shell': theme_name,
+            'metacity': xfwm4_name,
+            'xfwm4': xfwm4_name,
+            'gtksourceview': sourceview_name
+        }
 
-    # Update config file one last time
-    conf.write(config)
+        enable = Enable(config, verbose, **kwargs)
+
+        config = enable.enable_theme()
+
+        # Update config file one last time
+        conf.write(config)
+
+        # Set color scheme
+        tracing.phase('settings')
+        settings = GSettings(verbose)
+        try:
+            if config['color_scheme'] is not None and settings.available():
+                if settings.has_schema('org.gnome.desktop.interface'):
+                    settings.set('org.gnome.desktop.interface', 'color-scheme', config['color_scheme'])
+                if config['desktop_versions']['budgie'] is not None and settings.has_schema('com.solus-project.budgie-panel'):
+                    dark = 'true' if config['color_scheme'] == 'prefer-dark' else 'false'
+                    settings.set('com.solus-project.budgie-panel', 'dark-theme', dark)
+                settings.apply()
+        except subprocess.CalledProcessError:
+            pass
+
+        if config['flatpak']:
+            print('Giving Flatpak apps access to the GTK themes.')
+            run_command(['flatpak', 'override', '--user', '--filesystem=xdg-config/gtk-4.0', '--filesystem=xdg-data/themes'])
+
+    # The themes in /usr are cleaned up by the run that installed them
+    if scope != 'user':
+        # Remove old variants of the theme
+        tracing.phase('cleanup')
+        from uninstall import remove_theme, available_themes, remove_empty, delete, enable_old
+
+        print('Cleaning up...')
 
-    # Set color scheme
+        old_paths = installed(old_only=True)
+        for theme in OLD_THEMES:
+            remove_theme(theme, available_themes[theme], old_paths, True, False, verbose)
+
+        if config['dir'] == 'root':
+            home_paths = installed(directory='home')
+            for theme in MESON_THEMES:
+                remove_theme(theme, available_themes[theme], home_paths, True, False, verbose)
+        elif config['dir'] == 'home':
+            root_paths = installed(directory='root')
+            for theme in MESON_THEMES:
+                remove_theme(theme, available_themes[theme], root_paths, True, False, verbose)
+        elif config['dir'] == 'default':
+            non_default_paths = installed(directory='not_default')
+            for theme in MESON_THEMES:
+                remove_theme(theme, available_themes[theme], non_default_paths, True, False, verbose, True)
+
+        theme_dirs = installed(new_only = True, just_theme_dirs = True)
+
+        stale = {} # used as an ordered set
+        for i in theme_dirs:
+            if 'share/themes' in i:
+                paths = glob(f'{i}/*')
+            else:
+                paths = [i]
+            for path in paths:
+                for variant in VARIANTS['window-controls']:
+                    if variant != config['window-controls'] and variant in path:
+                        stale[path] = None
+                    for subdir in ('gtk-2.0', 'gtk-3.0', 'gtk-4.0', 'xfwm4', 'metacity', 'unity'):
+                        if path.endswith(subdir) and config['window-controls'] not in path:
+                            stale[path] = None
+                for color in VARIANTS['color']:
+                    if color != config['color'] and color in path:
+                        stale[path] = None
+                        break
+        delete(*stale)
+
+        # Parts that were turned off, the desktops go back to the themes they used before
+        current_paths = installed(new_only = True)
+        removing = [i for i in disabled if check_path(i, current_paths, False)]
+        if len(removing) > 0:
+            enable_old(config, removing)
+            for i in removing:
+                remove_theme(i, available_themes[i], current_paths, False, False, verbose)
+
+        remove_empty()
+
+        theme_dirs = installed(new_only = True, just_theme_dirs = True, directory = 'home')
+
+        # Symlink themes to /usr dir if using mate
+        if config['desktop_versions']['mate'] is not None and config['dir'] == 'default':
+            if isinstance(theme_dirs, list):
+                operations = []
+                for directory in theme_dirs:
+                    paths = glob(f'{directory}/*')
+                    for target in paths:
+                        dest = SYSTEM_PREFIX + target.split(f'{HOME}/.local')[1]
+                        directory = os.path.dirname(dest)
+                        if not os.path.isdir(directory) and {'op': 'mkdir', 'path': directory} not in operations:
+                            operations.append({'op': 'mkdir', 'path': directory})
+                        if not os.path.exists(dest) and os.path.exists(target):
+                            operations.append({'op': 'symlink', 'path': dest, 'target': target})
+                file_operations(operations)
+
+    # Only the icon themes that had files installed or deleted need a new cache
+    tracing.phase('icon caches')
     try:
-        if config['color_scheme'] is not None and shutil.which('gsettings') is not None:
-            subprocess.run(['gsettings', 'set', 'org.gnome.desktop.interface', 'color-scheme', config['color_scheme']], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, check=True)
-            if config['desktop_versions']['budgie'] is not None:
-                dark = 'true' if config['color_scheme'] == 'prefer-dark' else 'false'
-                subprocess.run(['gsettings', 'set', 'com.solus-project.budgie-panel', 'dark-theme', dark ], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, check=True)
-    except subprocess.CalledProcessError:
-        pass
-
-    if config['flatpak']:
-        print('Giving Flatpak apps access to the GTK themes.')
-        run_command(['flatpak', 'override', '--user', '--filesystem=xdg-config/gtk-4.0', '--filesystem=xdg-data/themes'])
-
-    # Remove old variants of the theme
-    from uninstall import remove_theme, available_themes, remove_empty, delete
-
-    print('Cleaning up...')
-
-    old_paths = installed(old_only=True)
-    for theme in OLD_THEMES:
-        remove_theme(theme, available_themes[theme], old_paths, True, False, verbose)
-
-    if config['dir'] == 'root':
-        home_paths = installed(directory='home')
-        for theme in MESON_THEMES:
-            remove_theme(theme, available_themes[theme], home_paths, True, False, verbose)
-    elif config['dir'] == 'home':
-        root_paths = installed(directory='root')
-        for theme in MESON_THEMES:
-            remove_theme(theme, available_themes[theme], root_paths, True, False, verbose)
-    elif config['dir'] == 'default':
-        non_default_paths = installed(directory='not_default')
-        for theme in MESON_THEMES:
-            remove_theme(theme, available_themes[theme], non_default_paths, True, False, verbose, True)
-
-    theme_dirs = installed(new_only = True, just_theme_dirs = True)
-
-    for i in theme_dirs:
-        if 'share/themes' in i:
-            paths = glob(f'{i}/*')
-        else:
-            paths = [i]
-        for path in paths:
-            for variant in VARIANTS['window-controls']:
-                if variant != config['window-controls'] and variant in path:
-                    delete(path)
-                for subdir in ('gtk-2.0', 'gtk-3.0', 'gtk-4.0', 'xfwm4', 'metacity', 'unity'):
-                    if path.endswith(subdir) and config['window-controls'] not in path:
-                        delete(path)
-            for color in VARIANTS['color']:
-                if color != config['color'] and color in path:
-                    delete(path)
-                    break
-
-    remove_empty()
-
-    theme_dirs = installed(new_only = True, just_theme_dirs = True, directory = 'home')
-
-    # Symlink themes to /usr dir if using mate
-    if config['desktop_versions']['mate'] is not None and config['dir'] == 'default':
-        if isinstance(theme_dirs, list):
-            for directory in theme_dirs:
-                paths = glob(f'{directory}/*')
-                for target in paths:
-                    dest = '/usr' + target.split(f'{HOME}/.local')[1]
-                    directory = os.path.dirname(dest)
-                    if not os.path.isdir(directory):
-                        run_command(['sudo', 'mkdir', '-p', directory])
-                    if not os.path.exists(dest) and os.path.exists(target):
-                        run_command(['sudo', 'ln', '-rsf', target, dest])
+        for theme, seconds in iconcache.update(verbose):
+            print(f'Regenerated the icon cache of {BOLD}{os.path.basename(theme)}{NC} in {os.path.dirname(theme)} in {seconds:.2f}s')
+    except privileged.PrivilegedError as error:
+        print(f'{BRED}Regenerating the icon caches failed:{NC}\n{error}')
+
+    if len(users) > 0:
+        tracing.phase('users')
+        install_for_users(config)
 
     if updated:
         print(f"{BYELLOW}Log out and log back in for everything to be updated.{NC}")
 
+    write_trace()
+
+def install_for_users(config):
+    '''
+    Install and enable the parts of the theme in the home directory of each user, after the shared themes are installed.
+
+    Parameters:
+        config (dict) : The configuration, users that don't have their own config get the same one.
+    '''
+    user_spec = dict(config_spec) if config_spec is not None else Config.to_spec(config)
+    user_spec.update({key: config[key] for key in SHARED_KEYS})
+
+    args = ['--no-update']
+    for flag, option in ((verbose, '--verbose'), (force, '--force'), (explain, '--explain')):
+        if flag:
+            args.append(option)
+    if bundle_file is not None:
+        args += ['--bundle', os.path.abspath(bundle_file)]
+
+    # Ask for the password once, instead of in every sudo at the same time
+    run_command(['sudo', '-v'], override_verbose=False)
+
+    def done(user, returncode, output, seconds):
+        if returncode == 0:
+            print(f'{BGREEN}Installed{NC} for {BOLD}{user.pw_name}{NC} in {seconds:.1f}s.')
+            if verbose:
+                print(output.rstrip('\n'))
+        else:
+            print(f'{BRED}Installing for {BLRED}{user.pw_name}{BRED} failed:{NC}\n{output.rstrip()}')
+
+    failed = multiuser.install(users, user_spec, args, jobs, done)
+    if len(failed) > 0:
+        print(f"{BRED}Installing failed for {', '.join(failed)}.{NC}")
+        sys.exit(1)
+
 class Config:
     '''Handles configuration of theme.'''
     def __init__(self):
+        self.store = ConfigStore()
+        self.fingerprints = ConfigStore(FINGERPRINTS, ()) # kept out of the config so it stays small, see fingerprint.py
         self.config = {}
         self.config['desktop_versions'] = self.get_desktops()
         self.config['enableable'] = self.get_enableable(self.config['desktop_versions'])
@@ -498,11 +926,17 @@ class Config:
         '''
         desktop_versions = {}
 
-        desktop_versions['gnome'] = self.check_de_version(['gnome-shell', '--version'], r'\.[0-9]?\n?$|\D', 'gnome')
-        desktop_versions['cinnamon'] = self.check_de_version(['cinnamon', '--version'], r'\.[0-9]\.?[0-9]?[0-9]?\n?$|^Cinnamon ', 'cinnamon')
-        desktop_versions['unity'] = self.check_de_version(['unity', '--version'], r'\.[0-9]\.[0-9]?\n?$|\D', 'unity')
-        desktop_versions['mate'] = self.check_de_version(['mate-session', '--version'], r'\.[0-9][0-9]?\.[0-9][0-9]?\n?$|^mate-session ', 'mate')
-        desktop_versions['budgie'] = self.check_de_version(['budgie-desktop', '--version'], r'Copyright.*\n|\.[0-9]\n|^budgie-desktop', 'budgie')
+        self.de_cache = self.read_de_cache()
+        self.de_cache_changed = False
+
+        # The probes mostly wait on the desktops starting up, so run them all at once
+        with ThreadPoolExecutor(max_workers=len(DE_PROBES)) as executor:
+            futures = {name: executor.submit(self.check_de_version, command, regex, name) for name, (command, regex) in DE_PROBES.items()}
+            for name, future in futures.items():
+                desktop_versions[name] = future.result()
+
+        if self.de_cache_changed:
+            self.write_de_cache()
 
         if shutil.which('xfce4-session') is not None:
             desktop_versions['xfce'] = VERSIONS['xfce'][0]
@@ -511,6 +945,62 @@ class Config:
 
         return desktop_versions
 
+    def read_de_cache(self):
+        '''
+        Reads the cached output of the desktop version commands.
+
+        Returns:
+            cache (dict) : {command: {'path': str, 'size': int, 'mtime': int, 'output': str}}
+        '''
+        try:
+            with open(DE_CACHE, encoding='UTF-8') as f:
+                cache = json.load(f)
+            if isinstance(cache, dict):
+                return cache
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def write_de_cache(self):
+        '''Writes the cached output of the desktop version commands, the cache is optional so errors are ignored.'''
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(f'{DE_CACHE}.tmp', 'w', encoding='UTF-8') as f:
+                json.dump(self.de_cache, f)
+            os.replace(f'{DE_CACHE}.tmp', DE_CACHE)
+        except OSError:
+            pass
+
+    def cached_output(self, command):
+        '''
+        Get the output of a desktop version command, only running it if the executable changed since it was last ran.
+
+        Parameters:
+            command (list) : list that contains command and arguments to run.
+
+        Returns:
+            output (str) : output of the command.
+        '''
+        executable = shutil.which(command[0])
+        if executable is None:
+            raise FileNotFoundError(command[0])
+        executable = os.path.realpath(executable)
+        stat = os.stat(executable)
+        identity = {'path': executable, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+        key = ' '.join(command)
+        entry = self.de_cache.get(key)
+        if isinstance(entry, dict) and all(entry.get(i) == value for i, value in identity.items()):
+            return entry['output']
+
+        with tracing.command(command) as info:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=DE_PROBE_TIMEOUT)
+            info['exit code'] = result.returncode
+        output = result.stdout.decode('utf-8')
+        self.de_cache[key] = dict(identity, output=output)
+        self.de_cache_changed = True
+        return output
+
     def check_de_version(self, command, regex, name):
         '''
         Get the current version number of an installed desktop.
@@ -524,7 +1014,8 @@ class Config:
             enableable (int or float) : version of desktop.
         '''
         try:
-            ver = subprocess.run(command, stdout=subprocess.PIPE).stdout.decode('utf-8')
+            with tracing.span(name, 'desktop probes'):
+                ver = self.cached_output(command)
             ver = sub(regex, '', ver)
 
             if '.' in ver and float(ver) in VERSIONS[name]:
@@ -533,7 +1024,7 @@ class Config:
                 version = int(ver)
             else:
                 version = None
-        except(FileNotFoundError, ValueError):
+        except(FileNotFoundError, ValueError, subprocess.TimeoutExpired):
             version = None
 
         return version
@@ -655,6 +1146,80 @@ class Config:
         print() # blank line
         configured = True
 
+    def apply_spec(self, spec):
+        '''
+        Configures the theme from a spec instead of prompting, exits if the spec can't be used on this system.
+
+        Parameters:
+            spec (dict) : The spec, see spec.py. Anything it doesn't set gets the default answer of the prompt.
+
+        Returns:
+            changed (set) : The keys of the configuration that are different from the config file.
+        '''
+        global configured
+        config = self.config
+        errors = []
+
+        previous = {key: config.get(key) for key in ('dir', 'color', 'theme', 'window-controls', 'flatpak')}
+        previous['enabled'] = set(config.get('enabled', []))
+
+        for key, default in (('dir', 'default'), ('color', 'orange'), ('theme', 'light'), ('window-controls', 'macos')):
+            value = spec.get(key, default)
+            if value not in VARIANTS[key]:
+                errors.append(f"'{value}' isn't a {key}, it has to be one of: {', '.join(VARIANTS[key])}")
+            else:
+                config[key] = value
+        if config['theme'] == 'auto' and not self.theme_variants('auto'):
+            errors.append("'auto' can't be used as the theme")
+
+        known = [part for parts in VARIANTS['enableable'].values() for part in parts if part not in ('settings_theme', 'default_syntax')]
+        enabled = spec.get('enabled', [part for part in known if part in config['enableable']])
+        config['enabled'] = []
+        for part in enabled:
+            if part not in known:
+                errors.append(f"'{part}' isn't a theme, it has to be one of: {', '.join(known)}")
+            elif part not in config['enableable']:
+                print(f"{BYELLOW}The {BLYELLOW}{part}{BYELLOW} theme can't be installed on this system, skipping it.{NC}")
+            elif part in MESON_THEMES and bundle_file is None and scope != 'user' and (shutil.which('meson') is None or shutil.which('ninja') is None):
+                errors.append(f"'meson' and 'ninja' are needed to install the {part} theme")
+            elif part not in config['enabled']:
+                config['enabled'].append(part)
+        if spec.get('firefox-settings', True) and 'firefox' in config['enabled']:
+            config['enabled'].append('settings_theme')
+        if spec.get('default-syntax', False) and 'vscode' in config['enabled']:
+            config['enabled'].append('default_syntax')
+        if len(config['enabled']) == 0 and len(errors) == 0:
+            errors.append('None of the themes in the spec can be installed')
+
+        config['flatpak'] = spec.get('flatpak', True) and shutil.which('flatpak') is not None
+
+        if len(errors) > 0:
+            print(f'{BRED}The spec is invalid:{NC}')
+            for error in errors:
+                print(f'  {error}')
+            sys.exit(1)
+
+        configured = True
+        changed = {key for key, value in previous.items() if key != 'enabled' and value != config[key]}
+        if previous['enabled'] != set(config['enabled']):
+            changed.add('enabled')
+        return changed
+
+    @staticmethod
+    def to_spec(config):
+        '''
+        Parameters:
+            config (dict) : Dictionary that contains the configuration.
+
+        Returns:
+            spec (dict) : A spec that configures the theme the same way, see apply_spec.
+        '''
+        ret = {key: config[key] for key in ('dir', 'color', 'theme', 'window-controls', 'flatpak')}
+        ret['enabled'] = [part for part in config['enabled'] if part not in ('settings_theme', 'default_syntax')]
+        ret['firefox-settings'] = 'settings_theme' in config['enabled']
+        ret['default-syntax'] = 'default_syntax' in config['enabled']
+        return ret
+
     def config_menu(self, message, options, default=1, custom_msg=None, no_columns=False):
         '''
         Prompts user with a menu of options.
@@ -721,7 +1286,7 @@ class Config:
             val = input(question + ' [y/n]'.replace(default, default.capitalize()) + f': {NC}')
 
             if val.casefold() == 'y'.casefold() or ( default == 'y' and val == '' ):
-                if name in VARIANTS['enableable']['dg-yaru'] or name in VARIANTS['enableable']['dg-adw-gtk3']:
+                if (name in VARIANTS['enableable']['dg-yaru'] or name in VARIANTS['enableable']['dg-adw-gtk3']) and bundle_file is None:
                     if shutil.which('meson') is None:
                         print(f"{BLRED}'meson'{BRED} not found, can't install {pretty} theme.{NC}")
                         continue
@@ -736,8 +1301,7 @@ class Config:
         '''Reads config file.'''
         config = self.config
         config['old'] = {}
-        config['old_vscode'] = []
-        config['old_firefox'] = []
+        config['fingerprints'] = {}
         config['dir'] = 'default'
         config['color'] = 'orange'
         config['theme'] = 'light'
@@ -748,112 +1312,65 @@ class Config:
             if theme != 'qualia-gtk-theme-snap' and theme != 'extra':
                 config[theme + '_version'] = ''
 
-        try:
-            config_file = open(CONFIG, encoding='UTF-8')
-            for line in config_file.readlines():
-                if ': ' in line:
-                    line = line.strip().split(': ')
-                else:
-                    continue
-
-                key = line[0]
-
-                try:
-                    value = line[1]
-                except IndexError:
-                    continue
-
-                if ' ' in value:
-                    value = value.split(' ')
-
-                if not configured and key in ('enabled', 'firefox', 'vscode'):
-                    prefix = 'old_' if key in ('firefox', 'vscode') else ''
-                    config[prefix + key] = []
-                    if isinstance(value, list):
-                        for theme in value:
-                            if theme.startswith('firefox'):
-                                theme = 'firefox'
-                            if (theme in config['enableable'] or key != 'enabled') and theme not in config[prefix + key]:
-                                if key == 'enabled' and theme == 'flatpak':
-                                    config['flatpak'] = True
-                                else:
-                                    config[prefix + key].append(theme)
-                    elif isinstance(value, str):
-                        if value.startswith('firefox'):
-                            value = 'firefox'
-                        if (value in config['enableable'] or prefix + key != 'enabled') and value not in config[prefix + key]:
-                            config[prefix + key].append(value)
-
-                elif key.startswith('old'): # Themes that were enabled before qualia
-                    old = key.split('_')
-                    theme = old[1]
-                    desktop = old[2]
-                    if desktop in VERSIONS:
-                        config['old'][theme] = {}
-                        config['old'][theme][desktop] = value
-                elif key == 'gnome':
-                    try:
-                        config['old_gnome'] = int(value)
-                    except ValueError:
-                        config['old_gnome'] = None
-                elif key == 'flatpak':
-                    config['flatpak'] = (value == 'True')
-                elif isinstance(value, str):
-                    try:
-                        if not configured and key in VARIANTS and value in VARIANTS[key]:
-                            config[key] = value
-                        elif key.endswith('version') and len(value) == 40:
-                            config[key] = value
-                    except TypeError:
-                        continue
-            config_file.close()
-        except FileNotFoundError:
-            pass
+        data = self.store.data
+
+        if not configured:
+            if isinstance(data.get('enabled'), list):
+                config['enabled'] = []
+                for theme in data['enabled']:
+                    if theme.startswith('firefox'):
+                        theme = 'firefox'
+                    if theme in config['enableable'] and theme not in config['enabled']:
+                        if theme == 'flatpak':
+                            config['flatpak'] = True
+                        else:
+                            config['enabled'].append(theme)
+            for key in ('dir', 'color', 'theme', 'window-controls'):
+                if data.get(key) in VARIANTS[key]:
+                    config[key] = data[key]
+
+        # Themes that were enabled before qualia
+        for theme, desktops in data.get('old', {}).items():
+            for desktop, name in desktops.items():
+                if desktop in VERSIONS:
+                    config['old'].setdefault(theme, {})[desktop] = name
+
+        if 'flatpak' in data:
+            config['flatpak'] = data['flatpak'] is True
+
+        for theme, version in data.get('versions', {}).items():
+            if isinstance(version, str) and len(version) == 40:
+                config[f'{theme}_version'] = version
+
+        for component, entry in self.fingerprints.data.items():
+            if isinstance(entry, dict):
+                config['fingerprints'][component] = entry
 
     def write(self, config):
         '''
-        Writes to config file.
+        Writes to config file, if anything changed.
 
         Parameters:
             config (dict) : Dictionary that contains the configuration.
         '''
-        if os.path.isfile(CONFIG):
-            os.remove(CONFIG)
-        elif os.path.isdir(CONFIG):
-            shutil.rmtree(CONFIG)
-
-        f = open(CONFIG, 'x', encoding='UTF-8')
-        f.write("This file is generated and used by the install script.\n")
-        f.write("You probably shouldn't edit it.\n\n")
-
-        f.write('color: ' + config['color'] + '\n')
-        f.write('theme: ' + config['theme'] + '\n')
-        f.write('window-controls: ' + config['window-controls'] + '\n')
-        f.write('dir: ' + config['dir'] + '\n')
-        f.write('enabled: ' + ' '.join(config['enabled']) + '\n\n')
-        f.write('gnome: ' + str(config['desktop_versions']['gnome']) + '\n')
-        f.write('firefox: ' + ' '.join(config['firefox']) + '\n')
-        f.write('vscode: ' + ' '.join(config['vscode']) + '\n')
-        f.write(f"flatpak: {config['flatpak']}\n\n")
-
-        for theme in VARIANTS['enableable']:
-            if theme == 'extra':
-                continue
-            try:
-                key = f'{theme}_version'
-                version = config[key]
-                f.write(f'{key}: {version}\n')
-            except KeyError:
-                pass
-
-        f.write('\n')
-
+        store = self.store
+        for key in ('color', 'theme', 'window-controls', 'dir', 'enabled', 'firefox', 'vscode', 'flatpak'):
+            store.set(key, config[key])
+        store.set('gnome', config['desktop_versions']['gnome'])
+        store.set('versions', {theme: config[f'{theme}_version'] for theme in VARIANTS['enableable']
+                               if theme != 'extra' and config.get(f'{theme}_version', '') != ''})
+        old = {}
         for theme in config['old']:
-            for de in config['old'][theme]:
-                if config['old'][theme][de] != '' and not config['old'][theme][de].startswith('qualia'):
-                    f.write(f"old_{theme}_{de}: {config['old'][theme][de]}\n")
-
-        f.close()
+            for de, name in config['old'][theme].items():
+                if name != '' and not name.startswith('qualia'):
+                    old.setdefault(theme, {})[de] = name
+        store.set('old', old)
+        store.save()
+        for component, entry in config['fingerprints'].items():
+            self.fingerprints.set(component, entry)
+        for component in [i for i in self.fingerprints.data if i not in config['fingerprints']]:
+            del self.fingerprints.data[component]
+        self.fingerprints.save()
 
     def theme_variants(self, pref):
         '''
@@ -864,9 +1381,10 @@ class Config:
         '''
         config = self.config
         if pref == 'auto':
-            try:
-                theme_setting = check_output(['gsettings', 'get', 'org.gnome.desktop.interface', 'color-scheme'])
-            except(FileNotFoundError):
+            settings = GSettings()
+            if settings.available() and settings.has_schema('org.gnome.desktop.interface'):
+                theme_setting = settings.get('org.gnome.desktop.interface', 'color-scheme')
+            else:
                 theme_setting=None
             if theme_setting == 'prefer-dark':
                 config['color_scheme']='prefer-dark'
@@ -881,66 +1399,266 @@ class Config:
             config['color_scheme']='prefer-dark'
         return True
 
-class Spinner(threading.Thread):
+class Progress:
     '''
-    Draws a spinner in terminal on long processes.
+    Draws a spinner line in the terminal for each theme that is being installed.
 
-    Attributes:
-        theme (str) : The theme name to be printed in the message.
-        directory (str) : The directory to be printed in the message.
-        process (Thread) : The thread of the install process we are waiting on.
+    The lines are drawn by a single thread that sleeps until a theme starts, and the
+    terminal width is only read again when the terminal is resized. When stdout isn't a
+    terminal, the messages are printed as plain lines without the spinners.
     '''
-    def __init__(self, theme, directory, process):
-        super().__init__(target=self._msg)
-        self.theme = theme
-        self.directory = directory
-        self.process = process
-        self.start()
-
-    def _msg(self):
-        '''Prints spinner with message'''
-        message = f'{BGREEN}Installing{NC} the {BOLD}{self.theme}{NC} in {BOLD}{self.directory}{NC}'
-        message_len = len(f'Installing the {self.theme} in {self.directory}') # without the color escape codes
-        if verbose:
-            print(message)
-            while self.process.is_alive():
-                pass
-        else:
-            while self.process.is_alive():
-                for cursor in '|/-\\':
-                    columns = int(os.popen('stty size', 'r').read().split()[1])
-                    sys.stdout.write(f'\r\033[?25l' + message + '   ' + f'\033[J\033[{columns}G' + cursor + '\n')
-                    sys.stdout.write(f'\033[{(message_len + 2) // (columns) + 1}A')
-                    sys.stdout.flush()
-                    time.sleep(0.1)
-            sys.stdout.write('\r' + message + '\033[J\n\033[?25h')
+    def __init__(self):
+        self.lines = {} # {thread: (message, message length without the color escape codes)}
+        self.condition = threading.Condition()
+        self.renderer = None
+        self.columns = None
+        self.rows = 0 # number of rows drawn by the last frame
+        self.hidden = False # if the cursor is hidden
+        self.frame = 0
+        self.tty = sys.stdout.isatty()
+
+    def resize(self, *args):
+        '''Reads the width of the terminal, used as the SIGWINCH handler.'''
+        self.columns = shutil.get_terminal_size().columns
+
+    def add(self, thread, theme, directory):
+        '''
+        Adds a line for a theme that is being installed.
+
+        Parameters:
+            thread (InstallThread) : The thread installing the theme.
+            theme (str) : The theme name to be printed in the message.
+            directory (str) : The directory to be printed in the message.
+        '''
+        message = f'{BGREEN}Installing{NC} the {BOLD}{theme}{NC} in {BOLD}{directory}{NC}'
+        if verbose or not self.tty:
+            self.print(message)
+            return
+        with self.condition:
+            if self.columns is None:
+                self.resize()
+            self.lines[thread] = (message, len(f'Installing the {theme} in {directory}'))
+            if self.renderer is None:
+                self.renderer = threading.Thread(target=self._render, daemon=True)
+                self.renderer.start()
+            self.condition.notify()
+
+    def remove(self, thread):
+        '''
+        Replaces the line of a theme that finished installing with its message.
+
+        Parameters:
+            thread (InstallThread) : The thread installing the theme.
+        '''
+        with self.condition:
+            if thread not in self.lines:
+                return
+            message = self.lines.pop(thread)[0]
+            self._clear()
+            sys.stdout.write(message + '\n')
+            self._draw()
+
+    def print(self, text):
+        '''
+        Prints text above the spinner lines.
+
+        Parameters:
+            text (str) : The text to print.
+        '''
+        with self.condition:
+            self._clear()
+            sys.stdout.write(text + '\n')
+            self._draw()
+
+    def show_cursor(self):
+        '''Brings back the cursor on a terminal, used before exiting on errors.'''
+        if self.tty:
+            sys.stdout.write('\033[?25h\n')
             sys.stdout.flush()
 
+    def _clear(self):
+        if self.rows > 0:
+            sys.stdout.write(f'\033[{self.rows}A\r\033[J')
+        self.rows = 0
+
+    def _draw(self):
+        cursor = '|/-\\'[self.frame % 4]
+        columns = self.columns or 80
+        for message, message_len in self.lines.values():
+            sys.stdout.write('\r\033[?25l' + message + '   ' + f'\033[J\033[{columns}G' + cursor + '\n')
+            self.rows += (message_len + 2) // columns + 1
+        if len(self.lines) == 0 and self.hidden:
+            sys.stdout.write('\033[?25h') # bring back cursor
+        self.hidden = len(self.lines) > 0
+        sys.stdout.flush()
+
+    def _render(self):
+        with self.condition:
+            while True:
+                if len(self.lines) == 0:
+                    self.condition.wait() # nothing to draw until a theme starts installing
+                else:
+                    self.condition.wait(0.1)
+                self.frame += 1
+                self._clear()
+                self._draw()
+
+progress = Progress()
+
 class InstallThread(threading.Thread):
     '''
     A thread for installing a part of the theme.
 
+    Threads are started by the schedule function.
+
     Attributes:
         process (object) : Callable object to run in a thread.
+        component (str) : Name of the theme being installed.
+        src (str) : Path to the submodule of the theme, or None if it isn't built from a submodule.
     '''
-    def __init__(self, process):
-        cd(REPO_DIR)
-        self.spinner = None
+    def __init__(self, process, component, src = None):
+        self.component = component
+        self.src = src
+        self.done = None # queue the thread is put in when it finishes, set by schedule
+        self.changed = False # if anything was installed
+        self.stage = None # directory the build was installed from, if it was installed from the build cache
+        self.inputs = None # what the theme was installed with, see get_inputs
+        self.version = None # commit of the submodule, read once by get_version
+        self.failed = False # if installing raised an exception, so what it installed isn't recorded
         super().__init__(target=process)
-        self.start()
-        self.join()
-        while self.spinner is not None and self.spinner.is_alive(): # Wait for spinner thread to close
-            pass
+
+    def run(self):
+        try:
+            with tracing.span(self.component, f'install {self.component}'):
+                super().run()
+        except BaseException:
+            self.failed = True
+            raise
+        finally:
+            progress.remove(self)
+            if self.done is not None:
+                self.done.put(self)
 
     def get_version(self):
         '''
-        Return current version of the submodule.
+        Return current version of the submodule, it is only read once since the submodules are updated before the themes are installed.
 
         Returns:
             version (str) : 40 character commit hash
         '''
-        version = check_output(['git', 'rev-parse', 'HEAD'])
-        return version
+        if self.version is None:
+            self.version = check_output(['git', 'rev-parse', 'HEAD'], cwd=self.src)
+        return self.version
+
+    def get_inputs(self):
+        '''
+        Return everything the installed files depend on, the theme is only installed again if one of them changes.
+
+        Returns:
+            inputs (dict) : {'version': commit of the submodule, ...} and the options it is built with.
+        '''
+        return {'version': self.get_version()}
+
+    def outdated(self, reasons = ()):
+        '''
+        Compare the inputs with the fingerprint of the last install, and print why the theme is installed or skipped with --explain.
+
+        Parameters:
+            reasons (list) : Other reasons to install the theme again.
+
+        Returns:
+            outdated (bool) : Whether or not the theme has to be installed again.
+        '''
+        self.inputs = self.get_inputs()
+        reasons = (['--force was used'] if force else []) + fingerprint.changes(self.config['fingerprints'].get(self.component), self.inputs) + list(reasons)
+        self.explain(reasons)
+        return len(reasons) > 0
+
+    def explain(self, reasons):
+        '''
+        Print why the theme is installed or skipped, if --explain was used.
+
+        Parameters:
+            reasons (list) : Why it is installed, empty if it is skipped.
+        '''
+        if not explain:
+            return
+        if len(reasons) == 0:
+            progress.print(f"{BOLD}{self.component}{NC}: skipped, nothing it's built from changed")
+        else:
+            progress.print(f'{BOLD}{self.component}{NC}: installing, because\n' + '\n'.join(f'    {reason}' for reason in reasons))
+
+    def installed_paths(self):
+        '''
+        Return the paths that were installed, used for the manifest.
+
+        Returns:
+            paths (list) : Every file and directory that was installed.
+        '''
+        return []
+
+    def meson_install(self, options):
+        '''
+        Install the theme from the build cache, recoloring or building it with meson first if this build isn't cached.
+
+        Parameters:
+            options (list) : The meson options, including the prefix.
+        '''
+        version = self.get_version()
+        key = buildcache.key(self.component, version, options)
+        self.stage = buildcache.lookup(key)
+        if self.stage is not None:
+            if verbose:
+                progress.print(f'Installing {self.component} from the build cache')
+        else:
+            # An accent color this commit was built with before, with other options, can be recolored from a cached build of another accent color
+            self.stage = recolor.build(self.component, version, options, key)
+            if self.stage is not None and verbose:
+                progress.print(f'Recolored a cached build of {self.component}')
+        if self.stage is None:
+            if not os.path.isdir(f'{self.src}/build'):
+                run_command(['meson', 'build'] + options, meson=True, cwd=self.src)
+            else:
+                run_command(['meson', 'configure', 'build'] + options, meson=True, cwd=self.src)
+            run_command(['ninja', '-C', 'build'], meson=True, cwd=self.src)
+            destdir = buildcache.reserve(key)
+            run_command(['env', f'DESTDIR={destdir}', 'ninja', '-C', 'build', 'install'], meson=True, cwd=self.src)
+            self.stage = buildcache.commit(key, {'component': self.component, 'version': version, 'options': options})
+            recolor.learn(self.component, version, options, self.stage)
+        self.install_stage(self.stage, '/')
+
+    def install_stage(self, stage, root):
+        '''
+        Install staged files, only writing the ones that changed.
+
+        Parameters:
+            stage (str) : The directory the files were installed to.
+            root (str) : The directory the stage is installed in.
+        '''
+        operations, stats = sync.plan(stage, root, self.component, disabled_paths(self.config, self.component))
+        with prefix_lock:
+            file_operations(operations)
+        if verbose or stats['written'] > 0 or stats['deleted'] > 0:
+            progress.print(f'{self.component}: {sync.report(stats)}')
+
+    def meson_installed_paths(self):
+        '''
+        Return the paths that meson installed, including the theme directories they are in.
+
+        Returns:
+            paths (list) : Every file and directory that was installed.
+        '''
+        if self.stage is not None:
+            installed_files = buildcache.installed(self.stage)
+        else:
+            installed_files = manifest.expand(json.loads(check_output(['meson', 'introspect', 'build', '--installed'], cwd=self.src)).values())
+        paths = {path: None for path in installed_files} # used as an ordered set
+        for path in list(paths):
+            parent = os.path.dirname(path)
+            while parent not in privileged.THEME_ROOTS and parent != '/':
+                paths[parent] = None
+                parent = os.path.dirname(parent)
+        return list(paths)
 
     def updated(self):
         '''
@@ -948,6 +1666,7 @@ class InstallThread(threading.Thread):
         '''
         global updated
         updated = True
+        self.changed = True
 
 class InstallDgAdwGtk3(InstallThread):
     '''
@@ -958,45 +1677,48 @@ class InstallDgAdwGtk3(InstallThread):
     '''
     def __init__(self, config):
         self.config = config
-        super().__init__(process=self._install)
+        super().__init__(self._install, 'dg-adw-gtk3', SRC['gtk3'])
 
-    def _install(self):
+    def get_options(self):
+        '''
+        Returns:
+            options (list) : The meson options, including the prefix.
+        '''
         config = self.config
-        if not no_update:
-            run_command(['git', 'submodule', 'update', '--init', 'src/dg-adw-gtk3'])
-        cd(SRC['gtk3'])
+        options = [f"-Dprefix={self.install_dir()}"]
+        options += [f"-Dgtk4={str('gtk4-libadwaita' in config['enabled']).lower()}", f"-Dgtk3={str('gtk3' in config['enabled']).lower()}"]
+        options += [f"-Dwindow-controls={config['window-controls']}"]
+        options += [f"-Daccent-colors={'' if config['color'] == 'orange' else config['color']}"]
+        return options
+
+    def install_dir(self):
+        return f'{HOME}/.local' if self.config['dir'] in ('default', 'home') else SYSTEM_PREFIX
 
-        install_dir = f'{HOME}/.local' if config['dir'] in ('default', 'home') else '/usr'
+    def get_inputs(self):
+        return {'version': self.get_version(), 'options': fingerprint.meson_options(self.get_options())}
+
+    def _install(self):
+        config = self.config
 
-        options = [f'-Dprefix={install_dir}']
         if 'gtk4-libadwaita' in config['enabled'] and 'gtk3' in config['enabled']:
             pretty_string = 'qualia GTK3 and Libadwaita GTK4 themes'
             up_to_date = 'qualia GTK3 and Libadwaita GTK4 themes are'
-            options += ['-Dgtk4=true', '-Dgtk3=true']
         elif 'gtk3' in self.config['enabled']:
             pretty_string = 'qualia GTK3 theme'
             up_to_date = 'qualia GTK3 theme is'
-            options += ['-Dgtk4=false', '-Dgtk3=true']
         else:
             pretty_string = 'Libadwaita GTK4 theme'
             up_to_date = 'Libadwaita GTK4 theme is'
-            options += ['-Dgtk4=true', '-Dgtk3=false']
 
-        options += [f"-Dwindow-controls={config['window-controls']}"]
-
-        options += [f"-Daccent-colors={'' if config['color'] == 'orange' else config['color']}"]
-
-        if self.get_version() != self.config['dg-adw-gtk3_version'] or reinstall or update_dir or update_window_controls:
-            self.spinner = Spinner(f"{config['color']} {pretty_string}", f'{install_dir}/share/themes', self)
-            if not os.path.isdir('build'):
-                run_command(['meson', 'build'] + options, meson=True)
-            else:
-                run_command(['meson', 'configure', 'build'] + options, meson=True)
-            run_command(['meson', 'configure', 'build'] + options, meson=True)
-            run_command(['ninja', '-C', 'build', 'install'], meson=True)
+        if self.outdated():
+            progress.add(self, f"{config['color']} {pretty_string}", f'{self.install_dir()}/share/themes')
+            self.meson_install(self.get_options())
             self.updated()
         else:
-            print(f'The {up_to_date} up to date.')
+            progress.print(f'The {up_to_date} up to date.')
+
+    def installed_paths(self):
+        return self.meson_installed_paths()
 
 class InstallDgYaru(InstallThread):
     '''
@@ -1011,14 +1733,49 @@ class InstallDgYaru(InstallThread):
         self.config = config
         self.parts = parts
         self.parts_pretty = parts_pretty
-        super().__init__(process=self._install)
+        super().__init__(self._install, 'dg-yaru', SRC['yaru'])
 
-    def _install(self):
+    def get_options(self):
+        '''
+        Returns:
+            options (list) : The meson options, including the prefix.
+        '''
         config = self.config
-        if not no_update:
-            run_command(['git', 'submodule', 'update', '--init', 'src/dg-yaru'])
 
-        cd(SRC['yaru'])
+        options = [f"-Dprefix={f'{HOME}/.local' if config['dir'] == 'home' else SYSTEM_PREFIX}"]
+
+        options += [f"-Daccent-colors={'' if config['color'] == 'orange' else config['color']}"]
+
+        options += [f"-Dwindow-controls={config['window-controls']}"]
+
+        for p in self.parts:
+            options.append('-D' + p + '=true')
+
+        for i in VARIANTS['enableable']['dg-yaru']:
+            if i not in self.parts:
+                options.append('-D' + i + '=false')
+
+        if panel_icons(config['desktop_versions']):
+            options.append('-Dpanel-icons=true')
+        else:
+            options.append('-Dpanel-icons=false')
+
+        gnome_version = config['desktop_versions']['gnome']
+        if gnome_version is not None:
+            options.append('-Dgnome-shell-version=' + str(gnome_version))
+
+        return options
+
+    def get_inputs(self):
+        # Options that none of the parts being installed use don't change what is installed
+        options = fingerprint.meson_options(self.get_options())
+        for option, parts in YARU_OPTION_PARTS.items():
+            if not any(part in self.parts for part in parts):
+                options.pop(option, None)
+        return {'version': self.get_version(), 'options': options}
+
+    def _install(self):
+        config = self.config
 
         pretty_string = 'qualia '
         for i, pretty in enumerate(self.parts_pretty):
@@ -1034,72 +1791,70 @@ class InstallDgYaru(InstallThread):
         else:
             pretty_string += ' theme'
 
-        install_dir = f'{HOME}/.local' if config['dir'] == 'home' else '/usr'
-
-        if self.get_version() != config['dg-yaru_version'] or reinstall or update_dir or \
-        (update_window_controls and ('metacity' in config['enabled'] or 'xfwm4' in config['enabled'] or 'ubuntu-unity' in config['enabled'])) or \
-        config['old_gnome'] != config['desktop_versions']['gnome']:
-            self.spinner = Spinner(f"{config['color']} {pretty_string}", f'{install_dir}/share', self)
-
-            options = [f'-Dprefix={install_dir}']
+        install_dir = f'{HOME}/.local' if config['dir'] == 'home' else SYSTEM_PREFIX
 
-            options += [f"-Daccent-colors={'' if config['color'] == 'orange' else config['color']}"]
-
-            options += [f"-Dwindow-controls={config['window-controls']}"]
-
-            for p in self.parts:
-                options.append('-D' + p + '=true')
-
-            for i in VARIANTS['enableable']['dg-yaru']:
-                if i not in self.parts:
-                    options.append('-D' + i + '=false')
-
-            if 'unity' in config['desktop_versions'] or 'mate' in config['desktop_versions']:
-                options.append('-Dpanel-icons=true')
-            else:
-                options.append('-Dpanel-icons=false')
-
-            gnome_version = self.config['desktop_versions']['gnome']
-            if gnome_version is not None:
-                options.append('-Dgnome-shell-version=' + str(gnome_version))
-
-            if not os.path.isdir('build'):
-                run_command(['meson', 'build'] + options, meson=True)
-            else:
-                run_command(['meson', 'configure', 'build'] + options, meson=True)
-            run_command(['ninja', '-C', 'build', 'install'], meson=True)
+        if self.outdated():
+            progress.add(self, f"{config['color']} {pretty_string}", f'{install_dir}/share')
+            self.meson_install(self.get_options())
             self.updated()
         else:
             if len(self.parts) > 1:
-                print(f'The {pretty_string} are up to date.')
+                progress.print(f'The {pretty_string} are up to date.')
             else:
-                print(f'The {pretty_string} is up to date.')
+                progress.print(f'The {pretty_string} is up to date.')
+
+    def installed_paths(self):
+        return self.meson_installed_paths()
 
 class InstallDgLibadwaita(InstallThread):
     '''
     Installs the dg-libadwaita theme if it was updated or if being forced.
 
+    The light and dark variants are both installed in ~/.config/gtk-4.0/qualia, and gtk.css links to the
+    one that is used through the 'current' link, so switching between them doesn't install anything.
+
     Attributes:
         config (dict) : Dictionary that contains the configuration.
     '''
     def __init__(self, config):
         self.config = config
-        super().__init__(process=self._install)
+        super().__init__(self._install, 'dg-libadwaita', SRC['gtk4'])
+
+    def get_arguments(self, variant):
+        '''
+        Parameters:
+            variant (str) : Either 'light' or 'dark'.
+
+        Returns:
+            arguments (list) : The arguments for install.sh.
+        '''
+        arguments = ['-c', self.config['color'], '-t', variant]
+        if self.config['window-controls'] == 'symbolic':
+            arguments.append('-s')
+        return arguments
+
+    def get_inputs(self):
+        return {'version': self.get_version(), 'arguments': {variant: self.get_arguments(variant) for variant in ('light', 'dark')}}
 
     def _install(self):
         config = self.config
-        if not no_update:
-            run_command(['git', 'submodule', 'update', '--init', 'src/dg-libadwaita'])
-        cd(SRC['gtk4'])
-
-        if self.get_version() != config['dg-libadwaita_version'] or reinstall or update_theme or update_window_controls:
-            command = ['./install.sh', '-c', config['color'], '-t', config['variant']]
-            if config['window-controls'] == 'symbolic':
-                command.append('-s')
-            run_command(command, show_ouput=True)
+
+        missing = [variant for variant in ('light', 'dark') if not os.path.isfile(f'{GTK4_DIR}/qualia/{variant}/gtk.css')]
+        if self.outdated([f'the {variant} variant is missing' for variant in missing]):
+            for variant in ('light', 'dark'):
+                # install.sh writes to the home directory, so it is pointed at a stage first
+                os.makedirs(STAGE_DIR, exist_ok=True)
+                with tempfile.TemporaryDirectory(dir=STAGE_DIR) as stage:
+                    run_command(['env', f'HOME={stage}', './install.sh'] + self.get_arguments(variant), cwd=self.src)
+                    self.install_stage(f'{stage}/.config/gtk-4.0', f'{GTK4_DIR}/qualia/{variant}')
             self.updated()
         else:
-            print('The qualia GTK4 configuration is up to date.')
+            progress.print('The qualia GTK4 configuration is up to date.')
+
+        switch_gtk4_variant(config['variant'])
+
+    def installed_paths(self):
+        return manifest.expand([f'{GTK4_DIR}/gtk.css', f'{GTK4_DIR}/mac-icons', f'{GTK4_DIR}/qualia'])
 
 class InstallDgFirefoxTheme(InstallThread):
     '''
@@ -1110,59 +1865,128 @@ class InstallDgFirefoxTheme(InstallThread):
     '''
     def __init__(self, config):
         self.config = config
-        super().__init__(process=self._install)
+        super().__init__(self._install, 'dg-firefox-theme', SRC['firefox'])
+
+    def get_arguments(self):
+        '''
+        Returns:
+            arguments (list) : The arguments for install.sh.
+        '''
+        arguments = ['-c', self.config['color']]
+        if 'settings_theme' not in self.config['enabled']:
+            arguments.append('-n')
+        if self.config['window-controls'] == 'symbolic':
+            arguments.append('-s')
+        return arguments
+
+    def get_inputs(self):
+        # install.sh installs the theme for every Firefox it finds
+        return {'version': self.get_version(), 'arguments': self.get_arguments(), 'firefox': sorted(self.config['firefox'])}
 
     def _install(self):
-        config = self.config
-        if not no_update:
-            run_command(['git', 'submodule', 'update', '--init', 'src/dg-firefox-theme'])
-        cd(SRC['firefox'])
-
-        firefox_changed = False
-        for variant in config['firefox']:
-            if variant not in config['old_firefox']:
-                firefox_changed = True
-
-        if self.get_version() != config['dg-firefox-theme_version'] or reinstall or update_settings or firefox_changed or update_window_controls:
-            command = ['./install.sh', '-c', self.config['color']]
-            if 'settings_theme' not in self.config['enabled']:
-                command.append('-n')
-            if config['window-controls'] == 'symbolic':
-                command.append('-s')
-            run_command(command, show_ouput=True)
+        if self.outdated():
+            run_command(['./install.sh'] + self.get_arguments(), show_ouput=True, cwd=self.src)
+            self.changed = True
         else:
-            print('The qualia Firefox theme is up to date.')
+            progress.print('The qualia Firefox theme is up to date.')
+
+    def installed_paths(self):
+        roots = []
+        for firefox_path in FIREFOX_DIR.values():
+            for i in ('chrome/qualia', 'chrome/userChrome.css', 'user.js', 'userContent.css'):
+                roots += glob(f'{firefox_path}/*/{i}')
+        return manifest.expand(roots)
 
 class InstallDgVscodeAdwaita(InstallThread):
     '''
     Installs the dg-vscode-adwaita theme if it was updated or if being forced.
 
+    install.py replaces the extension with the variant it is given, so switching between light and dark installs it again.
+
     Attributes:
         config (dict) : Dictionary that contains the configuration.
     '''
     def __init__(self, config):
         self.config = config
-        super().__init__(process=self._install)
+        super().__init__(self._install, 'dg-vscode-adwaita', SRC['vscode'])
+
+    def get_arguments(self):
+        '''
+        Returns:
+            arguments (list) : The arguments for install.py.
+        '''
+        arguments = ['-c', self.config['color'], '-t', self.config['variant']]
+        if 'default_syntax' in self.config['enabled']:
+            arguments.append('-d')
+        return arguments
+
+    def get_inputs(self):
+        # install.py installs the theme for every VS Code it finds
+        return {'version': self.get_version(), 'arguments': self.get_arguments(), 'vscode': sorted(self.config['vscode'])}
 
     def _install(self):
-        config = self.config
-        if not no_update:
-            run_command(['git', 'submodule', 'update', '--init', 'src/dg-vscode-adwaita'])
-        cd(SRC['vscode'])
-
-        vscode_changed = False
-        for variant in config['vscode']:
-            if variant not in config['old_vscode']:
-                vscode_changed = True
-
-        if self.get_version() != self.config['dg-vscode-adwaita_version'] or reinstall or configure_all or update_syntax or vscode_changed or update_color:
-            if 'default_syntax' in self.config['enabled']:
-                run_command(['./install.py', '-c', self.config['color'], '-t', self.config['variant'], '-d'], show_ouput = True)
-            else:
-                run_command(['./install.py', '-c', self.config['color'], '-t', self.config['variant']], show_ouput = True)
+        if self.outdated():
+            run_command(['./install.py'] + self.get_arguments(), show_ouput = True, cwd=self.src)
             self.updated()
         else:
-            print('The qualia VSCode theme is up to date.')
+            progress.print('The qualia VSCode theme is up to date.')
+
+    def installed_paths(self):
+        return manifest.expand([f'{path}/qualia' for path in VSCODE_DIR.values()])
+
+class InstallBundle(InstallThread):
+    '''
+    Installs the prebuilt parts of the theme from a bundle written by prebuild.py.
+
+    Attributes:
+        config (dict) : Dictionary that contains the configuration.
+        index (dict) : The index of the bundle.
+        dirs (dict) : {component: directory} where to install each part, the prefix for meson themes and the home directory for the others.
+        versions (dict) : {component: version} the versions of the submodules the parts were built from.
+        extracted (dict) : {component: [path, ...]} the paths that were installed, including the theme directories.
+    '''
+    def __init__(self, config, index, dirs):
+        self.config = config
+        self.index = index
+        self.dirs = dirs
+        self.versions = {}
+        self.extracted = {}
+        super().__init__(self._install, 'bundle')
+
+    def _install(self):
+        config = self.config
+        self.explain(['the bundle is always extracted, only the files that changed are written'])
+        progress.add(self, f"prebuilt {config['color']} {config['variant']} themes", ', '.join(sorted(set(self.dirs.values()))))
+
+        gnome_version = config['desktop_versions']['gnome']
+        if 'gnome-shell' in config['enabled'] and gnome_version is not None and str(self.index.get('gnome-shell-version')) != str(gnome_version):
+            progress.print(f"{BYELLOW}The bundle wasn't built for GNOME {gnome_version}, the GNOME Shell theme might not work.{NC}")
+
+        try:
+            artifacts = bundle.select(self.index, config['color'], config['variant'], config['window-controls'], panel_icons(config['desktop_versions']))
+            plan = bundle.artifact_plan(self.index, artifacts, {i: j for i, j in self.dirs.items() if i != 'dg-libadwaita'}, config['enabled'])
+            if 'dg-libadwaita' in self.dirs:
+                # Both variants are installed, see InstallDgLibadwaita
+                for variant in ('light', 'dark'):
+                    for artifact in bundle.select(self.index, config['color'], variant, config['window-controls'], panel_icons(config['desktop_versions'])):
+                        if self.index['artifacts'][artifact]['component'] == 'dg-libadwaita':
+                            plan[artifact] = {'strip': '.config/gtk-4.0', 'dest': f'{GTK4_DIR}/qualia/{variant}', 'enabled': config['enabled']}
+            extracted = bundle.install(bundle_file, plan, verbose)
+        except (OSError, bundle.BundleError) as error:
+            print(f'\n{BRED}Something went wrong while installing from the bundle:{NC}\n{error}')
+            progress.show_cursor()
+            os._exit(1)
+
+        for artifact, paths in extracted.items():
+            component = self.index['artifacts'][artifact]['component']
+            self.versions[component] = self.index['artifacts'][artifact]['version']
+            self.extracted.setdefault(component, []).extend(paths)
+            iconcache.touch(paths)
+        if 'dg-libadwaita' in self.dirs:
+            switch_gtk4_variant(config['variant'])
+            self.extracted['dg-libadwaita'] += [i for i in (f'{GTK4_DIR}/gtk.css', f'{GTK4_DIR}/mac-icons', f'{GTK4_DIR}/qualia/current') if os.path.lexists(i)]
+        invalidate()
+        self.updated()
 
 class InstallQualiaGtkThemeSnap(InstallThread):
     '''
@@ -1170,38 +1994,45 @@ class InstallQualiaGtkThemeSnap(InstallThread):
 
     Attributes:
         config (dict) : Dictionary that contains the configuration.
+        snapd (Snapd) : Client for the snapd API.
     '''
-    def __init__(self, config):
+    def __init__(self, config, snapd):
         self.config = config
-        super().__init__(process=self._install)
+        self.snapd = snapd
+        super().__init__(self._install, 'qualia-gtk-theme-snap')
 
     def _install(self):
-        snap_list = check_output(['snap', 'list']).split('\n')
-        for name in ('gtk-common-themes', 'qualia-gtk-theme'):
-            installed = False
-            for line in snap_list:
-                line = line.split()
-                if name in line:
-                    installed = True
-                    print(f'Checking if {BOLD}{name}{NC} Snap can be updated.')
-                    run_command(['sudo', 'snap', 'refresh', name], show_ouput = True)
-            if not installed:
-                print(f'{BGREEN}Installing{NC} the {BOLD}{name}{NC} Snap.')
-                run_command(['sudo', 'snap', 'install', name], show_ouput = True)
-
-        connections = check_output(['snap', 'connections']).split('\n')
-        for line in connections:
-            line = line.split()
-            for key, value in {'gtk3': 'gtk-3', 'icons': 'icon', 'sounds': 'sound'}.items():
-                try:
-                    if key in self.config["enabled"]:
-                        if line[2] == f'gtk-common-themes:{value}-themes':
-                            run_command(['sudo', 'snap', 'connect', line[1], f'qualia-gtk-theme:{value}-themes'], show_ouput = True)
-                    else:
-                        if line[2] == f'qualia-gtk-theme:{value}-themes':
-                            run_command(['sudo', 'snap', 'disconnect', line[1], f'qualia-gtk-theme:{value}-themes'], show_ouput = True)
-                except IndexError:
-                    pass
+        snapd = self.snapd
+        self.explain(['snapd is asked to refresh it, which does nothing if it is up to date'])
+        try:
+            installed = snapd.snaps()
+            requests = []
+            refresh = [name for name in ('gtk-common-themes', 'qualia-gtk-theme') if name in installed]
+            install = [name for name in ('gtk-common-themes', 'qualia-gtk-theme') if name not in installed]
+            for name in refresh:
+                progress.print(f'Checking if {BOLD}{name}{NC} Snap can be updated.')
+            for name in install:
+                progress.print(f'{BGREEN}Installing{NC} the {BOLD}{name}{NC} Snap.')
+            if len(refresh) > 0:
+                requests.append(snapd.snaps_request('refresh', refresh))
+            if len(install) > 0:
+                requests.append(snapd.snaps_request('install', install))
+            snapd.apply(requests)
+
+            # The slots have to exist before anything can be connected to them
+            requests = []
+            for plug_snap, plug, slot_snap, slot in snapd.connections():
+                for key, value in {'gtk3': 'gtk-3', 'icons': 'icon', 'sounds': 'sound'}.items():
+                    if slot != f'{value}-themes':
+                        continue
+                    if key in self.config['enabled']:
+                        if slot_snap == 'gtk-common-themes':
+                            requests.append(snapd.interface_request('connect', plug_snap, plug, 'qualia-gtk-theme', slot))
+                    elif slot_snap == 'qualia-gtk-theme':
+                        requests.append(snapd.interface_request('disconnect', plug_snap, plug, 'qualia-gtk-theme', slot))
+            snapd.apply(requests)
+        except (OSError, SnapdError, subprocess.CalledProcessError) as error:
+            progress.print(f'{BRED}Something went wrong while installing the Snap theme: {error}{NC}')
 
 class Enable:
     '''
@@ -1210,9 +2041,10 @@ class Enable:
     Attributes:
         config (dict) : Dictionary that contains the configuration.
         do_verbose (bool): Verbose output.
+        dry_run (bool) : Print the changes that would be made, without making them.
         kwargs (dict) : {theme: name} Dictionary of the themes to enable.
     '''
-    def __init__(self, config, do_verbose, **kwargs):
+    def __init__(self, config, do_verbose, dry_run = False, **kwargs):
         self.names = {}
         for theme in VARIANTS['enableable']:
             for part in theme:
@@ -1223,6 +2055,7 @@ class Enable:
         self.config = config
         self.data = self._data()
         self.verbose = do_verbose # pass verbose as an argument because uninstall.py also uses this class
+        self.dry_run = dry_run
 
     def _data(self):
         schemas = {
@@ -1361,76 +2194,86 @@ class Enable:
             desktop (str) : Either 'all' or name of desktop to enable themes in.
             uninstalling (bool) : True if being ran by uninstall script, so it doesn't check that the theme is enabled in configuration.
         '''
-        data = self.data
-        config = self.config
-        schema_list = check_output(['gsettings', 'list-schemas'])
-        for theme, value in data.items():
-            if theme in config['enabled'] or uninstalling:
-                if value['theme_name'] is None:
-                    continue
+        with tracing.span('enable themes', 'enable', desktop=desktop):
+            data = self.data
+            config = self.config
+            settings = GSettings(self.verbose, self.dry_run)
+            xfconf = Xfconf(self.verbose, self.dry_run)
+            if xfconf.available() and config['desktop_versions']['xfce'] is not None:
+                xfconf.read(*{i['channel'] for i in data.values() if i['channel'] is not None})
+            for theme, value in data.items():
+                if theme in config['enabled'] or uninstalling:
+                    if value['theme_name'] is None:
+                        continue
 
-                if theme == 'gnome-shell':
-                    if shutil.which('gnome-extensions') is not None:
-                        try:
-                            if 'user-theme@gnome-shell-extensions.gcampax.github.com' in check_output(['gnome-extensions', 'list']):
-                                    run_command(['gnome-extensions', 'enable', 'user-theme@gnome-shell-extensions.gcampax.github.com'], override_verbose = self.verbose)
-                            else:
+                    if theme == 'gnome-shell':
+                        if shutil.which('gnome-extensions') is not None:
+                            try:
+                                if 'user-theme@gnome-shell-extensions.gcampax.github.com' in check_output(['gnome-extensions', 'list']):
+                                    if self.dry_run:
+                                        print("Would enable the 'User Themes' GNOME Shell Extension")
+                                    else:
+                                        run_command(['gnome-extensions', 'enable', 'user-theme@gnome-shell-extensions.gcampax.github.com'], override_verbose = self.verbose)
+                                else:
+                                    print(f"{BLYELLOW}'User Themes'{BYELLOW} GNOME Shell Extension not found, not enabling GNOME Shell theme.{NC}")
+                                    continue
+                            except subprocess.CalledProcessError:
                                 print(f"{BLYELLOW}'User Themes'{BYELLOW} GNOME Shell Extension not found, not enabling GNOME Shell theme.{NC}")
                                 continue
-                        except subprocess.CalledProcessError:
-                            print(f"{BLYELLOW}'User Themes'{BYELLOW} GNOME Shell Extension not found, not enabling GNOME Shell theme.{NC}")
+                        else:
+                            print(f"{BLYELLOW}'gnome-extensions'{BYELLOW} not found, not enabling GNOME Shell theme.{NC}")
                             continue
-                    else:
-                        print(f"{BLYELLOW}'gnome-extensions'{BYELLOW} not found, not enabling GNOME Shell theme.{NC}")
-                        continue
 
-                for de, schema in value['schemas'].items():
-                    if desktop != 'all' and desktop != de:
-                        continue
-                    if theme == 'icons' and de == 'unity' and not uninstalling:
-                        # because the panel isn't always dark in the unity theme, use light icons in light theme
-                        name = f"qualia{config['suffix']}"
-                    else:
+                    for de, schema in value['schemas'].items():
+                        if desktop != 'all' and desktop != de:
+                            continue
+                        if theme == 'icons' and de == 'unity' and not uninstalling:
+                            # because the panel isn't always dark in the unity theme, use light icons in light theme
+                            name = f"qualia{config['suffix']}"
+                        else:
+                            name = value['theme_name']
+                        if isinstance(value['key'], dict):
+                            key = value['key'][de]
+                        else:
+                            key = value['key']
+                        if settings.available():
+                            if settings.has_schema(schema):
+                                if not (de in config['desktop_versions'] and config['desktop_versions'][de] is None):
+                                    de_pretty = 'GNOME' if de == 'gnome' else de.capitalize()
+                                    old = settings.get(schema, key)
+                                    if theme not in config['old']:
+                                        config['old'][theme] = {}
+                                        config['old'][theme][de] = old
+                                    elif de in config['old'][theme] and config['old'][theme][de].startswith('qualia'):
+                                        config['old'][theme][de] = old
+                                    if old != name:
+                                        print(f'Changing {config["enableable"][theme]} theme in {de_pretty} to {BOLD}{name}{NC}.')
+                                        settings.set(schema, key, name)
+                        else:
+                            print(f"{BLYELLOW}'gsettings'{BYELLOW} not found, not enabling {theme} theme.{NC}")
+                            break
+
+                    prop = data[theme]['property']
+                    if xfconf.available():
                         name = value['theme_name']
-                    if isinstance(value['key'], dict):
-                        key = value['key'][de]
-                    else:
-                        key = value['key']
-                    if shutil.which('gsettings') is not None:
-                        if schema in schema_list:
-                            if not (de in config['desktop_versions'] and config['desktop_versions'][de] is None):
-                                de_pretty = 'GNOME' if de == 'gnome' else de.capitalize()
-                                old = check_output(['gsettings', 'get', schema, key])
-                                if theme not in config['old']:
-                                    config['old'][theme] = {}
-                                    config['old'][theme][de] = old
-                                elif de in config['old'][theme] and config['old'][theme][de].startswith('qualia'):
-                                    config['old'][theme][de] = old
-                                if old != name:
-                                    print(f'Changing {config["enableable"][theme]} theme in {de_pretty} to {BOLD}{name}{NC}.')
-                                    run_command(['gsettings', 'set', schema, key, name], override_verbose = self.verbose)
-                    else:
-                        print(f"{BLYELLOW}'gsettings'{BYELLOW} not found, not enabling {theme} theme.{NC}")
-                        break
-
-                prop = data[theme]['property']
-                if shutil.which('xfconf-query') is not None:
-                    name = value['theme_name']
-                    channel = data[theme]['channel']
-                    if prop is not None and config['desktop_versions']['xfce'] is not None:
-                        old = check_output(['xfconf-query', '-c', channel, '-p', prop])
-                        if theme not in config['old']:
-                            config['old'][theme] = {}
-                            config['old'][theme]['xfce'] = old
-                        elif 'xfce' in config['old'][theme] and config['old'][theme]['xfce'].startswith('qualia'):
-                            config['old'][theme]['xfce'] = old
-                        if old != name:
-                            print(f'Changing {config["enableable"][theme]} theme in XFCE to {BOLD}{name}{NC}.')
-                            run_command(['xfconf-query', '-c', channel, '-p', prop, '-s', name], override_verbose = self.verbose)
-                elif prop is not None and config['desktop_versions']['xfce'] is not None:
-                    print(f"{BLYELLOW}'xfconf-query'{BYELLOW} not found, not enabling {theme} theme.{NC}")
-
-        return config
+                        channel = data[theme]['channel']
+                        if prop is not None and config['desktop_versions']['xfce'] is not None:
+                            old = xfconf.get(channel, prop)
+                            if theme not in config['old']:
+                                config['old'][theme] = {}
+                                config['old'][theme]['xfce'] = old
+                            elif 'xfce' in config['old'][theme] and config['old'][theme]['xfce'].startswith('qualia'):
+                                config['old'][theme]['xfce'] = old
+                            if old != name:
+                                print(f'Changing {config["enableable"][theme]} theme in XFCE to {BOLD}{name}{NC}.')
+                                xfconf.set(channel, prop, name)
+                    elif prop is not None and config['desktop_versions']['xfce'] is not None:
+                        print(f"{BLYELLOW}'xfconf-query'{BYELLOW} not found, not enabling {theme} theme.{NC}")
+
+            settings.apply()
+            xfconf.apply()
+
+            return config
 
 if __name__ == "__main__":
     ##############################
@@ -1444,7 +2287,7 @@ if __name__ == "__main__":
     parser.add_argument(
         '-c', '--clean',
         action = 'store_true',
-        help = 'clean build directories and exit'
+        help = 'clean build directories and the build cache and exit'
     )
     parser.add_argument(
         '-r', '--reconfigure',
@@ -1486,6 +2329,11 @@ if __name__ == "__main__":
         action = 'store_true',
         help = 'force install the theme'
     )
+    parser.add_argument(
+        '-e', '--explain',
+        action = 'store_true',
+        help = 'print why each theme is installed again or skipped'
+    )
     parser.add_argument(
         '-n', '--no-update',
         action = 'store_true',
@@ -1496,6 +2344,42 @@ if __name__ == "__main__":
         action = 'store_true',
         help = 'verbose mode'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        type = int,
+        metavar = 'N',
+        help = 'install at most N themes at once, defaults to the number of CPUs'
+    )
+    parser.add_argument(
+        '-b', '--bundle',
+        metavar = 'FILE',
+        help = 'install the themes from a bundle written by prebuild.py instead of building them'
+    )
+    parser.add_argument(
+        '-u', '--users',
+        metavar = 'USER,...',
+        help = 'install for each of these users, the themes are built once and installed in /usr/share'
+    )
+    parser.add_argument(
+        '-U', '--all-users',
+        action = 'store_true',
+        help = 'install for every user that can log in'
+    )
+    parser.add_argument(
+        '--user-only',
+        action = 'store_true',
+        help = argparse.SUPPRESS # used by --users to install the parts in the home directory of each user
+    )
+    parser.add_argument(
+        '-T', '--trace',
+        metavar = 'FILE',
+        help = 'write how long each part of the install took to FILE as a Chrome trace, and print a summary'
+    )
+    parser.add_argument(
+        '-S', '--spec',
+        metavar = 'FILE',
+        help = "configure the theme from a JSON file, or stdin if FILE is '-', and the QUALIA_* environment variables without any prompts"
+    )
 
     args = parser.parse_args()
 
@@ -1513,12 +2397,41 @@ if __name__ == "__main__":
 
     no_update = args.no_update
 
+    # Switching between light and dark doesn't build anything, so there is no reason to update the submodules
+    if args.theme and not (args.accent or args.install_dir or args.window or args.syntax or args.firefox or args.reconfigure or args.force):
+        no_update = True
+
     verbose = args.verbose
 
     force = args.force
 
+    explain = args.explain
+
     update_settings = args.firefox
 
+    jobs = args.jobs
+
+    bundle_file = args.bundle
+
+    trace_file = args.trace
+    tracing.enabled = trace_file is not None
+
+    try:
+        config_spec = spec.read(args.spec)
+    except spec.SpecError as error:
+        print(f'{BRED}{error}{NC}')
+        sys.exit(1)
+
+    if args.user_only:
+        scope = 'user'
+    elif args.users is not None or args.all_users:
+        try:
+            users = multiuser.accounts(None if args.all_users else [i for i in args.users.split(',') if i != ''])
+        except multiuser.UserError as error:
+            print(f'{BRED}{error}.{NC}')
+            sys.exit(1)
+        scope = 'shared'
+
     configure_all = False
 
     if args.clean:
@@ -1526,11 +2439,11 @@ if __name__ == "__main__":
             args = ['sudo', sys.executable] + sys.argv + [os.environ]
             os.execlpe('sudo', *args)
 
-        for i in (SRC['yaru'], SRC['gtk3']):
+        for i in (f"{SRC['yaru']}/build", f"{SRC['gtk3']}/build", BUILD_CACHE):
             try:
-                shutil.rmtree(f'{i}/build')
+                shutil.rmtree(i)
             except NotADirectoryError:
-                os.remove(f'{i}/build')
+                os.remove(i)
             except FileNotFoundError:
                 pass
         sys.exit()
@@ -0,0 +1,189 @@
+'''This module is for recording the files that each part of the theme installed.'''
+import os
+import gzip
+import hashlib
+from fnmatch import fnmatchcase
+
+from paths import MANIFEST_DIR
+
+# Parts of the theme that have manifests
+COMPONENTS = ('dg-adw-gtk3', 'dg-yaru', 'dg-libadwaita', 'dg-firefox-theme', 'dg-vscode-adwaita')
+
+_manifests = {} # {component: {path: entry} or None}, manifests that were loaded
+
+def _file(component):
+    return f'{MANIFEST_DIR}/{component}.tsv.gz'
+
+def file_hash(path):
+    '''
+    Parameters:
+        path (str) : The file to hash.
+
+    Returns:
+        hash (str) : The BLAKE2b hash of the file.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def entry(path):
+    '''
+    Describe a path the way it is stored in the manifest.
+
+    Parameters:
+        path (str) : The path to describe.
+
+    Returns:
+        entry (tuple) : ('d',) for directories, ('l', target) for symlinks, ('f', size, hash) for files.
+    '''
+    if os.path.islink(path):
+        return ('l', os.readlink(path))
+    if os.path.isdir(path):
+        return ('d',)
+    return ('f', os.path.getsize(path), file_hash(path))
+
+def expand(roots):
+    '''
+    Parameters:
+        roots (list) : Files and directories.
+
+    Returns:
+        paths (list) : The roots that exist and everything in them.
+    '''
+    paths = []
+    for root in roots:
+        if not os.path.lexists(root):
+            continue
+        paths.append(root)
+        if os.path.isdir(root) and not os.path.islink(root):
+            for directory, dirs, files in os.walk(root):
+                paths += [os.path.join(directory, i) for i in dirs + files]
+    return paths
+
+def load(component):
+    '''
+    Parameters:
+        component (str) : The part of the theme.
+
+    Returns:
+        manifest (dict) : {path: entry}, or None if there is no manifest because the theme was installed before manifests were used.
+    '''
+    if component not in _manifests:
+        try:
+            manifest = {}
+            with gzip.open(_file(component), 'rt', encoding='UTF-8') as f:
+                for line in f:
+                    line = line.rstrip('\n').split('\t')
+                    # Paths go last, since they are the only field that can contain anything
+                    if line[0] == 'f':
+                        manifest['\t'.join(line[3:])] = ('f', int(line[1]), line[2])
+                    elif line[0] == 'l':
+                        manifest['\t'.join(line[2:])] = ('l', line[1])
+                    elif line[0] == 'd':
+                        manifest['\t'.join(line[1:])] = ('d',)
+            _manifests[component] = manifest
+        except (OSError, ValueError, IndexError):
+            _manifests[component] = None
+    return _manifests[component]
+
+def write(component, manifest):
+    '''
+    Parameters:
+        component (str) : The part of the theme.
+        manifest (dict) : {path: entry}
+    '''
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    with gzip.open(f'{_file(component)}.tmp', 'wt', encoding='UTF-8') as f:
+        for path in sorted(manifest):
+            f.write('\t'.join([str(i) for i in manifest[path]] + [path]) + '\n')
+    os.replace(f'{_file(component)}.tmp', _file(component))
+    _manifests[component] = manifest
+
+def record(component, paths):
+    '''
+    Add what a part of the theme installed to its manifest.
+
+    Paths that are already in the manifest are kept as long as they exist, so what was installed
+    for another accent or in another directory can still be found by the cleanup and uninstall.py.
+
+    Parameters:
+        component (str) : The part of the theme.
+        paths (list) : Every file and directory it installed.
+    '''
+    manifest = {path: value for path, value in (load(component) or {}).items() if os.path.lexists(path)}
+    manifest.update((path, entry(path)) for path in paths if os.path.lexists(path))
+    write(component, manifest)
+
+def stale(component, paths):
+    '''
+    Find the files a part of the theme installed in the theme dirs before, that it didn't install this time.
+
+    Parameters:
+        component (str) : The part of the theme.
+        paths (list) : Every file and directory it installed this time.
+
+    Returns:
+        stale (list) : The files and symlinks that still exist, like the ones installed for another accent color or in another directory.
+    '''
+    from privileged import THEME_ROOTS
+    roots = tuple(root + '/' for root in THEME_ROOTS)
+    paths = set(paths)
+    return sorted(path for path, value in (load(component) or {}).items()
+                  if value[0] != 'd' and path not in paths and path.startswith(roots) and os.path.lexists(path))
+
+def theme_dir(path):
+    '''
+    Parameters:
+        path (str) : A path in a theme dir.
+
+    Returns:
+        theme_dir (str) : The theme dir the path is in, like '~/.local/share/icons/qualia', or None if it isn't in one.
+    '''
+    from privileged import THEME_ROOTS
+    for root in THEME_ROOTS:
+        if path.startswith(root + '/'):
+            return f"{root}/{path[len(root) + 1:].split('/')[0]}"
+    return None
+
+def discard(paths):
+    '''
+    Remove deleted paths and everything in them from the manifests.
+
+    Parameters:
+        paths (list) : The paths that were deleted.
+    '''
+    prefixes = tuple(path.rstrip('/') + '/' for path in paths)
+    paths = set(paths)
+    for component in COMPONENTS:
+        manifest = load(component)
+        if manifest is None:
+            continue
+        removed = [i for i in manifest if i in paths or i.startswith(prefixes)]
+        if len(removed) > 0:
+            for i in removed:
+                del manifest[i]
+            write(component, manifest)
+
+def match(pattern, component):
+    '''
+    Find the paths in a manifest that match a glob pattern.
+
+    Parameters:
+        pattern (str) : The pattern, '*' doesn't match '/' just like glob.
+        component (str) : The part of the theme.
+
+    Returns:
+        paths (list) : The matching paths, or None if there is no manifest.
+    '''
+    manifest = load(component)
+    if manifest is None:
+        return None
+    parts = pattern.split('/')
+    matches = []
+    for path in manifest:
+        split = path.split('/')
+        if len(split) == len(parts) and all(fnmatchcase(i, j) for i, j in zip(split, parts)):
+            matches.append(path)
+    return sorted(matches)
@@ -0,0 +1,103 @@
+'''
+This module is for installing the theme for several users at once.
+
+The themes that are built are installed once in /usr by the user running install.py, then
+install.py is ran again as each user with --user-only, which only installs and enables the parts
+that are in the home directory. Every user gets their own config and manifests in STATE_SUBDIR.
+'''
+import os
+import pwd
+import sys
+import json
+import time
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import tracing
+
+STATE_SUBDIR = '.local/state/qualia-gtk-theme'
+
+INSTALL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'install.py')
+
+# Users with a lower uid are system accounts
+MIN_UID = 1000
+
+NO_LOGIN = ('/usr/sbin/nologin', '/sbin/nologin', '/usr/bin/nologin', '/bin/false', '/usr/bin/false')
+
+class UserError(Exception):
+    '''Raised when a user doesn't exist.'''
+
+def accounts(names = None):
+    '''
+    Parameters:
+        names (list) : The users to install for, or None for every user that can log in.
+
+    Returns:
+        users (list) : pwd.struct_passwd of each user.
+    '''
+    if names is None:
+        return sorted((user for user in pwd.getpwall() if user.pw_uid >= MIN_UID and user.pw_shell not in NO_LOGIN and os.path.isdir(user.pw_dir)),
+                      key=lambda user: user.pw_name)
+    users = []
+    for name in names:
+        try:
+            users.append(pwd.getpwnam(name))
+        except KeyError as error:
+            raise UserError(f"The user '{name}' doesn't exist") from error
+    return users
+
+def command(user, args):
+    '''
+    Parameters:
+        user (pwd.struct_passwd) : The user to install for.
+        args (list) : Options for install.py.
+
+    Returns:
+        command (list) : The command that runs install.py as the user, with the home directory, state and session bus of the user.
+    '''
+    env = [f'USER={user.pw_name}', f'LOGNAME={user.pw_name}', f'HOME={user.pw_dir}', f'QUALIA_STATE_DIR={user.pw_dir}/{STATE_SUBDIR}',
+           # The repo belongs to someone else, git refuses to read it unless it is marked as safe
+           'GIT_CONFIG_COUNT=1', 'GIT_CONFIG_KEY_0=safe.directory', 'GIT_CONFIG_VALUE_0=*']
+    prefix = []
+    runtime_dir = f'/run/user/{user.pw_uid}'
+    if os.path.isdir(runtime_dir):
+        # The user is logged in, so their settings are changed through their own session bus
+        env += [f'XDG_RUNTIME_DIR={runtime_dir}', f'DBUS_SESSION_BUS_ADDRESS=unix:path={runtime_dir}/bus']
+    elif shutil.which('dbus-run-session') is not None:
+        prefix = ['dbus-run-session', '--']
+    return ['sudo', '-u', user.pw_name, '--', 'env', '-u', 'SUDO_USER'] + env + prefix + [sys.executable, INSTALL, '--user-only', '--spec', '-'] + args
+
+def install(users, spec, args, max_jobs = None, on_done = None):
+    '''
+    Install the parts of the theme in the home directory for each user, at most max_jobs users at once.
+
+    Parameters:
+        users (list) : The users from accounts.
+        spec (dict) : The configuration, see spec.py. Users that already have a config only get the parts that have to be the same for everyone.
+        args (list) : Options for install.py.
+        max_jobs (int) : The maximum number of users to install for at once. Defaults to one per CPU.
+        on_done (callable) : Called with the user, return code, output and seconds after each user is done.
+
+    Returns:
+        failed (list) : The names of the users it failed for.
+    '''
+    def run(user):
+        start = time.perf_counter()
+        argv = command(user, args)
+        with tracing.command(argv) as info:
+            output = subprocess.run(argv, input=json.dumps(spec).encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+            info['exit code'] = output.returncode
+        return output.returncode, output.stdout.decode('utf-8', 'replace'), time.perf_counter() - start
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        futures = {executor.submit(run, user): user for user in users}
+        for future in as_completed(futures):
+            user = futures[future]
+            returncode, output, seconds = future.result()
+            if returncode != 0:
+                failed.append(user.pw_name)
+            if on_done is not None:
+                on_done(user, returncode, output, seconds)
+    return failed
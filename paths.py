@@ -1,15 +1,28 @@
 '''This module is for getting paths to parts of the theme.'''
-from os import path, environ
-from glob import glob
+from os import path, environ, scandir
+from glob import has_magic
+from fnmatch import fnmatchcase
 
 SUDO_USER = environ.get('SUDO_USER')
 USER = SUDO_USER if SUDO_USER is not None else environ.get('USER')
 HOME = path.expanduser(f'~{USER}')
 REPO_DIR = path.dirname(path.realpath(__file__))
 
+# Where the themes are installed for every user, only changed to test the scripts without touching the system
+SYSTEM_PREFIX = environ.get('QUALIA_SYSTEM_PREFIX', '/usr')
+
 GTK4_DIR = f'{HOME}/.config/gtk-4.0'
+CACHE_DIR = f"{environ.get('XDG_CACHE_HOME', f'{HOME}/.cache')}/qualia-gtk-theme"
+DE_CACHE = f'{CACHE_DIR}/desktops.json'
+BUILD_CACHE = f'{CACHE_DIR}/builds'
+STAGE_DIR = f'{CACHE_DIR}/stages'
 SRC = f'{REPO_DIR}/src'
-CONFIG = f'{REPO_DIR}/config.txt'
+# Where the config and manifests are kept, install.py --users gives every user their own
+STATE_DIR = environ.get('QUALIA_STATE_DIR', REPO_DIR)
+CONFIG = f'{STATE_DIR}/config.json'
+LEGACY_CONFIG = f'{REPO_DIR}/config.txt'
+MANIFEST_DIR = f'{STATE_DIR}/manifests'
+FINGERPRINTS = f'{STATE_DIR}/fingerprints.json'
 OLD_CONFIG = f'{SRC}/installed-versions.txt'
 
 SRC = {
@@ -43,6 +56,83 @@ VSCODE_DIR = {
     'flatpak': f'{HOME}/.var/app/com.visualstudio.code/data/vscode/extensions',
 }
 
+_listings = {} # {directory: {name: is_dir}}, the directories that have been read
+
+def invalidate():
+    '''Forget the directories that have been read, has to be called after anything is installed or deleted.'''
+    _listings.clear()
+
+def _list(directory):
+    '''
+    Read a directory once, later calls return the same entries until invalidate is called.
+
+    Parameters:
+    directory (str) : The directory to read.
+
+    Returns:
+        entries (dict) : {name: is_dir}
+    '''
+    if directory not in _listings:
+        entries = {}
+        try:
+            with scandir(directory) as it:
+                for entry in it:
+                    try:
+                        entries[entry.name] = entry.is_dir()
+                    except OSError:
+                        entries[entry.name] = False
+        except OSError:
+            pass
+        _listings[directory] = entries
+    return _listings[directory]
+
+def _index_glob(pattern):
+    '''
+    Same as glob for absolute patterns, but every directory is only read once.
+
+    Parameters:
+    pattern (str) : The glob pattern.
+
+    Returns:
+        paths (list) : The matching paths.
+    '''
+    parts = pattern.split('/')[1:]
+    matches = ['']
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        found = []
+        for directory in matches:
+            entries = _list(directory or '/')
+            if has_magic(part):
+                # Like glob, wildcards don't match hidden files
+                names = sorted(name for name in entries if fnmatchcase(name, part) and (part.startswith('.') or not name.startswith('.')))
+            else:
+                names = [part] if part in entries else []
+            for name in names:
+                if last or entries[name]:
+                    found.append(f'{directory}/{name}')
+        matches = found
+    return matches
+
+def _glob(pattern, component = None):
+    '''
+    Find the installed paths that match a pattern.
+
+    Parameters:
+    pattern (str) : The glob pattern.
+    component (str) : The part of the theme the paths belong to, the paths in its manifest that still exist are added to the ones on the filesystem.
+
+    Returns:
+        paths (list) : The matching paths.
+    '''
+    # The manifest only has what was installed since it was first written, so the filesystem is
+    # still globbed to find themes from before it, like the ones for a previous accent color
+    matches = set(_index_glob(pattern))
+    if component is not None:
+        import manifest
+        matches.update(i for i in manifest.match(pattern, component) or [] if path.lexists(i))
+    return sorted(matches)
+
 def installed(old_only = False, new_only = False, just_theme_dirs = False, directory = None):
     '''
     Return paths of installed themes.
@@ -59,16 +149,16 @@ def installed(old_only = False, new_only = False, just_theme_dirs = False, direc
     '''
 
     if directory == 'root':
-        dg_yaru_prefixes = ('/usr/share',)
+        dg_yaru_prefixes = (f'{SYSTEM_PREFIX}/share',)
         dg_adw_gtk3_prefixes = dg_yaru_prefixes
     elif directory == 'home':
         dg_yaru_prefixes = (f'{HOME}/.local/share',)
         dg_adw_gtk3_prefixes = dg_yaru_prefixes
     elif directory == 'not_default':
         dg_yaru_prefixes = (f'{HOME}/.local/share',)
-        dg_adw_gtk3_prefixes = ('/usr/share',)
+        dg_adw_gtk3_prefixes = (f'{SYSTEM_PREFIX}/share',)
     else:
-        dg_yaru_prefixes = ('/usr/share', f'{HOME}/.local/share')
+        dg_yaru_prefixes = (f'{SYSTEM_PREFIX}/share', f'{HOME}/.local/share')
         dg_adw_gtk3_prefixes = dg_yaru_prefixes
 
     names = {}
@@ -100,45 +190,49 @@ def installed(old_only = False, new_only = False, just_theme_dirs = False, direc
     }
 
     for name in names['dg-yaru']:
+        component = 'dg-yaru' if name == 'qualia' else None # the old themes don't have manifests
         for prefix in dg_yaru_prefixes:
             for subdir in ('themes', 'icons', 'sounds', 'gnome-shell/theme'):
-                paths['theme_dirs'] += glob(f'{prefix}/{subdir}/{name}*')
+                paths['theme_dirs'] += _glob(f'{prefix}/{subdir}/{name}*', component)
             if just_theme_dirs:
                 continue
-            paths['gnome-shell'] += glob(f'{prefix}/themes/{name}*/gnome-shell') + glob(f'{prefix}/gnome-shell/theme/{name}*')
-            paths['metacity'] += glob(f'{prefix}/themes/{name}*/metacity')
-            paths['cinnamon-shell'] += glob(f'{prefix}/themes/{name}*/cinnamon')
-            paths['ubuntu-unity'] += glob(f'{prefix}/themes/{name}*/unity')
-            paths['xfwm4'] += glob(f'{prefix}/themes/{name}*/xfwm4')
-            paths['icons'] += glob(f'{prefix}/icons/{name}*/*')
+            paths['gnome-shell'] += _glob(f'{prefix}/themes/{name}*/gnome-shell', component) + _glob(f'{prefix}/gnome-shell/theme/{name}*', component)
+            paths['metacity'] += _glob(f'{prefix}/themes/{name}*/metacity', component)
+            paths['cinnamon-shell'] += _glob(f'{prefix}/themes/{name}*/cinnamon', component)
+            paths['ubuntu-unity'] += _glob(f'{prefix}/themes/{name}*/unity', component)
+            paths['xfwm4'] += _glob(f'{prefix}/themes/{name}*/xfwm4', component)
+            paths['icons'] += _glob(f'{prefix}/icons/{name}*/*', component)
             paths['cursors'] += [f'{prefix}/icons/{name}/cursor.theme', f'{prefix}/icons/{name}/cursors']
             paths['sounds'] += [f'{prefix}/sounds/{name}']
             for i in ('gtksourceview-5', 'gtksourceview-4', 'gtksourceview-3.0', 'gtksourceview-2.0'):
-                paths['gtksourceview'] += glob(f'{prefix}/{i}/styles/{name}*')
+                paths['gtksourceview'] += _glob(f'{prefix}/{i}/styles/{name}*', component)
 
     for name in names['dg-adw-gtk3']:
+        component = 'dg-adw-gtk3' if name == 'qualia' else None
         for prefix in dg_adw_gtk3_prefixes:
-            paths['theme_dirs'] += glob(f'{prefix}/themes/{name}*')
+            paths['theme_dirs'] += _glob(f'{prefix}/themes/{name}*', component)
             if just_theme_dirs:
                 continue
-            paths['gtk3'] += glob(f'{prefix}/themes/{name}*/gtk-3.0') + glob(f'{prefix}/themes/{name}*/gtk-2.0')
+            paths['gtk3'] += _glob(f'{prefix}/themes/{name}*/gtk-3.0', component) + _glob(f'{prefix}/themes/{name}*/gtk-2.0', component)
 
     if not just_theme_dirs:
         if directory is None:
             for firefox_path in FIREFOX_DIR.values():
                 for name in names['dg-firefox-theme']:
-                    paths['firefox'] += glob(f'{firefox_path}/*/chrome/{name}')
+                    paths['firefox'] += _glob(f'{firefox_path}/*/chrome/{name}', 'dg-firefox-theme' if name == 'qualia' else None)
                 if not old_only:
-                    paths['firefox'] += glob(f'{firefox_path}/*/user.js') + glob(f'{firefox_path}/*/chrome/userChrome.css') + glob(f'{firefox_path}/*/userContent.css')
+                    component = 'dg-firefox-theme'
+                    paths['firefox'] += _glob(f'{firefox_path}/*/user.js', component) + _glob(f'{firefox_path}/*/chrome/userChrome.css', component) + _glob(f'{firefox_path}/*/userContent.css', component)
 
         if not old_only:
             if directory is None:
                 paths['gtk4'] += [f'{GTK4_DIR}/mac-icons']
                 paths['gtk4'] += [f'{GTK4_DIR}/gtk.css']
+                paths['gtk4'] += [f'{GTK4_DIR}/qualia']
                 for extensions_path in VSCODE_DIR.values():
                     paths['vscode'] += [f'{extensions_path}/qualia']
             for prefix in dg_adw_gtk3_prefixes:
-                paths['gtk4-libadwaita'] += glob(f'{prefix}/themes/qualia*/gtk-4.0')
+                paths['gtk4-libadwaita'] += _glob(f'{prefix}/themes/qualia*/gtk-4.0', 'dg-adw-gtk3')
 
         return paths
     return paths['theme_dirs']
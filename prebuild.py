@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+'''Builds every variant of the theme ahead of time, so it can be installed without any build tools.'''
+import os
+import sys
+import json
+import time
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import buildcache
+from paths import SRC
+from install import VARIANTS, BRED, BGREEN, BOLD, NC
+
+INDEX_VERSION = 2
+
+# Where each part is installed in the artifacts, '/' for the prefix and '~' for the home directory
+ROOTS = {
+    'dg-adw-gtk3': '/',
+    'dg-yaru': '/',
+    'dg-libadwaita': '~',
+}
+
+SOURCES = {
+    'dg-adw-gtk3': SRC['gtk3'],
+    'dg-yaru': SRC['yaru'],
+    'dg-libadwaita': SRC['gtk4'],
+}
+
+class BuildError(Exception):
+    '''Raised when a command fails, contains the output of the command.'''
+
+def run(command, cwd = None, env = None):
+    '''
+    Run a command, keeping the output in case it fails.
+
+    Parameters:
+        command (list) : A list containing the command and each argument.
+        cwd (str) : Directory to run the command in.
+        env (dict) : Environment variables to add.
+    '''
+    try:
+        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True, cwd=cwd, env=None if env is None else {**os.environ, **env})
+    except subprocess.CalledProcessError as error:
+        raise BuildError(f"'{' '.join(command)}' failed:\n{error.output.decode('utf-8')}") from error
+
+def matrix():
+    '''
+    Returns:
+        cells (list) : Every combination of accent color, light or dark, window controls, and with or without the panel icons used on Unity and MATE.
+    '''
+    return [{'color': color, 'theme': theme, 'window-controls': controls, 'panel-icons': panel}
+            for color in VARIANTS['color'] for theme in ('light', 'dark') for controls in VARIANTS['window-controls'] for panel in (False, True)]
+
+def options(component, cell, prefix, gnome_version = None):
+    '''
+    Parameters:
+        component (str) : The part of the theme.
+        cell (dict) : The variant from matrix.
+        prefix (str) : The prefix the themes are built for.
+        gnome_version (str) : The GNOME Shell version to build for, or None.
+
+    Returns:
+        options (list) : The meson options, or the install.sh options for dg-libadwaita.
+    '''
+    accent = '' if cell['color'] == 'orange' else cell['color']
+    if component == 'dg-adw-gtk3':
+        return [f'-Dprefix={prefix}', '-Dgtk4=true', '-Dgtk3=true', f"-Dwindow-controls={cell['window-controls']}", f'-Daccent-colors={accent}']
+    if component == 'dg-yaru':
+        ret = [f'-Dprefix={prefix}', f'-Daccent-colors={accent}', f"-Dwindow-controls={cell['window-controls']}", f"-Dpanel-icons={str(cell['panel-icons']).lower()}"]
+        ret += [f'-D{i}=true' for i in VARIANTS['enableable']['dg-yaru']]
+        if gnome_version is not None:
+            ret.append(f'-Dgnome-shell-version={gnome_version}')
+        return ret
+    ret = ['-c', cell['color'], '-t', cell['theme']]
+    if cell['window-controls'] == 'symbolic':
+        ret.append('-s')
+    return ret
+
+def build(component, version, build_options, output, ninja_jobs):
+    '''
+    Build one part of the theme into an artifact, in its own build directory and staging prefix.
+
+    Parameters:
+        component (str) : The part of the theme.
+        version (str) : The commit of the submodule.
+        build_options (list) : The options from the options function.
+        output (str) : The directory to write the artifact to.
+        ninja_jobs (int) : Number of jobs each ninja process can use.
+
+    Returns:
+        artifact (str) : The name of the artifact.
+        seconds (float) : How long it took, 0 if the artifact already existed.
+    '''
+    artifact = f'{component}-{buildcache.key(component, version, build_options)}.tar.gz'
+    if os.path.isfile(f'{output}/{artifact}'):
+        return artifact, 0
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=output) as tmp:
+        stage = f'{tmp}/stage'
+        os.makedirs(stage)
+        if component == 'dg-libadwaita':
+            # install.sh works in the source directory, so every build gets a copy of it
+            shutil.copytree(SOURCES[component], f'{tmp}/src', symlinks=True, ignore=shutil.ignore_patterns('.git'))
+            run(['./install.sh'] + build_options, cwd=f'{tmp}/src', env={'HOME': stage})
+        else:
+            run(['meson', f'{tmp}/build'] + build_options, cwd=SOURCES[component])
+            run(['ninja', '-C', f'{tmp}/build', '-j', str(ninja_jobs)])
+            run(['ninja', '-C', f'{tmp}/build', 'install'], env={'DESTDIR': stage})
+        with tarfile.open(f'{tmp}/{artifact}', 'w:gz') as tar:
+            for name in sorted(os.listdir(stage)):
+                tar.add(f'{stage}/{name}', arcname=name)
+        os.replace(f'{tmp}/{artifact}', f'{output}/{artifact}')
+    return artifact, time.perf_counter() - start
+
+def bundle(output, index, path):
+    '''
+    Write the index and the artifacts it uses to a single file, the index is first so it can be read as a stream.
+
+    Parameters:
+        output (str) : The directory with the artifacts.
+        index (dict) : The index.
+        path (str) : The bundle to write.
+    '''
+    with tarfile.open(path, 'w') as tar:
+        tar.add(f'{output}/index.json', arcname='index.json')
+        for artifact in sorted(index['artifacts']):
+            tar.add(f'{output}/{artifact}', arcname=artifact)
+
+def main():
+    '''The main function.'''
+    parser = argparse.ArgumentParser(description='Build every variant of the theme, and write an index of the artifacts')
+    parser.add_argument('-o', '--output', default='prebuilt', help='directory to write the artifacts and index.json to, defaults to prebuilt')
+    parser.add_argument('-p', '--prefix', default='/usr', help='prefix to build the themes for, defaults to /usr')
+    parser.add_argument('-g', '--gnome-shell-version', metavar='VERSION', help='GNOME Shell version to build the GNOME Shell theme for')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), metavar='N', help='build at most N variants at once, defaults to the number of CPUs')
+    parser.add_argument('-b', '--bundle', metavar='FILE', help='also write the index and all of the artifacts to a single file')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    os.makedirs(output, exist_ok=True)
+    jobs = max(1, args.jobs)
+    # Split the CPUs between the builds so the machine isn't oversubscribed
+    ninja_jobs = max(1, (os.cpu_count() or 1) // jobs)
+
+    versions = {}
+    for component, src in SOURCES.items():
+        if not os.path.isdir(src) or len(os.listdir(src)) == 0:
+            print(f"{BRED}{component} isn't checked out, run {BOLD}'git submodule update --init'{NC}{BRED} first.{NC}")
+            sys.exit(1)
+        versions[component] = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, check=True, cwd=src).stdout.decode('utf-8').strip()
+
+    # Variants that only differ in things a part doesn't use share a build
+    cells = matrix()
+    builds = {} # {(component, options): [cell index, ...]}
+    for i, cell in enumerate(cells):
+        cell['artifacts'] = []
+        for component in SOURCES:
+            builds.setdefault((component, tuple(options(component, cell, args.prefix, args.gnome_shell_version))), []).append(i)
+
+    index = {'version': INDEX_VERSION, 'prefix': args.prefix, 'gnome-shell-version': args.gnome_shell_version, 'artifacts': {}, 'cells': cells}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(build, component, versions[component], list(build_options), output, ninja_jobs): (component, build_options)
+                   for component, build_options in builds}
+        for future in as_completed(futures):
+            component, build_options = futures[future]
+            try:
+                artifact, seconds = future.result()
+            except BuildError as error:
+                print(f'{BRED}Building {component} {" ".join(build_options)} failed.{NC}\n{error}')
+                executor.shutdown(cancel_futures=True)
+                sys.exit(1)
+            index['artifacts'][artifact] = {'component': component, 'root': ROOTS[component], 'version': versions[component], 'options': list(build_options)}
+            for i in builds[(component, build_options)]:
+                cells[i]['artifacts'].append(artifact)
+            print(f"{BGREEN}Built{NC} {BOLD}{artifact}{NC}" + (f' in {seconds:.1f}s' if seconds > 0 else ' (already built)'))
+
+    for cell in cells:
+        cell['artifacts'].sort()
+    with open(f'{output}/index.json.tmp', 'w', encoding='UTF-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(f'{output}/index.json.tmp', f'{output}/index.json')
+    print(f'{len(cells)} variants, {len(builds)} builds in {time.perf_counter() - start:.1f}s')
+
+    if args.bundle is not None:
+        bundle(output, index, args.bundle)
+        print(f"{BGREEN}Wrote{NC} {BOLD}{args.bundle}{NC}")
+
+if __name__ == "__main__":
+    main()
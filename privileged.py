@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+'''This module is for changing files in the theme directories, using one process started with sudo when it is needed.'''
+import os
+import sys
+import json
+import shutil
+import atexit
+import subprocess
+
+from paths import HOME, SYSTEM_PREFIX, GTK4_DIR, FIREFOX_DIR, VSCODE_DIR, BUILD_CACHE, STAGE_DIR, OLD_NAMES, CURRENT_NAMES, invalidate
+
+# Directories that contain themes, anything directly in them has to start with one of the theme names
+THEME_ROOTS = []
+for prefix in (f'{SYSTEM_PREFIX}/share', f'{HOME}/.local/share'):
+    THEME_ROOTS += [f'{prefix}/themes', f'{prefix}/icons', f'{prefix}/sounds', f'{prefix}/gnome-shell/theme']
+    THEME_ROOTS += [f'{prefix}/{i}/styles' for i in ('gtksourceview-5', 'gtksourceview-4', 'gtksourceview-3.0', 'gtksourceview-2.0')]
+
+# Directories that only the theme is installed in, anything in them can be changed
+CONFIG_ROOTS = [GTK4_DIR] + list(FIREFOX_DIR.values()) + list(VSCODE_DIR.values())
+
+# Directories that files are copied from, the build cache and the stages of the install scripts
+SOURCE_ROOTS = [BUILD_CACHE, STAGE_DIR]
+
+# The roots with symlinks resolved, since the paths are checked after resolving them.
+# The helper gets them from the process that started it, see set_roots
+_REAL_THEME_ROOTS = [os.path.realpath(root) for root in THEME_ROOTS]
+_REAL_CONFIG_ROOTS = [os.path.realpath(root) for root in CONFIG_ROOTS]
+_REAL_SOURCE_ROOTS = [os.path.realpath(root) for root in SOURCE_ROOTS]
+
+THEME_NAMES = tuple({name for names in list(OLD_NAMES.values()) + list(CURRENT_NAMES.values()) for name in names})
+
+OPERATIONS = ('unlink', 'rmtree', 'mkdir', 'symlink', 'copy', 'icon-cache')
+
+class PrivilegedError(OSError):
+    '''Raised when operations fail.'''
+
+def set_roots(theme_roots, config_roots, source_roots):
+    '''
+    Replace the roots that paths are checked against.
+
+    The helper is started with sudo, which drops XDG_CACHE_HOME and QUALIA_SYSTEM_PREFIX, so the
+    roots it computes itself can differ from the ones of the process that started it.
+
+    Parameters:
+        theme_roots (list) : The directories that contain themes.
+        config_roots (list) : The directories that only the theme is installed in.
+        source_roots (list) : The directories that files are copied from.
+    '''
+    global _REAL_THEME_ROOTS, _REAL_CONFIG_ROOTS, _REAL_SOURCE_ROOTS
+    _REAL_THEME_ROOTS = [os.path.realpath(root) for root in theme_roots]
+    _REAL_CONFIG_ROOTS = [os.path.realpath(root) for root in config_roots]
+    _REAL_SOURCE_ROOTS = [os.path.realpath(root) for root in source_roots]
+
+def allowed(path):
+    '''
+    Check that a path is part of the theme.
+
+    Parameters:
+        path (str) : The path to check.
+
+    Returns:
+        allowed (bool) : Whether or not the path can be changed.
+    '''
+    path = resolve(path)
+    for root in _REAL_THEME_ROOTS:
+        if path.startswith(root + '/'):
+            return path[len(root) + 1:].startswith(THEME_NAMES)
+    for root in _REAL_CONFIG_ROOTS:
+        if path.startswith(root + '/'):
+            return True
+    return False
+
+def resolve(path):
+    '''
+    Parameters:
+        path (str) : A path.
+
+    Returns:
+        path (str) : The absolute path with the symlinks in its parent resolved, the last part is kept so a symlink itself can be changed.
+    '''
+    path = os.path.normpath(os.path.abspath(path))
+    return os.path.join(os.path.realpath(os.path.dirname(path)), os.path.basename(path))
+
+def allowed_source(source):
+    '''
+    Check that a file can be copied into the theme, so files outside of the build cache and stages can't be read.
+
+    Parameters:
+        source (str) : The path to check.
+
+    Returns:
+        allowed (bool) : Whether or not the file can be copied.
+    '''
+    source = resolve(source)
+    if not os.path.islink(source) and not os.path.isfile(source):
+        return False
+    return any(source.startswith(root + '/') for root in _REAL_SOURCE_ROOTS)
+
+def execute(operation):
+    '''
+    Run an operation in this process.
+
+    Parameters:
+        operation (dict) : {'op': one of OPERATIONS, 'path': str}, symlink also has 'target', the path to link to,
+            and copy has 'source', the file or symlink to copy. icon-cache regenerates the icon-theme.cache of an icon theme.
+    '''
+    op = operation.get('op')
+    path = operation.get('path')
+    if op not in OPERATIONS or not isinstance(path, str):
+        raise ValueError(f'Invalid operation {json.dumps(operation)}')
+    if not allowed(path):
+        raise PermissionError(f"'{path}' isn't part of the theme")
+
+    if op == 'unlink':
+        if os.path.lexists(path):
+            os.unlink(path)
+    elif op == 'rmtree':
+        if os.path.islink(path) or not os.path.isdir(path):
+            if os.path.lexists(path):
+                os.unlink(path)
+        else:
+            shutil.rmtree(path)
+    elif op == 'mkdir':
+        os.makedirs(path, exist_ok=True)
+    elif op == 'symlink':
+        # Same as 'ln -rsf', except the link is made next to the path and renamed over it so the path is never missing
+        target = os.path.relpath(operation['target'], os.path.dirname(path))
+        tmp = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(target, tmp)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+    elif op == 'copy':
+        # Copied next to the path and renamed over it, so the path is never missing or half written
+        source = operation['source']
+        if not isinstance(source, str) or not allowed_source(source):
+            raise PermissionError(f"'{source}' isn't in the build cache or a stage")
+        tmp = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        if os.path.islink(source):
+            os.symlink(os.readlink(source), tmp)
+        else:
+            shutil.copy2(source, tmp)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+    elif op == 'icon-cache':
+        command = [i for i in ('gtk-update-icon-cache', 'gtk4-update-icon-cache') if shutil.which(i) is not None]
+        if len(command) == 0:
+            raise PrivilegedError("'gtk-update-icon-cache' not found")
+        output = subprocess.run([command[0], '-q', '-f', path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+        if output.returncode != 0:
+            raise PrivilegedError(output.stdout.decode('utf-8').strip())
+
+class Helper:
+    '''
+    A process started once with sudo, that runs the operations this process doesn't have permission for.
+
+    The first line sent is the roots of this process, then operations are sent as JSON lines, and
+    it replies with a JSON line for each of them.
+    '''
+    def __init__(self):
+        self.process = None
+
+    def run(self, operations):
+        '''
+        Run operations in the privileged process, starting it if it isn't running.
+
+        Parameters:
+            operations (list) : The operations to run.
+
+        Returns:
+            results (list) : {'ok': bool, 'error': str} for each operation.
+        '''
+        if self.process is None:
+            self.process = subprocess.Popen(['sudo', sys.executable, os.path.realpath(__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            atexit.register(self.stop)
+            self.process.stdin.write(json.dumps({'theme roots': THEME_ROOTS, 'config roots': CONFIG_ROOTS, 'source roots': SOURCE_ROOTS}) + '\n')
+        for operation in operations:
+            self.process.stdin.write(json.dumps(operation) + '\n')
+        self.process.stdin.flush()
+        results = []
+        for _ in operations:
+            line = self.process.stdout.readline()
+            if line == '':
+                raise PrivilegedError('The privileged helper exited')
+            results.append(json.loads(line))
+        return results
+
+    def stop(self):
+        '''Stops the privileged process.'''
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+helper = Helper()
+
+def batch(operations, verbose = False, dry_run = False, check = True):
+    '''
+    Run operations, only using the privileged helper for the ones this process doesn't have permission for.
+
+    Parameters:
+        operations (list) : The operations to run, see execute.
+        verbose (bool) : Print the operations.
+        dry_run (bool) : Don't actually run the operations.
+        check (bool) : Raise PrivilegedError if any of the operations fail.
+
+    Returns:
+        results (list) : {'ok': bool, 'error': str} for each operation.
+    '''
+    results = [None] * len(operations)
+    privileged = []
+    for i, operation in enumerate(operations):
+        if verbose:
+            print(f"{operation['op'].capitalize()} {operation['path']}" + (f" -> {operation['target']}" if 'target' in operation else '') + (f" from {operation['source']}" if 'source' in operation else ''))
+        if dry_run:
+            results[i] = {'ok': True}
+            continue
+        try:
+            execute(operation)
+            results[i] = {'ok': True}
+        except PermissionError as error:
+            if os.getuid() == 0 or not allowed(operation['path']) or ('source' in operation and not allowed_source(operation['source'])):
+                results[i] = {'ok': False, 'error': str(error)}
+            else:
+                privileged.append(i)
+        except (OSError, ValueError) as error:
+            results[i] = {'ok': False, 'error': str(error)}
+
+    if len(privileged) > 0:
+        for i, result in zip(privileged, helper.run([operations[i] for i in privileged])):
+            results[i] = result
+
+    if not dry_run and len(operations) > 0:
+        invalidate()
+
+    errors = [result['error'] for result in results if not result['ok']]
+    if check and len(errors) > 0:
+        raise PrivilegedError('\n'.join(errors))
+    return results
+
+def remove(paths, verbose = False, dry_run = False):
+    '''
+    Delete files and directories, like 'rm -rf'.
+
+    Parameters:
+        paths (list) : The paths to delete.
+        verbose (bool) : Print the paths.
+        dry_run (bool) : Don't actually delete anything.
+    '''
+    paths = [path for path in paths if path != '/']
+    if verbose:
+        for path in paths:
+            print('Deleting ' + path)
+    batch([{'op': 'rmtree', 'path': path} for path in paths], dry_run=dry_run)
+
+def main():
+    '''Runs operations read from stdin, one JSON object per line after the roots.'''
+    try:
+        roots = json.loads(sys.stdin.readline())
+        set_roots(roots['theme roots'], roots['config roots'], roots['source roots'])
+    except (ValueError, KeyError, TypeError):
+        print('The privileged helper has to be started by Helper.run', file=sys.stderr)
+        sys.exit(1)
+    for line in sys.stdin:
+        try:
+            execute(json.loads(line))
+            result = {'ok': True}
+        except (OSError, ValueError, KeyError) as error:
+            result = {'ok': False, 'error': str(error)}
+        print(json.dumps(result), flush=True)
+
+if __name__ == "__main__":
+    main()
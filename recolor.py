@@ -0,0 +1,287 @@
+'''
+This module is for changing the accent color of a cached build without building it again.
+
+Token maps are learned by comparing cached builds that only differ in the accent color. Every color
+in the compiled CSS, SVG and other text files is a token, and a map pairs the tokens of one accent
+with the tokens in the same place for another accent. A build can be recolored if every color in its
+text files is in the map, and no other file was different between the accents.
+
+Maps are only learned between accent colors that have both been built from the same submodule commit,
+so an accent color that was never built can't be recolored and is always built with meson. What the
+maps save is building an accent color again when other options change, like the window controls or
+the parts that are installed: the build for another accent color with the new options is recolored.
+'''
+import os
+import re
+import json
+import shutil
+import threading
+
+import buildcache
+from paths import CACHE_DIR
+from privileged import allowed
+
+RECOLOR_MAPS = f'{CACHE_DIR}/recolor.json'
+
+TOKEN = re.compile(rb'#[0-9a-fA-F]{8}\b|#[0-9a-fA-F]{6}\b|#[0-9a-fA-F]{3}\b|rgba?\([0-9., %]*\)')
+
+# Files that are recolored, everything else has to be the same for every accent
+TEXT_SUFFIXES = ('.css', '.svg', '.xml', '.theme', '.rc', 'gtkrc', '.json', '.js')
+
+ACCENT_OPTION = '-Daccent-colors='
+
+_lock = threading.Lock()
+
+class Unmappable(Exception):
+    '''Raised when a build can't be recolored, so it has to be built.'''
+
+def accent(options):
+    '''
+    Parameters:
+        options (list) : The meson options.
+
+    Returns:
+        color (str) : The accent color the options are for.
+    '''
+    for option in options:
+        if option.startswith(ACCENT_OPTION):
+            return option[len(ACCENT_OPTION):] or 'orange'
+    return 'orange'
+
+def _other_options(options):
+    return sorted(option for option in options if not option.startswith(ACCENT_OPTION))
+
+def rename(name, old, new):
+    '''
+    Parameters:
+        name (str) : Name of a theme dir, like 'qualia-blue-dark'.
+        old (str) : The accent color the name is for.
+        new (str) : The accent color to rename it for.
+
+    Returns:
+        name (str) : The name for the new accent color, like 'qualia-red-dark'.
+    '''
+    old_prefix = 'qualia' if old == 'orange' else f'qualia-{old}'
+    new_prefix = 'qualia' if new == 'orange' else f'qualia-{new}'
+    if name == old_prefix or name.startswith((old_prefix + '-', old_prefix + '.')):
+        return new_prefix + name[len(old_prefix):]
+    return name
+
+def _top(stage, path):
+    '''Split a staged path into its theme dir and the path in the theme dir.'''
+    parts = os.path.relpath(path, stage).split('/')
+    for i in range(len(parts)):
+        if allowed('/' + '/'.join(parts[:i + 1])):
+            return '/'.join(parts[:i + 1]), '/'.join(parts[i + 1:])
+    return None, None
+
+def _walk(stage):
+    '''{(theme dir, path in theme dir): staged path} for every file and symlink in a stage.'''
+    files = {}
+    for parent, dirs, names in os.walk(stage):
+        for name in names + [i for i in dirs if os.path.islink(os.path.join(parent, i))]:
+            path = os.path.join(parent, name)
+            top, rest = _top(stage, path)
+            if top is not None:
+                files[(top, rest)] = path
+    return files
+
+def load():
+    '''
+    Returns:
+        maps (dict) : {component: {'old>new': map}}, see learn_pair.
+    '''
+    try:
+        with open(RECOLOR_MAPS, encoding='UTF-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save(maps):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(f'{RECOLOR_MAPS}.tmp', 'w', encoding='UTF-8') as f:
+        json.dump(maps, f)
+    os.replace(f'{RECOLOR_MAPS}.tmp', RECOLOR_MAPS)
+
+def learn_pair(stage_a, color_a, stage_b, color_b):
+    '''
+    Learn how to recolor a build of one accent color to another.
+
+    Parameters:
+        stage_a (str) : A cached build.
+        color_a (str) : Its accent color.
+        stage_b (str) : A cached build with the same options, except the accent color.
+        color_b (str) : Its accent color.
+
+    Returns:
+        map (dict) : {'tokens': {a: b}, 'ambiguous': [a], 'names': {a: b}, 'accented': [[theme dir, path in theme dir], ...]}, see recolor.
+    '''
+    files_a = _walk(stage_a)
+    files_b = _walk(stage_b)
+    names = {}
+    for top, _ in files_a:
+        if top in names:
+            continue
+        # The theme dir is renamed if there is one with the new name, like the cursors it might not depend on the accent
+        parent, name = os.path.split(top)
+        renamed = os.path.join(parent, rename(name, color_a, color_b))
+        names[top] = renamed if any(i[0] == renamed for i in files_b) else top
+
+    tokens = {}
+    ambiguous = set()
+    accented = set()
+    for (top, rest), path_a in files_a.items():
+        path_b = files_b.get((names[top], rest))
+        if path_b is None:
+            accented.add((top, rest))
+            continue
+        if os.path.islink(path_a) or os.path.islink(path_b):
+            if not (os.path.islink(path_a) and os.path.islink(path_b) and os.readlink(path_a) == os.readlink(path_b)):
+                accented.add((top, rest))
+            continue
+        with open(path_a, 'rb') as f:
+            data_a = f.read()
+        with open(path_b, 'rb') as f:
+            data_b = f.read()
+        if not path_a.endswith(TEXT_SUFFIXES):
+            if data_a != data_b:
+                accented.add((top, rest))
+            continue
+        if TOKEN.split(data_a) != TOKEN.split(data_b):
+            accented.add((top, rest)) # something other than the colors changed
+            continue
+        for token_a, token_b in zip(TOKEN.findall(data_a), TOKEN.findall(data_b)):
+            token_a, token_b = token_a.decode('ascii'), token_b.decode('ascii')
+            if tokens.setdefault(token_a, token_b) != token_b:
+                ambiguous.add(token_a)
+    return {'tokens': tokens, 'ambiguous': sorted(ambiguous), 'names': names, 'accented': [list(i) for i in sorted(accented)]}
+
+def learn(component, version, options, stage):
+    '''
+    Learn maps between a build and the cached builds that only differ from it in the accent color.
+
+    Parameters:
+        component (str) : The part of the theme.
+        version (str) : The commit of the submodule.
+        options (list) : The meson options.
+        stage (str) : The directory the build is cached in.
+    '''
+    color = accent(options)
+    known = load().get(component, {})
+    learned = {}
+    for key, meta in buildcache.builds().items():
+        if meta['component'] != component or meta['version'] != version or _other_options(meta['options']) != _other_options(options):
+            continue
+        other = accent(meta['options'])
+        if other == color or known.get(f'{color}>{other}', {}).get('version') == version:
+            continue # maps only have to be learned again when the submodule changes
+        other_stage = buildcache.lookup(key)
+        if other_stage is None:
+            continue
+        learned[f'{color}>{other}'] = {'version': version, **learn_pair(stage, color, other_stage, other)}
+        learned[f'{other}>{color}'] = {'version': version, **learn_pair(other_stage, other, stage, color)}
+    if len(learned) > 0:
+        with _lock:
+            maps = load()
+            maps.setdefault(component, {}).update(learned)
+            _save(maps)
+
+def find_map(component, old, new, version):
+    '''
+    Parameters:
+        component (str) : The part of the theme.
+        old (str) : The accent color of the cached build.
+        new (str) : The accent color that is needed.
+        version (str) : The commit of the submodule, maps learned from other commits aren't used.
+
+    Returns:
+        map (dict) : The map from old to new, going through another accent color if there isn't a direct one. None if there isn't one.
+    '''
+    maps = {pair: value for pair, value in load().get(component, {}).items() if value.get('version') == version}
+    if f'{old}>{new}' in maps:
+        return maps[f'{old}>{new}']
+    for pair, first in maps.items():
+        middle = pair.split('>')[1]
+        if not pair.startswith(f'{old}>') or f'{middle}>{new}' not in maps:
+            continue
+        second = maps[f'{middle}>{new}']
+        back = {b: a for a, b in first['names'].items()}
+        return {
+            'tokens': {a: second['tokens'][b] for a, b in first['tokens'].items() if b in second['tokens']},
+            'ambiguous': sorted(set(first['ambiguous']) | {a for a, b in first['tokens'].items() if b in second['ambiguous']}),
+            'names': {a: second['names'][b] for a, b in first['names'].items() if b in second['names']},
+            'accented': first['accented'] + [[back[top], rest] for top, rest in second['accented'] if top in back],
+        }
+    return None
+
+def _recolor_file(source, dest, token_map):
+    def replace(match):
+        token = match.group(0).decode('ascii')
+        if token not in token_map:
+            raise Unmappable(f"'{source}' has the color {token}, which isn't in the map")
+        return token_map[token].encode('ascii')
+    with open(source, 'rb') as f_in, open(dest, 'wb') as f_out:
+        for line in f_in:
+            f_out.write(TOKEN.sub(replace, line))
+    shutil.copymode(source, dest)
+
+def recolor(stage, recolor_map, destdir):
+    '''
+    Write a build for another accent color, the text files are recolored a line at a time and the other files are copied.
+
+    Parameters:
+        stage (str) : A cached build.
+        recolor_map (dict) : The map from find_map.
+        destdir (str) : Directory to write the build to, from buildcache.reserve.
+    '''
+    token_map = {a: b for a, b in recolor_map['tokens'].items() if a not in recolor_map['ambiguous']}
+    accented = {tuple(i) for i in recolor_map['accented']}
+    for (top, rest), path in _walk(stage).items():
+        if (top, rest) in accented:
+            raise Unmappable(f"'{top}/{rest}' is different for every accent color")
+        if top not in recolor_map['names']:
+            raise Unmappable(f"'{top}' isn't in the map")
+        dest = os.path.join(destdir, recolor_map['names'][top], rest) if rest != '' else os.path.join(destdir, recolor_map['names'][top])
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), dest)
+        elif path.endswith(TEXT_SUFFIXES):
+            _recolor_file(path, dest, token_map)
+        else:
+            shutil.copy2(path, dest)
+    # Directories that were installed empty
+    for parent, dirs, _ in os.walk(stage):
+        for name in dirs:
+            top, rest = _top(stage, os.path.join(parent, name))
+            if top in recolor_map['names'] and not os.path.islink(os.path.join(parent, name)):
+                os.makedirs(os.path.join(destdir, recolor_map['names'][top], rest), exist_ok=True)
+
+def build(component, version, options, key):
+    '''
+    Recolor a cached build of another accent color into the cache.
+
+    Parameters:
+        component (str) : The part of the theme.
+        version (str) : The commit of the submodule.
+        options (list) : The meson options that are needed.
+        key (str) : The build cache key for them.
+
+    Returns:
+        stage (str) : The directory the recolored build is cached in, or None if it has to be built.
+    '''
+    color = accent(options)
+    for other_key, meta in buildcache.builds().items():
+        if meta['component'] != component or meta['version'] != version or _other_options(meta['options']) != _other_options(options):
+            continue
+        other = accent(meta['options'])
+        recolor_map = find_map(component, other, color, version)
+        stage = buildcache.lookup(other_key)
+        if recolor_map is None or stage is None:
+            continue
+        destdir = buildcache.reserve(key)
+        try:
+            recolor(stage, recolor_map, destdir)
+        except (Unmappable, OSError):
+            continue
+        return buildcache.commit(key, {'component': component, 'version': version, 'options': options})
+    return None
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+'''This module is for managing snaps through the snapd REST API.'''
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import http.client
+
+SOCKET = '/run/snapd.socket'
+
+class SnapdError(Exception):
+    '''Raised when snapd returns an error or a change fails.'''
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''
+    A HTTP connection over a Unix socket.
+
+    Attributes:
+        path (str) : Path to the socket.
+    '''
+    def __init__(self, path, timeout = 30):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+class Snapd:
+    '''
+    Client for the snapd REST API.
+
+    The installed snaps and the interface connections are fetched once and cached until changes are
+    applied. Changes are built as requests and submitted together by apply, which waits for all of
+    them to finish.
+
+    Attributes:
+        socket_path (str) : Path to the snapd socket, a stand-in socket can be used for testing.
+        verbose (bool) : Print the requests that change anything.
+        sudo (bool) : Submit changes through a process started with sudo when not running as root.
+    '''
+    def __init__(self, socket_path = SOCKET, verbose = False, sudo = True):
+        self.socket_path = socket_path
+        self.verbose = verbose
+        self.sudo = sudo
+        self._snaps = None
+        self._connections = None
+
+    def available(self):
+        '''
+        Returns:
+            available (bool) : Whether or not snapd is running.
+        '''
+        return os.path.exists(self.socket_path)
+
+    def _request(self, method, path, body = None):
+        connection = UnixHTTPConnection(self.socket_path)
+        try:
+            headers = {}
+            if body is not None:
+                body = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, path, body, headers)
+            response = json.loads(connection.getresponse().read().decode('utf-8'))
+        finally:
+            connection.close()
+        if response.get('type') == 'error':
+            result = response.get('result', {})
+            raise SnapdError(result.get('message', 'Unknown error') if isinstance(result, dict) else result)
+        if response.get('type') == 'async':
+            return response['change']
+        return response.get('result')
+
+    def snaps(self):
+        '''
+        Returns:
+            snaps (set) : The names of the installed snaps.
+        '''
+        if self._snaps is None:
+            self._snaps = {i['name'] for i in self._request('GET', '/v2/snaps')}
+        return self._snaps
+
+    def connections(self):
+        '''
+        Returns:
+            connections (list) : [(plug snap, plug, slot snap, slot), ...] the established interface connections.
+        '''
+        if self._connections is None:
+            result = self._request('GET', '/v2/connections')
+            self._connections = [(i['plug']['snap'], i['plug']['plug'], i['slot']['snap'], i['slot']['slot']) for i in result.get('established') or []]
+        return self._connections
+
+    def connectivity(self):
+        '''
+        Returns:
+            connected (bool) : Whether or not snapd can reach the store.
+        '''
+        try:
+            return bool(self._request('GET', '/v2/debug?aspect=connectivity').get('connectivity'))
+        except (OSError, SnapdError, AttributeError):
+            return False
+
+    @staticmethod
+    def snaps_request(action, names):
+        '''
+        Parameters:
+            action (str) : 'install', 'refresh' or 'remove'.
+            names (list) : The snaps to change.
+
+        Returns:
+            request (tuple) : The request to pass to apply.
+        '''
+        return ('POST', '/v2/snaps', {'action': action, 'snaps': list(names)})
+
+    @staticmethod
+    def interface_request(action, plug_snap, plug, slot_snap, slot):
+        '''
+        Parameters:
+            action (str) : 'connect' or 'disconnect'.
+            plug_snap (str) : The snap that has the plug.
+            plug (str) : The name of the plug.
+            slot_snap (str) : The snap that has the slot.
+            slot (str) : The name of the slot.
+
+        Returns:
+            request (tuple) : The request to pass to apply.
+        '''
+        return ('POST', '/v2/interfaces', {'action': action, 'plugs': [{'snap': plug_snap, 'plug': plug}], 'slots': [{'snap': slot_snap, 'slot': slot}]})
+
+    def apply(self, requests):
+        '''
+        Submit requests that change snaps, then wait for all of the changes to finish.
+
+        Parameters:
+            requests (list) : Requests from snaps_request and interface_request.
+        '''
+        if len(requests) == 0:
+            return
+        self._snaps = self._connections = None
+        if self.verbose:
+            for method, path, body in requests:
+                print(f'{method} {path} {json.dumps(body)}')
+
+        if self.sudo and os.getuid() != 0:
+            # Changing snaps needs root, so hand the whole batch to one privileged process
+            subprocess.run(['sudo', sys.executable, os.path.realpath(__file__), self.socket_path], input=json.dumps(requests).encode('utf-8'), check=True)
+            return
+
+        changes = [self._request(method, path, body) for method, path, body in requests]
+        for change in changes:
+            if not isinstance(change, str):
+                continue
+            while True:
+                result = self._request('GET', f'/v2/changes/{change}')
+                if result.get('ready'):
+                    if result.get('status') != 'Done':
+                        raise SnapdError(result.get('err', f"Change {change} failed"))
+                    break
+                time.sleep(0.2)
+
+def main():
+    '''Applies the requests read from stdin, used by Snapd.apply when it isn't running as root.'''
+    try:
+        Snapd(sys.argv[1] if len(sys.argv) > 1 else SOCKET, sudo = False).apply(json.load(sys.stdin))
+    except (OSError, SnapdError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+This module is for reading a configuration from a file or environment variables, so the theme can be installed without any prompts.
+
+A spec is a JSON object, every key is optional and the environment variables override it:
+
+    {
+        "dir": "default",                 QUALIA_DIR
+        "color": "blue",                  QUALIA_COLOR
+        "theme": "dark",                  QUALIA_THEME
+        "window-controls": "macos",       QUALIA_WINDOW_CONTROLS
+        "enabled": ["gtk3", "icons"],     QUALIA_ENABLED, separated by spaces or commas
+        "flatpak": true,                  QUALIA_FLATPAK
+        "firefox-settings": true,         QUALIA_FIREFOX_SETTINGS
+        "default-syntax": false           QUALIA_DEFAULT_SYNTAX
+    }
+'''
+import os
+import sys
+import json
+
+ENV = {
+    'QUALIA_DIR': 'dir',
+    'QUALIA_COLOR': 'color',
+    'QUALIA_THEME': 'theme',
+    'QUALIA_WINDOW_CONTROLS': 'window-controls',
+    'QUALIA_ENABLED': 'enabled',
+    'QUALIA_FLATPAK': 'flatpak',
+    'QUALIA_FIREFOX_SETTINGS': 'firefox-settings',
+    'QUALIA_DEFAULT_SYNTAX': 'default-syntax',
+}
+
+STRING_KEYS = ('dir', 'color', 'theme', 'window-controls')
+BOOL_KEYS = ('flatpak', 'firefox-settings', 'default-syntax')
+
+class SpecError(Exception):
+    '''Raised when a spec can't be read or has a value of the wrong type.'''
+
+def _bool(key, value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.casefold() in ('y', 'yes', 'true', '1'):
+        return True
+    if isinstance(value, str) and value.casefold() in ('n', 'no', 'false', '0'):
+        return False
+    raise SpecError(f"'{key}' has to be true or false, not '{value}'")
+
+def normalize(spec):
+    '''
+    Parameters:
+        spec (dict) : A spec read from a file or the environment.
+
+    Returns:
+        spec (dict) : The same spec with lists and booleans parsed, and unknown keys rejected.
+    '''
+    ret = {}
+    for key, value in spec.items():
+        if key in STRING_KEYS:
+            if not isinstance(value, str):
+                raise SpecError(f"'{key}' has to be a string, not '{value}'")
+            ret[key] = value
+        elif key in BOOL_KEYS:
+            ret[key] = _bool(key, value)
+        elif key == 'enabled':
+            if isinstance(value, str):
+                value = value.replace(',', ' ').split()
+            if not isinstance(value, list) or not all(isinstance(i, str) for i in value):
+                raise SpecError(f"'enabled' has to be a list of themes, not '{value}'")
+            ret[key] = value
+        else:
+            raise SpecError(f"Unknown key '{key}'")
+    return ret
+
+def read(path = None, environ = None):
+    '''
+    Parameters:
+        path (str) : The spec file, '-' for stdin, or None to only use the environment.
+        environ (dict) : The environment variables, defaults to os.environ.
+
+    Returns:
+        spec (dict) : The spec, or None if there is no file and none of the environment variables are set.
+    '''
+    environ = os.environ if environ is None else environ
+    spec = {}
+    if path is not None:
+        try:
+            if path == '-':
+                spec = json.load(sys.stdin)
+            else:
+                with open(path, encoding='UTF-8') as f:
+                    spec = json.load(f)
+        except (OSError, ValueError) as error:
+            raise SpecError(f"Can't read '{path}': {error}") from error
+        if not isinstance(spec, dict):
+            raise SpecError(f"'{path}' has to be a JSON object")
+    spec.update({key: environ[variable] for variable, key in ENV.items() if variable in environ})
+    if path is None and len(spec) == 0:
+        return None
+    return normalize(spec)
@@ -0,0 +1,78 @@
+'''This module is for installing staged files, only writing the ones that are different from what is installed.'''
+import os
+
+import manifest
+from privileged import allowed
+
+def _same(source, dest, source_stat):
+    '''Compare a staged file to an installed one, the content is only hashed if the size matches and the mtime doesn't.'''
+    try:
+        dest_stat = os.lstat(dest)
+    except FileNotFoundError:
+        return False
+    if os.path.islink(source) or os.path.islink(dest):
+        return os.path.islink(source) and os.path.islink(dest) and os.readlink(source) == os.readlink(dest)
+    if not os.path.isfile(dest) or dest_stat.st_size != source_stat.st_size:
+        return False
+    if dest_stat.st_mtime_ns == source_stat.st_mtime_ns:
+        return True
+    return manifest.file_hash(source) == manifest.file_hash(dest)
+
+def plan(stage, root, component, keep = ()):
+    '''
+    Compare a staged tree to what is installed.
+
+    Parameters:
+        stage (str) : The directory the files were installed to.
+        root (str) : The directory the stage is installed in, '/' for a DESTDIR and the home directory for a HOME.
+        component (str) : The part of the theme, files in its manifest that aren't staged anymore are deleted.
+        keep (tuple) : Paths ending in '/', what is in them isn't deleted even if it isn't staged anymore.
+
+    Returns:
+        operations (list) : Operations that make the installed files match the stage, see privileged.execute.
+        stats (dict) : {'written': files written, 'bytes': bytes written, 'deleted': files deleted, 'unchanged': files that are the same}
+    '''
+    operations = []
+    stats = {'written': 0, 'bytes': 0, 'deleted': 0, 'unchanged': 0}
+    staged = set()
+    for parent, dirs, files in os.walk(stage):
+        for name in dirs + files:
+            source = os.path.join(parent, name)
+            dest = os.path.join(root, os.path.relpath(source, stage))
+            if not allowed(dest):
+                continue
+            staged.add(dest)
+            source_stat = os.lstat(source)
+            if name in dirs and not os.path.islink(source):
+                if os.path.islink(dest) or not os.path.isdir(dest):
+                    operations.append({'op': 'mkdir', 'path': dest})
+            elif _same(source, dest, source_stat):
+                stats['unchanged'] += 1
+            else:
+                operations.append({'op': 'copy', 'path': dest, 'source': source})
+                stats['written'] += 1
+                stats['bytes'] += source_stat.st_size
+
+    # Theme dirs that are staged, anything in them that isn't staged anymore was installed by an older version
+    theme_dirs = tuple(path + '/' for path in staged if os.path.dirname(path) == root.rstrip('/') or not allowed(os.path.dirname(path)))
+    for path, entry in (manifest.load(component) or {}).items():
+        if entry[0] != 'd' and path not in staged and path.startswith(theme_dirs) and not (path + '/').startswith(keep) and os.path.lexists(path):
+            operations.append({'op': 'unlink', 'path': path})
+            stats['deleted'] += 1
+    return operations, stats
+
+def report(stats):
+    '''
+    Parameters:
+        stats (dict) : The stats from plan.
+
+    Returns:
+        report (str) : A summary of what was written.
+    '''
+    size = stats['bytes']
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+    size = f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+    return f"wrote {stats['written']} files ({size}), deleted {stats['deleted']}, {stats['unchanged']} unchanged"
@@ -0,0 +1,160 @@
+'''
+This module is for recording where the installer spends its time.
+
+Spans are nested per thread, and every span belongs to a phase, which it gets from the span it is
+in if it doesn't name one, or from the phase of the run that was started with phase. Commands are
+spans too, so the number of processes started in each phase is counted. Nothing is recorded unless
+enabled is set. The spans can be written as Chrome trace events, which can be opened in
+chrome://tracing or https://ui.perfetto.dev.
+'''
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+enabled = False
+
+_start = time.perf_counter()
+_lock = threading.Lock()
+_spans = [] # {'name', 'phase', 'start', 'end', 'thread', 'command', 'args'}, in the order they ended
+_threads = {} # {thread id: thread name}
+_local = threading.local()
+_current = None # (phase, start) of the phase of the run, see phase
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def _record(name, phase, start, end, args):
+    thread = threading.current_thread()
+    with _lock:
+        _threads[thread.ident] = thread.name
+        _spans.append({'name': name, 'phase': phase, 'start': start - _start, 'end': end - _start,
+                       'thread': thread.ident, 'command': 'command' in args, 'args': args})
+
+def phase(name):
+    '''
+    End the current phase of the run and start the next one, spans that aren't in another span are part of it.
+
+    Parameters:
+        name (str) : The next phase, or None to only end the current one.
+    '''
+    global _current
+    if not enabled:
+        return
+    now = time.perf_counter()
+    if _current is not None:
+        _record(_current[0], _current[0], _current[1], now, {})
+    _current = (name, now) if name is not None else None
+
+@contextmanager
+def span(name, phase = None, **args):
+    '''
+    Record how long the with block takes.
+
+    Parameters:
+        name (str) : What is being done.
+        phase (str) : The phase it is part of, defaults to the phase of the span it is in.
+        args : Anything else to record, the dictionary is yielded so more can be added in the with block.
+    '''
+    if not enabled:
+        yield args
+        return
+    stack = _stack()
+    if phase is None:
+        if len(stack) > 0:
+            phase = stack[-1]
+        else:
+            phase = _current[0] if _current is not None else 'other'
+    stack.append(phase)
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        stack.pop()
+        _record(name, phase, start, time.perf_counter(), args)
+
+@contextmanager
+def command(argv, cwd = None):
+    '''
+    Record a process, set 'exit code' in the yielded dictionary once it is known.
+
+    Parameters:
+        argv (list) : The command and its arguments.
+        cwd (str) : Directory it runs in.
+    '''
+    args = {'command': ' '.join(argv)}
+    if cwd is not None:
+        args['cwd'] = cwd
+    with span(os.path.basename(argv[0]), **args) as info:
+        yield info
+
+def events():
+    '''
+    Returns:
+        events (list) : The spans as Chrome trace events, with a name for each thread.
+    '''
+    pid = os.getpid()
+    with _lock:
+        spans = list(_spans)
+        threads = dict(_threads)
+    ret = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}} for tid, name in threads.items()]
+    for i in sorted(spans, key=lambda i: i['start']):
+        ret.append({'name': i['name'], 'cat': i['phase'], 'ph': 'X', 'pid': pid, 'tid': i['thread'],
+                    'ts': round(i['start'] * 1e6), 'dur': round((i['end'] - i['start']) * 1e6), 'args': i['args']})
+    return ret
+
+def write(path):
+    '''
+    Parameters:
+        path (str) : The file to write the trace to.
+    '''
+    with open(f'{path}.tmp', 'w', encoding='UTF-8') as f:
+        json.dump({'traceEvents': events(), 'displayTimeUnit': 'ms'}, f)
+    os.replace(f'{path}.tmp', path)
+
+def _wall(intervals):
+    '''Time covered by the intervals, spans that ran at the same time are only counted once.'''
+    total = 0
+    end = None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+def summary():
+    '''
+    Returns:
+        rows (list) : [(phase, wall seconds, processes started), ...] in the order the phases started.
+    '''
+    with _lock:
+        spans = list(_spans)
+    phases = {}
+    for i in sorted(spans, key=lambda i: i['start']):
+        phase = phases.setdefault(i['phase'], {'intervals': [], 'spawns': 0})
+        phase['intervals'].append((i['start'], i['end']))
+        if i['command']:
+            phase['spawns'] += 1
+    return [(name, _wall(phase['intervals']), phase['spawns']) for name, phase in phases.items()]
+
+def table():
+    '''
+    Returns:
+        table (str) : The summary, with a row for the whole run.
+    '''
+    rows = summary()
+    width = max([len(name) for name, _, _ in rows] + [len('total')])
+    lines = [f"{'phase':<{width}}  {'wall':>9}  {'spawns':>6}"]
+    for name, wall, spawns in rows:
+        lines.append(f'{name:<{width}}  {wall:>8.2f}s  {spawns:>6}')
+    with _lock:
+        total = _wall([(i['start'], i['end']) for i in _spans])
+        spawns = sum(1 for i in _spans if i['command'])
+    lines.append(f"{'total':<{width}}  {total:>8.2f}s  {spawns:>6}")
+    return '\n'.join(lines)
@@ -4,10 +4,14 @@
 import os
 import sys
 import shutil
-import subprocess
 
 from install import Config, Enable, VARIANTS
-from paths import installed, CONFIG
+from snapd import Snapd
+from privileged import remove, PrivilegedError
+import manifest
+import iconcache
+from paths import CACHE_DIR, FINGERPRINTS, installed
+from configstore import ConfigStore
 
 NC = '\033[0m'
 BOLD = '\033[1m'
@@ -34,6 +38,10 @@ Or run '{sys.argv[0]}' with no arguments to uninstall the entire theme.'''
 verbose = False
 dry_run = False
 
+snapd = Snapd()
+store = ConfigStore()
+fingerprints = ConfigStore(FINGERPRINTS, ())
+
 available_themes = {}
 for theme in VARIANTS['enableable']:
     if theme == 'extra':
@@ -44,73 +52,104 @@ for theme in VARIANTS['enableable']:
 
 def remove_config(name, version = False):
     '''
-    Removes themes from config file after they are uninstalled.
+    Removes themes from the config after they are uninstalled, it is written once the batch in main ends.
 
     Parameters:
-    name (str) : The name of the theme or line to remove.
-    version (bool) : True if the line that stores the git version for the theme is being removed.
+    name (str) : The name of the theme or part to remove.
+    version (bool) : True if the git version and fingerprint stored for the theme are being removed.
     '''
-    if os.path.isfile(CONFIG) and not dry_run:
-        with open(CONFIG, 'r', encoding='UTF-8') as f:
-            filedata = f.read()
-        for line in filedata.split('\n'):
-            if version and line.startswith(name):
-                filedata = filedata.replace(line + '\n', '')
-            elif line.startswith("enabled"):
-                newline = line.replace(f' {name}', '')
-                if name == 'firefox':
-                    newline = newline.replace(f' settings_theme', '')
-                elif name == 'vscode':
-                    newline = newline.replace(f' default_syntax', '')
-                filedata = filedata.replace(line, newline)
-        with open(CONFIG, 'w', encoding='UTF-8') as f:
-            f.write(filedata)
-
-def delete(path):
+    if dry_run or not store.exists():
+        return
+    if version:
+        store.set('versions', {theme: commit for theme, commit in store.get('versions', {}).items() if theme != name})
+        if name in fingerprints.data:
+            del fingerprints.data[name]
+            fingerprints.save()
+    else:
+        removing = [name] + (['settings_theme'] if name == 'firefox' else []) + (['default_syntax'] if name == 'vscode' else [])
+        store.set('enabled', [part for part in store.get('enabled', []) if part not in removing])
+
+def delete(*paths):
     '''
-    Deletes a file or directory using rm.
+    Deletes files or directories like 'rm -rf', using sudo only for the paths we can't delete ourselves.
 
     Parameters:
-    path (str) : The path to remove.
+    paths (str) : The paths to remove.
     '''
-    if verbose:
-        print('Deleting ' + path)
-    if not dry_run and path != '/':
-        subprocess.run(['sudo', 'rm', '-rf', path], check=True)
+    remove(paths, verbose, dry_run)
+    iconcache.touch(paths)
+    if not dry_run:
+        manifest.discard(paths)
 
-def remove_empty():
+def prune(directory, theme_dir = False):
     '''
-    Removes empty theme directories.
+    Find what can be removed in a directory, starting from the deepest directories.
+
+    Broken symlinks and empty directories are removed at any depth. In theme dirs,
+    index.theme is removed if it is all that is left, or if there is no GTK theme left for it,
+    and icon-theme.cache is removed if there is no index.theme left for it.
+
+    Parameters:
+    directory (str) : The directory to check.
+    theme_dir (bool) : True if the directory is a theme dir.
+
+    Returns:
+        removable (list) : The paths that can be removed, directories that can be removed aren't listed again for their contents.
+        empty (bool) : True if the directory can be removed as well.
     '''
-    theme_dirs = installed(just_theme_dirs = True)
+    removable = []
+    kept = []
     try:
-        if isinstance(theme_dirs, list):
-            for path in theme_dirs:
-                folders = next(os.walk(path))[1]
-                files = next(os.walk(path))[2]
-                if len(files) > 0:
-                    skip_dir = False
-                    for file in files:
-                        file_path = f'{path}/{file}'
-                        if file != 'index.theme':
-                            if os.path.islink(file_path) and not os.path.exists(os.readlink(file_path)):
-                                delete(file_path) # remove broken symlinks
-                            else:
-                                skip_dir = True # If index.theme is the only file, delete the dir. otherwise leave it.
-                        elif 'share/themes' in path: # Remove gtk index if gtk theme is deleted
-                            remove_index = True
-                            for subdir in ('gtk-3.0', 'gtk-4.0'):
-                                if subdir in folders:
-                                    remove_index = False
-                            if remove_index:
-                                delete(file_path)
-                else:
-                    skip_dir = False
-                if len(folders) == 0:
-                    if not skip_dir:
-                        delete(path)
-    except StopIteration:
-        pass
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError:
+        return [], False
+
+    for entry in entries:
+        if entry.is_symlink():
+            if os.path.exists(entry.path):
+                kept.append(entry.name)
+            else:
+                removable.append(entry.path) # broken symlink
+        elif entry.is_dir():
+            sub_removable, empty = prune(entry.path)
+            if empty:
+                removable.append(entry.path)
+            else:
+                removable += sub_removable
+                kept.append(entry.name)
+        else:
+            kept.append(entry.name)
+
+    if theme_dir and 'index.theme' in kept:
+        # Remove gtk index if gtk theme is deleted
+        no_gtk = 'share/themes' in directory and 'gtk-3.0' not in kept and 'gtk-4.0' not in kept
+        if kept == ['index.theme'] or no_gtk:
+            kept.remove('index.theme')
+            removable.append(f'{directory}/index.theme')
+
+    if theme_dir and 'icon-theme.cache' in kept and 'index.theme' not in kept:
+        # The cache isn't in the manifests, since it is generated after the theme is installed
+        kept.remove('icon-theme.cache')
+        removable.append(f'{directory}/icon-theme.cache')
+
+    return removable, len(kept) == 0
+
+def remove_empty():
+    '''
+    Removes empty theme directories, broken symlinks and orphaned index.theme files, all in one batch.
+    '''
+    removing = []
+    for path in dict.fromkeys(installed(just_theme_dirs = True)):
+        if os.path.islink(path) or not os.path.isdir(path):
+            continue
+        removable, empty = prune(path, True)
+        if empty:
+            removing.append(path)
+        else:
+            removing += removable
+    if len(removing) > 0:
+        delete(*removing)
 
 def remove_theme(name, pretty, paths, old = False, disconnect = True, override_verbose = None, no_symlinks = False):
     '''
@@ -145,15 +184,12 @@ def remove_theme(name, pretty, paths, old = False, disconnect = True, override_v
     snap = ('dg-adw-gtk3-theme',) if old else ('qualia-gtk-theme', 'dg-adw-gtk3-theme')
 
     if not dry_run:
-        if name == 'snap' and shutil.which('snap') is not None:
-            for i in snap:
-                snap_list = subprocess.run(['sudo', 'snap', 'list'], stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').split('\n')
-                for line in snap_list:
-                    line = line.split()
-                    if i in line:
-                        print(message)
-                        subprocess.run(['sudo', 'snap', 'remove', i], check=True)
-                        return
+        if name == 'snap' and snapd.available():
+            removing = [i for i in snap if i in snapd.snaps()]
+            if len(removing) > 0:
+                print(message)
+                snapd.apply([snapd.snaps_request('remove', removing)])
+                return
 
     if name != 'snap':
         if isinstance(paths[name], list):
@@ -168,16 +204,13 @@ def remove_theme(name, pretty, paths, old = False, disconnect = True, override_v
                     shown = True
                     delete(path)
 
-    if disconnect and not dry_run:
-        for i in snap:
-            if name in ('gtk3', 'icons', 'sounds') and shutil.which('snap') is not None:
-                connections = subprocess.run(['sudo', 'snap', 'connections'], stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').strip().split('\n')
-                for line in connections:
-                    line = line.split()
-                    for key, value in {'gtk3': 'gtk-3', 'icons': 'icon', 'sounds': 'sound'}.items():
-                        if key == name:
-                            if line[2] == f'{i}:{value}-themes':
-                                subprocess.run(['sudo', 'snap', 'disconnect', line[1], f'{i}:{value}-themes'], check=True)
+    if disconnect and not dry_run and name in ('gtk3', 'icons', 'sounds') and snapd.available():
+        slot = {'gtk3': 'gtk-3', 'icons': 'icon', 'sounds': 'sound'}[name] + '-themes'
+        requests = []
+        for plug_snap, plug, slot_snap, connected_slot in snapd.connections():
+            if slot_snap in snap and connected_slot == slot:
+                requests.append(snapd.interface_request('disconnect', plug_snap, plug, slot_snap, slot))
+        snapd.apply(requests)
 
 def enable_old(config, themes):
     '''
@@ -200,7 +233,7 @@ def enable_old(config, themes):
                     kwargs[de][theme] = name
 
     for de, kwargs in kwargs.items():
-        enable = Enable(config, verbose, **kwargs)
+        enable = Enable(config, verbose, dry_run, **kwargs)
         enable.enable_theme(de, True)
 
 def main():
@@ -249,8 +282,10 @@ def main():
     if len(args) <= 1:
         uninstalling = available_themes
 
-    # Enable old themes
-    if os.path.isfile(CONFIG) and not dry_run:
+    snapd.verbose = verbose
+
+    # Enable old themes, in dry run mode this only prints the changes
+    if store.exists():
         conf = Config()
 
         conf.read()
@@ -260,29 +295,35 @@ def main():
         if 'enabled' in config:
             enable_old(config, uninstalling)
 
-    # Remove theme
-    for i in uninstalling:
-        remove_theme(i, available_themes[i], paths)
-        remove_config(i)
-
-    # Cleanup config file
-    if os.path.isfile(CONFIG) and not dry_run:
-        new_conf = Config()
-        new_conf.read()
-        config = new_conf.ret_config()
+    with store.batch():
+        # Remove theme
+        for i in uninstalling:
+            remove_theme(i, available_themes[i], paths)
+            remove_config(i)
 
         # Remove version of theme from config file if it is fully uninstalled
-        if 'enabled' in config and len(config['enabled']) > 0:
+        enabled = store.get('enabled', [])
+        if len(enabled) > 0:
             for theme in VARIANTS['enableable']:
-                found = False
-                for part in config['enabled']:
-                    if part in VARIANTS['enableable'][theme]:
-                        found = True
-                if not found:
+                if not any(part in VARIANTS['enableable'][theme] for part in enabled):
                     remove_config(theme, True)
-        else:
-            os.remove(CONFIG) # Remove config file if nothing is enabled
+
+    # Remove config file and the build cache if nothing is enabled
+    if store.exists() and not dry_run and len(store.get('enabled', [])) == 0:
+        store.delete()
+        fingerprints.delete()
+        if verbose:
+            print('Deleting ' + CACHE_DIR)
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
 
     remove_empty()
+
+    # Icon themes that had parts removed still have them in their caches
+    try:
+        for theme, seconds in iconcache.update(verbose, dry_run):
+            print(f'Regenerated the icon cache of {os.path.basename(theme)} in {os.path.dirname(theme)} in {seconds:.2f}s')
+    except PrivilegedError as error:
+        print(f'{BRED}Regenerating the icon caches failed:{NC}\n{error}')
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,191 @@
+'''This module is for reading and changing Xfconf properties.'''
+import shutil
+import subprocess
+
+import tracing
+
+try:
+    from gi.repository import Gio, GLib
+except ImportError:
+    Gio = None
+
+BUS_NAME = 'org.xfce.Xfconf'
+OBJECT_PATH = '/org/xfce/Xfconf'
+INTERFACE = 'org.xfce.Xfconf'
+DBUS_NAME = 'org.freedesktop.DBus'
+DBUS_PATH = '/org/freedesktop/DBus'
+
+class Xfconf:
+    '''
+    Reads and changes Xfconf properties through one D-Bus session connection.
+
+    Every property of a channel is read in one call, and changes are queued by set and only
+    written by apply if they differ from the current value. The xfconf-query command is used
+    instead if Gio isn't available, or if Xfconf stops answering on the bus.
+
+    Attributes:
+        verbose (bool) : Print the changes that are made.
+        dry_run (bool) : Print the changes that would be made, without making them.
+        address (str) : Address of the bus to connect to, used to test against a stand-in service. Defaults to the session bus.
+    '''
+    _values = {} # {channel: {property: value}}, shared by all instances connected to the session bus
+    _types = {} # {channel: {property: GVariant type string}}
+
+    def __init__(self, verbose = False, dry_run = False, address = None):
+        self.verbose = verbose
+        self.dry_run = dry_run
+        self.address = address
+        self.connection = None
+        self.bus = None # if Xfconf is on the bus, checked by available
+        self.pending = {} # {channel: {property: value}}
+        if address is not None:
+            self._values = {}
+            self._types = {}
+
+    def available(self):
+        '''
+        Returns:
+            available (bool) : Whether or not Xfconf is running or can be started on the bus, or xfconf-query is installed if Gio isn't available.
+        '''
+        if Gio is None:
+            return shutil.which('xfconf-query') is not None
+        if self.bus is None:
+            try:
+                names = self._call('ListNames', bus_name=DBUS_NAME, object_path=DBUS_PATH, interface=DBUS_NAME).unpack()[0]
+                if BUS_NAME not in names:
+                    names = self._call('ListActivatableNames', bus_name=DBUS_NAME, object_path=DBUS_PATH, interface=DBUS_NAME).unpack()[0]
+                self.bus = BUS_NAME in names
+            except GLib.Error:
+                self.bus = False
+        return self.bus
+
+    def _on_bus(self):
+        return Gio is not None and self.bus is not False
+
+    def _run(self, command):
+        if self.verbose:
+            print("Running command '" + ' '.join(command) + "'")
+        with tracing.command(command) as info:
+            output = subprocess.run(command, stdout=subprocess.PIPE, check=False)
+            info['exit code'] = output.returncode
+        output.check_returncode()
+        return output.stdout.decode('utf-8')
+
+    def _call(self, method, parameters = None, bus_name = BUS_NAME, object_path = OBJECT_PATH, interface = INTERFACE):
+        if self.connection is None:
+            if self.address is None:
+                self.connection = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+            else:
+                flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+                self.connection = Gio.DBusConnection.new_for_address_sync(self.address, flags, None, None)
+        return self.connection.call_sync(bus_name, object_path, interface, method, parameters, None, Gio.DBusCallFlags.NONE, -1, None)
+
+    def channels(self):
+        '''
+        Returns:
+            channels (list) : The names of the channels.
+        '''
+        if self._on_bus():
+            try:
+                return list(self._call('ListChannels').unpack()[0])
+            except GLib.Error as error:
+                # xfconfd isn't running and couldn't be started, so use xfconf-query from now on
+                if self.verbose:
+                    print(f'Xfconf is not answering on the bus, using xfconf-query instead: {error.message}')
+                self.bus = False
+        if shutil.which('xfconf-query') is None:
+            return []
+        return [i.strip() for i in self._run(['xfconf-query', '-l']).split('\n')[1:] if i.strip() != '']
+
+    def read(self, *channels):
+        '''
+        Read every property of the channels that haven't been read yet.
+
+        Parameters:
+            channels (str) : The channels to read.
+        '''
+        for channel in channels:
+            if channel in self._values:
+                continue
+            values = {}
+            types = {}
+            if self._on_bus():
+                try:
+                    properties = self._call('GetAllProperties', GLib.Variant('(ss)', (channel, '/'))).get_child_value(0)
+                except GLib.Error:
+                    properties = GLib.Variant('a{sv}', {})
+                # Read the entries one by one instead of unpacking, so the types of the values are kept
+                for i in range(properties.n_children()):
+                    entry = properties.get_child_value(i)
+                    prop = entry.get_child_value(0).get_string()
+                    value = entry.get_child_value(1).get_variant()
+                    types[prop] = value.get_type_string()
+                    value = value.unpack()
+                    values[prop] = str(value).lower() if isinstance(value, bool) else str(value)
+            else:
+                try:
+                    output = self._run(['xfconf-query', '-c', channel, '-l', '-v'])
+                except (subprocess.CalledProcessError, OSError):
+                    output = ''
+                for line in output.split('\n'):
+                    line = line.split(None, 1)
+                    if len(line) > 0:
+                        values[line[0]] = line[1] if len(line) > 1 else ''
+            self._values[channel] = values
+            self._types[channel] = types
+
+    def get(self, channel, prop):
+        '''
+        Get the value of a property, including changes that haven't been applied yet.
+
+        Parameters:
+            channel (str) : The channel of the property.
+            prop (str) : The property to get.
+
+        Returns:
+            value (str) : The value, empty if the property doesn't exist.
+        '''
+        if prop in self.pending.get(channel, {}):
+            return self.pending[channel][prop]
+        self.read(channel)
+        return self._values[channel].get(prop, '')
+
+    def set(self, channel, prop, value):
+        '''
+        Queue a change to a property, it is written by apply if it differs from the current value.
+
+        Parameters:
+            channel (str) : The channel of the property.
+            prop (str) : The property to change.
+            value (str) : The new value.
+        '''
+        self.read(channel)
+        if self._values[channel].get(prop) == value:
+            self.pending.get(channel, {}).pop(prop, None)
+        else:
+            self.pending.setdefault(channel, {})[prop] = value
+
+    def plan(self):
+        '''
+        Returns:
+            changes (list) : [(channel, property, old value, new value), ...] the changes that apply would make.
+        '''
+        return [(channel, prop, self._values[channel].get(prop, ''), value) for channel, changes in self.pending.items() for prop, value in changes.items()]
+
+    def apply(self):
+        '''Writes all of the queued changes, or prints them in dry run mode.'''
+        changes = self.plan()
+        self.pending = {}
+        for channel, prop, old, value in changes:
+            if self.dry_run:
+                print(f"Would change '{prop}' in the '{channel}' channel from '{old}' to '{value}'")
+                continue
+            if self._on_bus():
+                value_type = self._types[channel].get(prop, 's')
+                variant = GLib.Variant('s', value) if value_type == 's' else GLib.Variant.parse(GLib.VariantType(value_type), value, None, None)
+                if self.verbose:
+                    print(f"Setting '{prop}' in the '{channel}' channel to '{value}'")
+                self._call('SetProperty', GLib.Variant('(ssv)', (channel, prop, variant)))
+            else:
+                self._run(['xfconf-query', '-c', channel, '-p', prop, '-s', value])
+            self._values[channel][prop] = value